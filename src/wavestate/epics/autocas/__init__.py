@@ -7,20 +7,26 @@
 # with details inline in source files, comments, and docstrings.
 """
 """
+import time as _time
+
+# for the --profile-startup report of CAS9CmdLine
+_import_mtime_start = _time.perf_counter()
+
 from ._version import version, __version__, version_info
 
 from .cascore import (
     Reactor,
+    AsyncioReactor,
     CASUser,
     InstaCAS,
     CAS9CmdLine,
     CAS9Module,
-    CADriverServer,
     RelayValueFloat,
     RelayValueFloatLowHighMod,
     RelayValueInt,
     RelayValueString,
     RelayValueLongString,
+    RelayValueWaveform,
     RelayValueEnum,
     RelayValueCoerced,
     RelayValueRejected,
@@ -37,9 +43,19 @@ from .cascore import (
     mproperty,
 )
 
+_import_time_s = _time.perf_counter() - _import_mtime_start
 
 # __all__ = [
 #     "version",
 #     "__version__",
 #     "version_info",
 # ]
+
+
+def __getattr__(name):
+    # loaded lazily, see cascore.__getattr__
+    if name == "CADriverServer":
+        from .cascore import CADriverServer
+
+        return CADriverServer
+    raise AttributeError("module {0} has no attribute {1}".format(__name__, name))
@@ -10,6 +10,7 @@
 
 
 from .reactor import Reactor
+from .asyncio_reactor import AsyncioReactor
 
 from .cascore import (
     CASUser,
@@ -28,16 +29,13 @@ from .cas9program import (
     CAS9Module,
 )
 
-from .pcaspy_backend import (
-    CADriverServer,
-)
-
 from .relay_values import (
     RelayValueFloat,
     RelayValueFloatLowHighMod,
     RelayValueInt,
     RelayValueString,
     RelayValueLongString,
+    RelayValueWaveform,
     RelayValueEnum,
     RelayValueCoerced,
     RelayValueRejected,
@@ -50,3 +48,12 @@ from .relay_values import (
     RelayBoolNotAll,
     RelayBoolNotAny,
 )
+
+
+def __getattr__(name):
+    # the backends load the CA libraries, so are only imported when used
+    if name == "CADriverServer":
+        from .pcaspy_backend import CADriverServer
+
+        return CADriverServer
+    raise AttributeError("module {0} has no attribute {1}".format(__name__, name))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Reactor variant that drives its queue from an asyncio event loop, so that tasks
+may be coroutines and asyncio based I/O (streams, subprocesses, sockets) can live
+alongside the usual callbacks and looping tasks.
+"""
+import asyncio
+import contextlib
+import selectors
+import threading
+import traceback
+
+from . import reactor
+
+
+class _TaskLockSelector(selectors.DefaultSelector):
+    """
+    Selector that releases the reactor's queue and task locks only while it
+    polls or waits for I/O or a timeout. The event loop thread otherwise holds
+    the task_lock, so callbacks and coroutine steps run under the same lock as
+    ordinary reactor tasks and other threads may only touch RelayValues between
+    iterations of the loop.
+    """
+
+    def __init__(self, reactor):
+        super(_TaskLockSelector, self).__init__()
+        self._reactor = reactor
+
+    def select(self, timeout=None):
+        # also released around the zero-timeout polls made while callbacks are ready,
+        # else a loop that is never idle would starve other threads of the task_lock
+        r = self._reactor
+        r._task_waiting = True
+        r.task_lock.release()
+        r._queue_lock.release()
+        try:
+            return super(_TaskLockSelector, self).select(timeout)
+        finally:
+            r._queue_lock.acquire()
+            r.task_lock.acquire()
+            r._task_waiting = False
+
+
+class AsyncioReactor(reactor.Reactor):
+    """
+    A Reactor whose flush and run_reactor run an asyncio event loop. Tasks keep
+    the same send_task/enqueue/enqueue_looping semantics, and any task that
+    returns a coroutine has it scheduled on the loop. Sends from other threads
+    wake the loop through call_soon_threadsafe.
+
+    Coroutines only make progress while the reactor is flushing or running.
+    Those still pending when run_reactor finishes are cancelled.
+    """
+
+    def __init__(self, task_lock=None, **kwargs):
+        super(AsyncioReactor, self).__init__(task_lock=task_lock, **kwargs)
+        self.loop = asyncio.SelectorEventLoop(_TaskLockSelector(self))
+        self._wake_event = None
+        self._wake_pending = False
+        # strong references to running coroutine tasks, as the loop only holds weak ones
+        self._coro_tasks = set()
+        return
+
+    def run_reactor(self):
+        self._queue_lock.acquire()
+        self._current_reactor_thread = threading.current_thread()
+        try:
+            self.loop.run_until_complete(self._drive())
+            # slurp up remaining tasks
+            while True:
+                with self._task_cv:
+                    batch = [
+                        pair
+                        for pair in self._task_deque
+                        if pair[1] is not reactor._EXIT
+                    ]
+                    self._task_deque.clear()
+                if not batch:
+                    break
+                self._run_batch(batch)
+            self._cancel_coroutines()
+        finally:
+            self._current_reactor_thread = None
+            self._queue_lock.release()
+        return
+
+    def flush(
+        self,
+        for_s=None,
+        modulo_s=None,
+        mtime_to=None,
+    ):
+        mtime_to = self._flush_mtime_to(
+            for_s=for_s,
+            modulo_s=modulo_s,
+            mtime_to=mtime_to,
+        )
+        # if mtime_to is None at this point, then it means to flush and quit immediately
+
+        self._queue_lock.acquire()
+        self._current_reactor_thread = threading.current_thread()
+        try:
+            self.loop.run_until_complete(
+                self._drive(mtime_to=mtime_to, block=mtime_to is not None)
+            )
+        finally:
+            self._current_reactor_thread = None
+            self._queue_lock.release()
+        return
+
+    async def _drive(self, mtime_to=None, block=True):
+        if self._wake_event is None:
+            self._wake_event = asyncio.Event()
+        event = self._wake_event
+        while True:
+            # cleared before looking at the queue so that a send racing with
+            # the check still leaves the event set
+            event.clear()
+            with self._task_cv:
+                mtime = self.clock()
+                batch = self._pop_ready(mtime)
+                if not batch:
+                    wait_s = self._wait_s(mtime, mtime_to)
+
+            if batch:
+                do_exit = batch[-1][1] is reactor._EXIT
+                if do_exit:
+                    batch.pop()
+                self._run_batch(batch)
+                if do_exit:
+                    return
+                # a queue that is never empty must not keep a timed flush running
+                if mtime_to is not None and self.clock() >= mtime_to:
+                    return
+                # give coroutines, I/O callbacks and, through _TaskLockSelector,
+                # other threads a turn between batches
+                await asyncio.sleep(0)
+                continue
+
+            if mtime_to is not None:
+                if mtime >= mtime_to:
+                    return
+            elif not block:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), wait_s)
+            except asyncio.TimeoutError:
+                pass
+
+    def _batch_lock(self):
+        # the loop thread already holds the task_lock, see _TaskLockSelector
+        return contextlib.nullcontext()
+
+    def _item_returned(self, ret):
+        if asyncio.iscoroutine(ret):
+            task = self.loop.create_task(ret)
+            self._coro_tasks.add(task)
+            task.add_done_callback(self._coroutine_done)
+        return
+
+    def _coroutine_done(self, task):
+        self._coro_tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            # TODO, log better
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+        return
+
+    def _cancel_coroutines(self):
+        tasks = list(self._coro_tasks)
+        if not tasks:
+            return
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True)
+        )
+        return
+
+    def _wake(self):
+        event = self._wake_event
+        if event is None:
+            # the loop has never run, the first _drive will check the queue
+            return
+        if threading.current_thread() is self._current_reactor_thread:
+            event.set()
+        elif not self._wake_pending:
+            # coalesce wakes from other threads into one loop callback
+            self._wake_pending = True
+            self.loop.call_soon_threadsafe(self._wake_threadsafe)
+        return
+
+    def _wake_threadsafe(self):
+        with self._task_cv:
+            self._wake_pending = False
+        self._wake_event.set()
+        return
@@ -11,8 +11,6 @@
 
 from wavestate import declarative
 import numpy as np
-import pcaspy
-import pcaspy.tools
 
 from . import relay_values
 
@@ -32,7 +30,16 @@ class CASCollector(declarative.OverridableObject):
         """
         return {}
 
+    # the last generated db, cleared as channels are hosted
+    _db_generated_memo = None
+
     def cas_db_generate(self):
+        """
+        Generate the PV db, mapping channel names to their settings dictionaries. The
+        db is memoized until another channel is hosted, so callers must not modify it.
+        """
+        if self._db_generated_memo is not None:
+            return self._db_generated_memo
         db_gen = dict()
         for rv, db_entry in self.rv_db.items():
             name = self.rv_names.get(rv, None)
@@ -43,6 +50,7 @@ class CASCollector(declarative.OverridableObject):
             dcopy = dict(db_entry)
             dcopy["rv"] = rv
             db_gen[name] = dcopy
+        self._db_generated_memo = db_gen
         return db_gen
 
     def prefix2channel(self, prefix):
@@ -82,6 +90,9 @@ class CASCollector(declarative.OverridableObject):
         urgentsave_s=None,
         deferred=False,
         remote=False,
+        # throttles the RelayValue callbacks to the backends, see relay_throttle
+        max_rate_hz=None,
+        deadband=None,
         # **kwargs
     ):
         # TODO, need some way to check that multiple PV's of the same name are not registered
@@ -189,6 +200,8 @@ class CASCollector(declarative.OverridableObject):
             remote=remote,
             deferred=deferred,
             interaction=interaction,
+            max_rate_hz=max_rate_hz,
+            deadband=deadband,
         )
         for k, v in db_inj.items():
             if v is not None:
@@ -216,6 +229,8 @@ class CASCollector(declarative.OverridableObject):
             ctree_check("remote", bool)
             ctree_check("deferred", bool)
             ctree_check("interaction", check_interaction)
+            ctree_check("max_rate_hz", float)
+            ctree_check("deadband", float)
 
             if dtype in ["float", "int"]:
                 if db.get("count", None) is None:
@@ -230,8 +245,16 @@ class CASCollector(declarative.OverridableObject):
                     ctree_check("hihi", float)
                     ctree_check("burt", bool)
                     ctree_check("burtRO", bool)
+                elif isinstance(rv, relay_values.RelayValueWaveform):
+                    max_length = cdb.get_configured(
+                        "max_length",
+                        default=rv.max_length,
+                        about="Number of elements allocated for the waveform",
+                    )
+                    rv.max_length_set(max_length)
+                    db["count"] = rv.max_length
                 else:
-                    # nothing for waveforms
+                    # nothing for other waveforms
                     # TODO, allow waveforms
                     #
                     pass
@@ -270,4 +293,5 @@ class CASCollector(declarative.OverridableObject):
         else:
             raise RuntimeError("Type Not Recognized")
         self.rv_db[rv] = db
+        self._db_generated_memo = None
         return
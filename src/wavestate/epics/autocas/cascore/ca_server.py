@@ -0,0 +1,1075 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Pure-Python Channel Access server running on asyncio.
+
+This implements the subset of the pcaspy SimpleServer, Driver and ServerThread
+interfaces used by the CAS drivers, so that channels may be hosted without the
+EPICS libraries. It serves the CA protocol (minor version 13) over TCP with UDP
+name resolution and beacons, configured from the usual EPICS_CAS_* and EPICS_CA_*
+environment variables.
+
+Monitor events are queued per client connection, keeping only the latest event
+of each subscription, and the queue of each client is written to its socket in
+a single write once per loop iteration. While a slow client's write buffer is
+full, its events keep coalescing and are written once the buffer drains.
+"""
+import os
+import time
+import socket
+import struct
+import asyncio
+import collections
+import threading
+import traceback
+
+import numpy as np
+
+
+CA_MINOR_VERSION = 13
+CA_SERVER_PORT = 5064
+CA_REPEATER_PORT = 5065
+# seconds between the UNIX and EPICS epochs
+EPICS_EPOCH_UNIX = 631152000
+
+CA_PROTO_VERSION = 0
+CA_PROTO_EVENT_ADD = 1
+CA_PROTO_EVENT_CANCEL = 2
+CA_PROTO_READ = 3
+CA_PROTO_WRITE = 4
+CA_PROTO_SEARCH = 6
+CA_PROTO_EVENTS_OFF = 8
+CA_PROTO_EVENTS_ON = 9
+CA_PROTO_READ_SYNC = 10
+CA_PROTO_ERROR = 11
+CA_PROTO_CLEAR_CHANNEL = 12
+CA_PROTO_RSRV_IS_UP = 13
+CA_PROTO_NOT_FOUND = 14
+CA_PROTO_READ_NOTIFY = 15
+CA_PROTO_CREATE_CHAN = 18
+CA_PROTO_WRITE_NOTIFY = 19
+CA_PROTO_CLIENT_NAME = 20
+CA_PROTO_HOST_NAME = 21
+CA_PROTO_ACCESS_RIGHTS = 22
+CA_PROTO_ECHO = 23
+CA_PROTO_CREATE_CH_FAIL = 26
+
+ECA_NORMAL = 1
+ECA_BADTYPE = 114
+ECA_PUTFAIL = 160
+ECA_BADCOUNT = 176
+ECA_BADCHID = 410
+
+DBE_VALUE = 1
+DBE_LOG = 2
+DBE_ALARM = 4
+DBE_PROPERTY = 8
+
+DBR_STRING = 0
+DBR_SHORT = 1
+DBR_FLOAT = 2
+DBR_ENUM = 3
+DBR_CHAR = 4
+DBR_LONG = 5
+DBR_DOUBLE = 6
+DBR_STSACK_STRING = 37
+DBR_CLASS_NAME = 38
+
+NO_ALARM = 0
+MINOR_ALARM = 1
+MAJOR_ALARM = 2
+INVALID_ALARM = 3
+
+WRITE_ALARM = 2
+HIHI_ALARM = 3
+HIGH_ALARM = 4
+LOLO_ALARM = 5
+LOW_ALARM = 6
+STATE_ALARM = 7
+
+MAX_STRING_SIZE = 40
+MAX_ENUM_STRING_SIZE = 26
+MAX_ENUM_STATES = 16
+
+_header = struct.Struct(">HHHHII")
+_header_ext = struct.Struct(">HHHHIIII")
+
+# the native DBR type of each pcaspy type name
+native_dbr_types = {
+    "float": DBR_DOUBLE,
+    "int": DBR_LONG,
+    "short": DBR_SHORT,
+    "enum": DBR_ENUM,
+    "string": DBR_STRING,
+    "str": DBR_STRING,
+    "char": DBR_CHAR,
+}
+
+_value_dtypes = {
+    DBR_SHORT: np.dtype(">i2"),
+    DBR_FLOAT: np.dtype(">f4"),
+    DBR_ENUM: np.dtype(">u2"),
+    DBR_CHAR: np.dtype("u1"),
+    DBR_LONG: np.dtype(">i4"),
+    DBR_DOUBLE: np.dtype(">f8"),
+}
+
+# padding between the metadata and the value of the DBR_STS and DBR_TIME types
+_sts_pad = {DBR_CHAR: 1, DBR_DOUBLE: 4}
+_time_pad = {DBR_SHORT: 2, DBR_ENUM: 2, DBR_CHAR: 3, DBR_DOUBLE: 4}
+
+# limits of the DBR_GR and DBR_CTRL types, with the struct code of the limit values
+_limit_codes = {
+    DBR_SHORT: "h",
+    DBR_FLOAT: "f",
+    DBR_CHAR: "B",
+    DBR_LONG: "i",
+    DBR_DOUBLE: "d",
+}
+
+
+def message(command, payload=b"", data_type=0, data_count=0, p1=0, p2=0):
+    """
+    Encode a CA message, padding the payload to 8 bytes and using the extended
+    header for large payloads.
+    """
+    pad = -len(payload) % 8
+    if pad:
+        payload = payload + b"\0" * pad
+    size = len(payload)
+    if size >= 0xFFFF or data_count >= 0xFFFF:
+        header = _header_ext.pack(
+            command, 0xFFFF, data_type, 0, p1, p2, size, data_count
+        )
+    else:
+        header = _header.pack(command, size, data_type, data_count, p1, p2)
+    return header + payload
+
+
+def _string_encode(val, size=MAX_STRING_SIZE):
+    if isinstance(val, bytes):
+        raw = val
+    else:
+        raw = str(val).encode("utf-8")
+    raw = raw[: size - 1]
+    return raw + b"\0" * (size - len(raw))
+
+
+def _string_decode(raw):
+    return raw.split(b"\0", 1)[0].decode("utf-8", "replace")
+
+
+class SimplePV(object):
+    """
+    A hosted channel, its value, alarm state and metadata (the pcaspy info
+    dictionary), and its subscriptions.
+    """
+
+    def __init__(self, name, reason, info):
+        self.name = name
+        self.reason = reason
+        self.info = dict(info)
+        self.type = self.info.get("type", "float")
+        self.dbr_type = native_dbr_types[self.type]
+        self.count = self.info.get("count", 1)
+        if self.type in ["string", "str", "char"]:
+            default = ""
+        else:
+            default = 0
+        if self.count > 1 and self.type != "char":
+            default = [default] * self.count
+        self.value = self.info.get("value", default)
+        self.mlst = self.value
+        self.alst = self.value
+        self.alarm = NO_ALARM
+        self.severity = NO_ALARM
+        self.time = time.time()
+        self.mask = 0
+        self.flag = False
+        # subscription id -> _Subscription
+        self.subs = dict()
+        # write notifies pending the completion of an asynchronous write
+        self.notifies = collections.deque()
+        # the write notify of the write being passed to Driver.write, if any
+        self.notify_write = None
+        return
+
+    def check_value(self, value):
+        """
+        The event mask of a new value, applying the monitor and archive deadbands to numeric scalars
+        """
+        if self.count > 1 or isinstance(value, np.ndarray):
+            return DBE_VALUE | DBE_LOG
+        mask = 0
+        if self.dbr_type == DBR_STRING or self.type == "char":
+            if self.mlst != value:
+                mask |= DBE_VALUE
+                self.mlst = value
+            if self.alst != value:
+                mask |= DBE_LOG
+                self.alst = value
+            return mask
+        try:
+            if abs(self.mlst - value) > self.info.get("mdel", 0):
+                mask |= DBE_VALUE
+                self.mlst = value
+            if abs(self.alst - value) > self.info.get("adel", 0):
+                mask |= DBE_LOG
+                self.alst = value
+        except TypeError:
+            mask = DBE_VALUE | DBE_LOG
+            self.mlst = value
+            self.alst = value
+        return mask
+
+    def check_alarm(self, value):
+        info = self.info
+        if self.dbr_type == DBR_ENUM:
+            states = info.get("states", [])
+            if not states:
+                return NO_ALARM, NO_ALARM
+            if 0 <= value < len(states):
+                severity = states[value]
+                return (NO_ALARM if severity == NO_ALARM else STATE_ALARM), severity
+            return STATE_ALARM, MAJOR_ALARM
+        if self.dbr_type == DBR_STRING or self.type == "char":
+            return NO_ALARM, NO_ALARM
+
+        alarm = NO_ALARM
+        severity = NO_ALARM
+        try:
+            vmin = np.min(value)
+            vmax = np.max(value)
+        except (TypeError, ValueError):
+            return alarm, severity
+        low = info.get("low", 0)
+        high = info.get("high", 0)
+        if low < high:
+            if vmin <= low:
+                alarm, severity = LOW_ALARM, MINOR_ALARM
+            elif vmax >= high:
+                alarm, severity = HIGH_ALARM, MINOR_ALARM
+        lolo = info.get("lolo", 0)
+        hihi = info.get("hihi", 0)
+        if lolo < hihi:
+            if vmin <= lolo:
+                alarm, severity = LOLO_ALARM, MAJOR_ALARM
+            elif vmax >= hihi:
+                alarm, severity = HIHI_ALARM, MAJOR_ALARM
+        return alarm, severity
+
+    def _strings(self, value):
+        """
+        The value as a list of strings, for DBR_STRING requests
+        """
+        if self.dbr_type == DBR_ENUM:
+            enums = self.info.get("enums", [])
+            idx = int(value)
+            if 0 <= idx < len(enums):
+                return [enums[idx]]
+            return [str(idx)]
+        if self.dbr_type == DBR_STRING or self.type == "char":
+            if isinstance(value, (list, tuple, np.ndarray)):
+                return [str(v) for v in value]
+            return [str(value)]
+        prec = self.info.get("prec", None)
+        vals = np.atleast_1d(value)
+        if self.dbr_type in (DBR_DOUBLE, DBR_FLOAT) and prec is not None:
+            fmt = "{0:." + str(int(prec)) + "f}"
+            return [fmt.format(v) for v in vals.tolist()]
+        return [repr(v) for v in vals.tolist()]
+
+    def _numeric(self, value):
+        """
+        The value as a 1-dimensional array, for the numeric DBR types
+        """
+        if self.type == "char" and isinstance(value, str):
+            return np.frombuffer(value.encode("utf-8") + b"\0", dtype="u1")
+        if self.dbr_type == DBR_STRING:
+            vals = []
+            for v in np.atleast_1d(value).tolist():
+                try:
+                    vals.append(float(v))
+                except ValueError:
+                    vals.append(0.0)
+            return np.asarray(vals)
+        return np.atleast_1d(np.asarray(value))
+
+    def encode(self, dbr_type, count):
+        """
+        The payload of the value and metadata as the DBR type, and the count of elements in it.
+        Raises ValueError for unsupported types.
+        """
+        if dbr_type == DBR_CLASS_NAME:
+            return _string_encode("autocas"), 1
+        if dbr_type == DBR_STSACK_STRING:
+            strs = self._strings(self.value)
+            meta = struct.pack(">hhHH", self.alarm, self.severity, 0, 0)
+            return meta + _string_encode(strs[0] if strs else ""), 1
+        if not 0 <= dbr_type <= 34:
+            raise ValueError("unsupported DBR type {0}".format(dbr_type))
+        kind, base = divmod(dbr_type, 7)
+
+        value = self.value
+        if base == DBR_STRING:
+            vals = self._strings(value)
+        else:
+            vals = self._numeric(value)
+        N = len(vals)
+        if count == 0 or count is None:
+            count = N
+        if base == DBR_STRING:
+            vals = list(vals[:count]) + [""] * (count - min(N, count))
+            raw = b"".join(_string_encode(v) for v in vals)
+        else:
+            dtype = _value_dtypes[base]
+            if dtype.kind in "iu" and vals.dtype.kind not in "iub":
+                ii = np.iinfo(dtype)
+                vals = np.clip(np.round(np.nan_to_num(vals.astype(float))), ii.min, ii.max)
+            arr = np.zeros(count, dtype=dtype)
+            M = min(N, count)
+            arr[:M] = vals[:M]
+            raw = arr.tobytes()
+
+        if kind == 0:
+            return raw, count
+        if kind == 1:
+            meta = struct.pack(">hh", self.alarm, self.severity)
+            meta += b"\0" * _sts_pad.get(base, 0)
+            return meta + raw, count
+        if kind == 2:
+            secs = int(self.time)
+            meta = struct.pack(
+                ">hhII",
+                self.alarm,
+                self.severity,
+                max(secs - EPICS_EPOCH_UNIX, 0),
+                int((self.time - secs) * 1e9),
+            )
+            meta += b"\0" * _time_pad.get(base, 0)
+            return meta + raw, count
+        return self._encode_graphic(kind, base) + raw, count
+
+    def _encode_graphic(self, kind, base):
+        """
+        The metadata of the DBR_GR (kind 3) and DBR_CTRL (kind 4) types
+        """
+        info = self.info
+        if base == DBR_STRING:
+            return struct.pack(">hh", self.alarm, self.severity)
+        if base == DBR_ENUM:
+            enums = info.get("enums", [])[:MAX_ENUM_STATES]
+            strs = b"".join(_string_encode(e, MAX_ENUM_STRING_SIZE) for e in enums)
+            strs += b"\0" * (MAX_ENUM_STRING_SIZE * (MAX_ENUM_STATES - len(enums)))
+            return struct.pack(">hhh", self.alarm, self.severity, len(enums)) + strs
+
+        limits = [
+            info.get("hilim", 0),
+            info.get("lolim", 0),
+            info.get("hihi", 0),
+            info.get("high", 0),
+            info.get("low", 0),
+            info.get("lolo", 0),
+        ]
+        if kind == 4:
+            limits += [info.get("hilim", 0), info.get("lolim", 0)]
+        code = _limit_codes[base]
+        if code in "hBi":
+            limits = [int(v) for v in limits]
+        units = _string_encode(info.get("unit", ""), 8)
+        limits = struct.pack(">{0}{1}".format(len(limits), code), *limits)
+        if base in (DBR_FLOAT, DBR_DOUBLE):
+            meta = struct.pack(
+                ">hhhh", self.alarm, self.severity, int(info.get("prec", 0) or 0), 0
+            )
+            return meta + units + limits
+        meta = struct.pack(">hh", self.alarm, self.severity) + units + limits
+        if base == DBR_CHAR:
+            meta += b"\0"
+        return meta
+
+    def decode(self, dbr_type, count, payload):
+        """
+        Decode a written value into the native type, as pcaspy gives it to Driver.write
+        """
+        if dbr_type == DBR_STRING:
+            strs = [
+                _string_decode(payload[i * MAX_STRING_SIZE : (i + 1) * MAX_STRING_SIZE])
+                for i in range(count)
+            ]
+            if self.dbr_type == DBR_ENUM:
+                enums = self.info.get("enums", [])
+                if strs[0] in enums:
+                    return enums.index(strs[0])
+                return int(float(strs[0]))
+            if self.dbr_type == DBR_STRING or self.type == "char":
+                return strs[0] if count == 1 else strs
+            vals = np.asarray([float(s) for s in strs])
+        elif dbr_type in _value_dtypes:
+            vals = np.frombuffer(payload, dtype=_value_dtypes[dbr_type], count=count)
+            if self.type == "char" or self.dbr_type == DBR_STRING:
+                if dbr_type == DBR_CHAR:
+                    return _string_decode(vals.tobytes())
+                return str(vals[0]) if count == 1 else [str(v) for v in vals]
+        else:
+            raise ValueError("unsupported DBR type for writes {0}".format(dbr_type))
+
+        if self.dbr_type in (DBR_DOUBLE, DBR_FLOAT):
+            if self.count == 1:
+                return float(vals[0])
+            return vals.astype(float)
+        if self.count == 1:
+            return int(vals[0])
+        return vals.astype(int)
+
+
+class _Subscription(object):
+    __slots__ = ("client", "subid", "dbr_type", "count", "mask")
+
+    def __init__(self, client, subid, dbr_type, count, mask):
+        self.client = client
+        self.subid = subid
+        self.dbr_type = dbr_type
+        self.count = count
+        self.mask = mask
+
+
+class _CAClient(asyncio.Protocol):
+    """
+    A client's TCP circuit
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self._buf = bytearray()
+        # sid -> (cid, pv)
+        self.channels = dict()
+        # subid -> (sid, pv)
+        self.subs = dict()
+        self.hostname = ""
+        self.username = ""
+        # monitor events waiting to be written, coalesced by subscription
+        self._lock = threading.Lock()
+        self._events = dict()
+        self._events_scheduled = False
+        self._events_on = True
+        # set by the transport while its write buffer is above the high-water mark
+        self._paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+        self.server._clients.add(self)
+
+    def connection_lost(self, exc):
+        self.server._clients.discard(self)
+        with self.server._lock:
+            for subid, (sid, pv) in self.subs.items():
+                pv.subs.pop((self, subid), None)
+        self.subs.clear()
+        self.channels.clear()
+
+    def send(self, data):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def pause_writing(self):
+        """
+        Hold back monitor events, which then only coalesce, until resume_writing
+        """
+        with self._lock:
+            self._paused = True
+
+    def resume_writing(self):
+        with self._lock:
+            self._paused = False
+        self._events_flush()
+
+    def post(self, subid, data):
+        """
+        Queue a monitor event, replacing any unsent event of the subscription. May be called from any thread.
+        """
+        with self._lock:
+            self._events[subid] = data
+            if self._events_scheduled:
+                return
+            self._events_scheduled = True
+        self.server._loop.call_soon_threadsafe(self._events_flush)
+
+    def _events_flush(self, force=False):
+        """
+        Write the queued events, unless paused or force, which still only writes the
+        latest event of each subscription.
+        """
+        with self._lock:
+            self._events_scheduled = False
+            if not self._events_on or not self._events:
+                return
+            if self._paused and not force:
+                return
+            events = self._events
+            self._events = dict()
+        self.send(b"".join(events.values()))
+
+    def data_received(self, data):
+        buf = self._buf
+        buf += data
+        idx = 0
+        N = len(buf)
+        while N - idx >= 16:
+            command, size, data_type, count, p1, p2 = _header.unpack_from(buf, idx)
+            start = idx + 16
+            if size == 0xFFFF and count == 0:
+                if N - idx < 24:
+                    break
+                size, count = struct.unpack_from(">II", buf, start)
+                start += 8
+            if size > self.server.max_payload:
+                # as the EPICS servers, close the circuit rather than buffering a
+                # message larger than any channel can take
+                del buf[:]
+                self.transport.close()
+                return
+            if N - start < size:
+                break
+            payload = bytes(buf[start : start + size])
+            header = bytes(buf[idx:start])
+            idx = start + size
+            try:
+                self.dispatch(command, data_type, count, p1, p2, payload, header)
+            except Exception:
+                traceback.print_exc()
+        del buf[:idx]
+
+    def error(self, header, cid, status, text):
+        self.send(
+            message(
+                CA_PROTO_ERROR,
+                header[:16] + text.encode("utf-8") + b"\0",
+                p1=cid,
+                p2=status,
+            )
+        )
+
+    def dispatch(self, command, data_type, count, p1, p2, payload, header):
+        server = self.server
+        if command == CA_PROTO_VERSION:
+            self.send(message(CA_PROTO_VERSION, data_count=CA_MINOR_VERSION))
+        elif command == CA_PROTO_HOST_NAME:
+            self.hostname = _string_decode(payload)
+        elif command == CA_PROTO_CLIENT_NAME:
+            self.username = _string_decode(payload)
+        elif command == CA_PROTO_ECHO:
+            self.send(message(CA_PROTO_ECHO))
+        elif command == CA_PROTO_CREATE_CHAN:
+            cid = p1
+            pv = server.pvs_by_name.get(_string_decode(payload), None)
+            if pv is None:
+                self.send(message(CA_PROTO_CREATE_CH_FAIL, p1=cid))
+                return
+            sid = server._sid_next()
+            self.channels[sid] = (cid, pv)
+            self.send(
+                message(CA_PROTO_ACCESS_RIGHTS, p1=cid, p2=3)
+                + message(
+                    CA_PROTO_CREATE_CHAN,
+                    data_type=pv.dbr_type,
+                    data_count=pv.count,
+                    p1=cid,
+                    p2=sid,
+                )
+            )
+        elif command == CA_PROTO_CLEAR_CHANNEL:
+            sid = p1
+            self.channels.pop(sid, None)
+            subids = []
+            with server._lock:
+                for subid, (sub_sid, pv) in list(self.subs.items()):
+                    if sub_sid == sid:
+                        pv.subs.pop((self, subid), None)
+                        del self.subs[subid]
+                        subids.append(subid)
+            with self._lock:
+                for subid in subids:
+                    self._events.pop(subid, None)
+            self.send(message(CA_PROTO_CLEAR_CHANNEL, p1=sid, p2=p2))
+        elif command in (CA_PROTO_READ_NOTIFY, CA_PROTO_READ):
+            chan = self.channels.get(p1, None)
+            if chan is None:
+                self.error(header, p1, ECA_BADCHID, "bad channel id")
+                return
+            cid, pv = chan
+            server._read(pv)
+            try:
+                data, count = pv.encode(data_type, count)
+            except ValueError:
+                self.error(header, cid, ECA_BADTYPE, "bad DBR type")
+                return
+            if command == CA_PROTO_READ:
+                self.send(message(CA_PROTO_READ, data, data_type, count, p1, p2))
+            else:
+                self.send(
+                    message(CA_PROTO_READ_NOTIFY, data, data_type, count, ECA_NORMAL, p2)
+                )
+        elif command in (CA_PROTO_WRITE, CA_PROTO_WRITE_NOTIFY):
+            chan = self.channels.get(p1, None)
+            if chan is None:
+                self.error(header, p1, ECA_BADCHID, "bad channel id")
+                return
+            cid, pv = chan
+            notify = None
+            if command == CA_PROTO_WRITE_NOTIFY:
+                notify = (self, data_type, count, p2)
+            try:
+                value = pv.decode(data_type, count, payload)
+            except (ValueError, IndexError):
+                if notify is not None:
+                    self.send(
+                        message(CA_PROTO_WRITE_NOTIFY, b"", data_type, count, ECA_PUTFAIL, p2)
+                    )
+                return
+            server._write(pv, value, notify)
+        elif command == CA_PROTO_EVENT_ADD:
+            chan = self.channels.get(p1, None)
+            if chan is None:
+                self.error(header, p1, ECA_BADCHID, "bad channel id")
+                return
+            cid, pv = chan
+            try:
+                data, count_use = pv.encode(data_type, count)
+            except ValueError:
+                self.error(header, cid, ECA_BADTYPE, "bad DBR type")
+                return
+            mask = DBE_VALUE | DBE_ALARM
+            if len(payload) >= 14:
+                mask = struct.unpack_from(">H", payload, 12)[0]
+            sub = _Subscription(self, p2, data_type, count, mask)
+            with server._lock:
+                self.subs[p2] = (p1, pv)
+                pv.subs[(self, p2)] = sub
+            # the current value is sent at once
+            self.post(
+                p2,
+                message(CA_PROTO_EVENT_ADD, data, data_type, count_use, ECA_NORMAL, p2),
+            )
+        elif command == CA_PROTO_EVENT_CANCEL:
+            with server._lock:
+                sub = self.subs.pop(p2, None)
+                if sub is not None:
+                    sub[1].subs.pop((self, p2), None)
+            with self._lock:
+                self._events.pop(p2, None)
+            self.send(message(CA_PROTO_EVENT_ADD, b"", data_type, count, p1, p2))
+        elif command == CA_PROTO_EVENTS_OFF:
+            self._events_on = False
+        elif command == CA_PROTO_EVENTS_ON:
+            self._events_on = True
+            self._events_flush()
+        elif command == CA_PROTO_READ_SYNC:
+            self.send(message(CA_PROTO_READ_SYNC))
+        return
+
+
+class _CASearch(asyncio.DatagramProtocol):
+    """
+    UDP name resolution, answering the searches for hosted channels
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        replies = []
+        idx = 0
+        N = len(data)
+        pvs = self.server.pvs_by_name
+        while N - idx >= 16:
+            command, size, data_type, count, p1, p2 = _header.unpack_from(data, idx)
+            payload = data[idx + 16 : idx + 16 + size]
+            idx += 16 + size
+            if command == CA_PROTO_SEARCH:
+                if _string_decode(payload) in pvs:
+                    replies.append(
+                        message(
+                            CA_PROTO_SEARCH,
+                            struct.pack(">H", CA_MINOR_VERSION),
+                            data_type=self.server.port,
+                            p1=0xFFFFFFFF,
+                            p2=p1,
+                        )
+                    )
+        if replies:
+            reply = message(CA_PROTO_VERSION, data_count=CA_MINOR_VERSION)
+            self.transport.sendto(reply + b"".join(replies), addr)
+
+
+def _env(*names, default=None):
+    for name in names:
+        val = os.getenv(name, None)
+        if val:
+            return val
+    return default
+
+
+def _addr_list(text, port):
+    addrs = []
+    for entry in text.split():
+        host, _, entry_port = entry.partition(":")
+        addrs.append((host, int(entry_port) if entry_port else port))
+    return addrs
+
+
+class SimpleServer(object):
+    """
+    Hosts the channels created with createPV, served by a ServerThread.
+    """
+
+    def __init__(self):
+        self.pvs = dict()
+        self.pvs_by_name = dict()
+        self.driver = None
+        # protects the subscriptions, which the driver posts to from other threads
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._sid = 0
+        # the largest message payload accepted from clients, as set by
+        # EPICS_CA_MAX_ARRAY_BYTES and raised by createPV to fit every channel
+        self.max_payload = int(_env("EPICS_CA_MAX_ARRAY_BYTES", default=16384))
+        self._loop = None
+        self._servers = []
+        self._tasks = []
+        self.port = None
+        return
+
+    def createPV(self, prefix, pvdb):
+        for reason, info in pvdb.items():
+            pv = SimplePV(prefix + reason, reason, info)
+            self.pvs[reason] = pv
+            self.pvs_by_name[pv.name] = pv
+            # enough for a write of every element as a string
+            self.max_payload = max(self.max_payload, MAX_STRING_SIZE * pv.count)
+        return
+
+    def _sid_next(self):
+        self._sid += 1
+        return self._sid
+
+    def _read(self, pv):
+        driver = self.driver
+        if driver is not None:
+            value = driver.read(pv.reason)
+            if value is not None:
+                pv.value = value
+        return
+
+    def _write(self, pv, value, notify):
+        driver = self.driver
+        asyn = notify is not None and pv.info.get("asyn", False)
+        if asyn:
+            # completed by Driver.callbackPV, which the driver may call from another
+            # thread before write returns
+            pv.notifies.append(notify)
+            pv.notify_write = notify
+        try:
+            success = driver.write(pv.reason, value)
+        except Exception:
+            traceback.print_exc()
+            success = False
+        finally:
+            pv.notify_write = None
+        if success is False:
+            driver.setParamStatus(pv.reason, WRITE_ALARM, INVALID_ALARM)
+        driver.updatePV(pv.reason)
+        if notify is None:
+            return
+        if asyn:
+            if success is not False:
+                return
+            try:
+                pv.notifies.remove(notify)
+            except ValueError:
+                # already completed by the driver
+                return
+        self._notify(notify, ECA_NORMAL if success is not False else ECA_PUTFAIL)
+
+    def _notify(self, notify, status):
+        client, data_type, count, ioid = notify
+        # the events of the write precede its completion, as from the EPICS servers
+        client._events_flush(force=True)
+        client.send(message(CA_PROTO_WRITE_NOTIFY, b"", data_type, count, status, ioid))
+
+    async def _start(self):
+        loop = self._loop
+        intf = _env("EPICS_CAS_INTF_ADDR_LIST", default="0.0.0.0").split()[0]
+        port = int(_env("EPICS_CAS_SERVER_PORT", "EPICS_CA_SERVER_PORT", default=CA_SERVER_PORT))
+
+        try:
+            server = await loop.create_server(lambda: _CAClient(self), intf, port)
+        except OSError:
+            # another server has the port, clients find this one by searching
+            server = await loop.create_server(lambda: _CAClient(self), intf, 0)
+        self._servers.append(server)
+        self.port = server.sockets[0].getsockname()[1]
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind((intf, port))
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _CASearch(self), sock=sock
+        )
+        self._servers.append(transport)
+        self._tasks.append(loop.create_task(self._beacons()))
+        return
+
+    async def _beacons(self):
+        """
+        Announce the server, quickly at first then with the beacon period
+        """
+        beacon_port = int(
+            _env("EPICS_CAS_BEACON_PORT", "EPICS_CA_REPEATER_PORT", default=CA_REPEATER_PORT)
+        )
+        addrs = _addr_list(
+            _env("EPICS_CAS_BEACON_ADDR_LIST", "EPICS_CA_ADDR_LIST", default=""),
+            beacon_port,
+        )
+        auto = _env("EPICS_CAS_AUTO_BEACON_ADDR_LIST", "EPICS_CA_AUTO_ADDR_LIST", default="YES")
+        if auto.upper() != "NO":
+            addrs.append(("255.255.255.255", beacon_port))
+        period_max_s = float(
+            _env("EPICS_CAS_BEACON_PERIOD", "EPICS_CA_BEACON_PERIOD", default=15)
+        )
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setblocking(False)
+        beacon_id = 0
+        period_s = 0.02
+        try:
+            while True:
+                beacon = message(
+                    CA_PROTO_RSRV_IS_UP,
+                    data_type=CA_MINOR_VERSION,
+                    data_count=self.port,
+                    p1=beacon_id,
+                    p2=0,
+                )
+                for addr in addrs:
+                    try:
+                        sock.sendto(beacon, addr)
+                    except OSError:
+                        pass
+                beacon_id = (beacon_id + 1) & 0xFFFFFFFF
+                await asyncio.sleep(period_s)
+                period_s = min(2 * period_s, period_max_s)
+        finally:
+            sock.close()
+
+    def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        for server in self._servers:
+            server.close()
+        for client in list(self._clients):
+            if client.transport is not None:
+                client.transport.close()
+        self._loop.stop()
+
+
+class ServerThread(threading.Thread):
+    """
+    Runs the server's event loop, as the pcaspy ServerThread
+    """
+
+    def __init__(self, server):
+        super(ServerThread, self).__init__(name="CA server")
+        self.server = server
+        # not _started, which is the Event of threading.Thread itself
+        self._serving = threading.Event()
+        self._error = None
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        self.server._loop = loop
+        try:
+            loop.run_until_complete(self.server._start())
+        except Exception as E:
+            self._error = E
+            self._serving.set()
+            loop.close()
+            raise
+        self._serving.set()
+        try:
+            loop.run_forever()
+            # let the tasks cancelled by _shutdown finish
+            tasks = self.server._tasks
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            loop.close()
+
+    def start(self):
+        super(ServerThread, self).start()
+        # serve before returning, as pcaspy does
+        self._serving.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self):
+        loop = self.server._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self.server._shutdown)
+            except RuntimeError:
+                pass
+
+
+class Driver(object):
+    """
+    Parameter library of the channel values, with the pcaspy Driver interface.
+    The server must be assigned to self.cas before Driver.__init__, as the CAS drivers do.
+    """
+
+    def __init__(self):
+        self.cas.driver = self
+        self.pvDB = self.cas.pvs
+        return
+
+    def read(self, reason):
+        return self.getParam(reason)
+
+    def write(self, reason, value):
+        self.setParam(reason, value)
+        return True
+
+    def setParam(self, reason, value, timestamp=None):
+        if isinstance(value, list):
+            value = value[:]
+        elif isinstance(value, np.ndarray):
+            value = value.copy()
+        pv = self.pvDB[reason]
+        pv.mask |= pv.check_value(value)
+        pv.value = value
+        if timestamp is None:
+            timestamp = time.time()
+        pv.time = timestamp
+        if pv.mask:
+            pv.flag = True
+        alarm, severity = pv.check_alarm(value)
+        self.setParamStatus(reason, alarm, severity)
+
+    def setParamStatus(self, reason, alarm=None, severity=None):
+        pv = self.pvDB[reason]
+        if alarm is not None and pv.alarm != alarm:
+            pv.alarm = alarm
+            pv.mask |= DBE_ALARM
+            pv.flag = True
+        if severity is not None and pv.severity != severity:
+            pv.severity = severity
+            pv.mask |= DBE_ALARM
+            pv.flag = True
+
+    def setParamEnums(self, reason, enums, states=None):
+        if states is None:
+            states = [NO_ALARM] * len(enums)
+        if len(enums) != len(states):
+            raise ValueError("enums and states must have the same length")
+        self.setParamInfo(reason, dict(enums=enums, states=states))
+
+    def setParamInfo(self, reason, info):
+        pv = self.pvDB[reason]
+        pv.info.update(info)
+        alarm, severity = pv.check_alarm(pv.value)
+        self.setParamStatus(reason, alarm, severity)
+        pv.mask |= DBE_PROPERTY
+        pv.flag = True
+
+    def getParam(self, reason):
+        return self.pvDB[reason].value
+
+    def getParamDB(self, reason):
+        return self.pvDB[reason]
+
+    def getParamInfo(self, reason, info_keys=None):
+        info = self.pvDB[reason].info
+        if info_keys is None:
+            return dict(info)
+        return {k: info[k] for k in info_keys if k in info}
+
+    def callbackPV(self, reason, success=True, notify=None):
+        """
+        Complete a pending write notify of an asynchronous (asyn) channel, as failed
+        with ECA_PUTFAIL if not success. Completes the oldest unless notify is given,
+        which drivers may take from SimplePV.notify_write during their write.
+        """
+        pv = self.pvDB[reason]
+        try:
+            if notify is None:
+                notify = pv.notifies.popleft()
+            else:
+                pv.notifies.remove(notify)
+        except (IndexError, ValueError):
+            return
+        self.cas._loop.call_soon_threadsafe(
+            self.cas._notify, notify, ECA_NORMAL if success else ECA_PUTFAIL
+        )
+
+    def updatePVs(self):
+        for reason in self.pvDB:
+            self.updatePV(reason)
+
+    def updatePV(self, reason):
+        """
+        Post the events of a changed channel to its subscriptions, encoding the value once
+        for each requested type.
+        """
+        pv = self.pvDB[reason]
+        if not pv.flag:
+            return
+        pv.flag = False
+        mask = pv.mask
+        pv.mask = 0
+        if not pv.subs:
+            return
+        with self.cas._lock:
+            subs = list(pv.subs.values())
+        encoded = dict()
+        for sub in subs:
+            if not (sub.mask & mask):
+                continue
+            key = (sub.dbr_type, sub.count)
+            data = encoded.get(key, None)
+            if data is None:
+                try:
+                    data = encoded[key] = pv.encode(sub.dbr_type, sub.count)
+                except ValueError:
+                    continue
+            payload, count = data
+            sub.client.post(
+                sub.subid,
+                message(
+                    CA_PROTO_EVENT_ADD,
+                    payload,
+                    sub.dbr_type,
+                    count,
+                    ECA_NORMAL,
+                    sub.subid,
+                ),
+            )
+        return
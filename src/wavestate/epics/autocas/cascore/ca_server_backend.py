@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+The CAS driver on the pure-Python CA server of ca_server, which does not need pcaspy
+or the EPICS libraries.
+"""
+
+from . import cas_driver
+from . import ca_server
+
+
+class CADriverServer(cas_driver.CADriverBase, ca_server.Driver):
+    t_server = ca_server.SimpleServer
+    t_server_thread = ca_server.ServerThread
+
+    def write_token(self, channel):
+        return self.pvDB[channel].notify_write
+
+    def write_complete(self, channel, success, token):
+        if token is not None:
+            self.callbackPV(channel, success=success, notify=token)
@@ -12,6 +12,7 @@
 import os
 import sys
 import socket
+from os import path
 
 from wavestate import declarative
 from wavestate.declarative import argparse as declarg
@@ -20,7 +21,9 @@ from ..config import pytoml
 
 from . import cascore
 from . import ctree
+from . import db_cache
 from . import program
+from . import shard
 
 
 class CAS9MetaProgram(
@@ -34,8 +37,20 @@ class CAS9MetaProgram(
     def cmd(self, val):
         return val
 
+    @declarative.dproperty
+    def shard_plan(self, val = None):
+        """
+        shard.ShardPlan to split the program over several processes, or None to host all of it
+        """
+        return val
+
     @declarative.dproperty
     def root(self):
+        if self.shard_plan is None:
+            cache = self.cmd.db_cache
+        else:
+            #each process only generates a part of the db
+            cache = None
         root = cascore.InstaCAS(
             prefix_base      = self.cmd.ifo,
             prefix_subsystem = self.cmd.subsystem,
@@ -44,6 +59,8 @@ class CAS9MetaProgram(
             config_files     = [
                 self.cmd.config_file,
             ],
+            db_cache         = cache,
+            shard_plan       = self.shard_plan,
         )
         return root
 
@@ -174,6 +191,26 @@ class CAS9CmdLine(
             val = False
         return val
 
+    @declarg.store_true(['--profile-startup'])
+    @declarative.dproperty
+    def profile_startup(self, val = None):
+        """
+        Report the time spent importing, and constructing each dproperty while starting up
+        """
+        if val is None:
+            val = False
+        return val
+
+    @declarative.dproperty
+    def startup_profile(self):
+        if not self.profile_startup:
+            return None
+        from .. import _import_time_s
+        from . import startup_profile
+        return startup_profile.StartupProfile(
+            import_time_s = _import_time_s,
+        )
+
     #must specify in base classes or as a default
     @declarative.dproperty
     def t_task(self, val = None):
@@ -241,9 +278,122 @@ class CAS9CmdLine(
         )
         return val
 
+    @declarg.argument(['--shard'], metavar = 'name')
+    @declarative.dproperty
+    def shard(self, val = None):
+        """
+        Run only the named shard of a program configured with shards. Used by the shard supervisor to start its workers.
+        """
+        return val
+
+    @declarg.argument(['--shard-fd'], type = int, metavar = 'fd')
+    @declarative.dproperty
+    def shard_fd(self, val = None):
+        """
+        File descriptor for a shard worker to report to its supervisor
+        """
+        return val
+
+    @declarative.dproperty
+    def shards(self, val = None):
+        """
+        Ordered dictionary of shard names to their node paths, or None if the program is not sharded
+        """
+        if val is None:
+            val = self.ctree.get_configured(
+                'shards',
+                default = None,
+                about = (
+                    "Split the program over several processes when run. A list of nodes of the task, as"
+                    " dot separated configuration paths, to each host from a worker process. An entry may also hold several"
+                    " comma separated nodes to host from a single process. The supervisor process hosts the rest of the task."
+                    " The objects above the nodes should only contain them, as their channels are hosted by the supervisor."
+                )
+            )
+        if not val:
+            return None
+        return shard.shards_parse(val)
+
+    def shard_plan(self):
+        """
+        The shard.ShardPlan for this process, or None if the program is not sharded. Only valid within a command.
+        """
+        if self.shards is None:
+            if self.shard is not None:
+                raise RuntimeError("--shard given, but no shards are configured")
+            return None
+        idx = sys.argv.index(self.__cls_argparse_cmd__)
+        return shard.ShardPlan(
+            nodes        = self.shards,
+            shard        = self.shard,
+            module_name  = self.module_name,
+            report_fd    = self.shard_fd,
+            argv         = [sys.executable] + sys.argv[:idx],
+            argv_command = sys.argv[idx:],
+        )
+
+    @declarative.dproperty
+    def db_cache_folder(self, val = None):
+        if val is None:
+            default = path.join(
+                os.getenv('XDG_CACHE_HOME', path.expanduser('~/.cache')),
+                'wavestate.epics.autocas',
+            )
+        else:
+            default = val
+        val = self.ctree.get_configured(
+            'db_cache_folder',
+            default = default,
+            about = (
+                "Folder to cache the generated PV layout, so that the list commands needn't construct the program."
+                " The cache is keyed on the configuration file and the program source. If null, then no cache is used."
+            )
+        )
+        return val
+
+    @declarative.dproperty
+    def db_cache(self):
+        if self.db_cache_folder is None:
+            return None
+        packages = [
+            self.t_task.__module__.split('.')[0],
+            '__main__',
+            'wavestate.epics.autocas',
+        ]
+        key = db_cache.cache_key(
+            config_files = [f for f in [self.config_file] if f is not None],
+            source_files = db_cache.package_source_files(packages),
+            extra        = [self.module_name, self.ifo, self.subsystem],
+        )
+        return db_cache.PVDBCache(
+            folder = self.db_cache_folder,
+            name   = self.module_name,
+            key    = key,
+        )
+
+    def db_layout(self):
+        """
+        The static layout of the PV db, channel names to settings, from the cache if possible.
+        """
+        if self.db_cache is not None:
+            cache = self.db_cache.load()
+            if cache is not None:
+                return cache['channels']
+        program = self.meta_program_generate()
+        db = program.root.cas_db_generate()
+        if self.db_cache is not None:
+            try:
+                self.db_cache.save(db)
+            except (IOError, OSError) as E:
+                print("WARNING: could not write the PV db cache: {0}".format(E), file = sys.stderr)
+        return db_cache.db_layout(db)
+
     t_meta_program = CAS9MetaProgram
 
     def meta_program_generate(self, **kwargs):
+        if self.startup_profile is not None:
+            #reports at exit unless reported sooner
+            self.startup_profile.start()
         return self.t_meta_program(
             cmd = self,
             **kwargs
@@ -252,10 +402,14 @@ class CAS9CmdLine(
     @declarg.command()
     def run(self, args):
         """
-        Main method to start running the task
+        Main method to start running the task. If shards are configured, this runs the supervisor, which starts a worker process for each shard.
         """
-        program = self.meta_program_generate()
+        program = self.meta_program_generate(shard_plan = self.shard_plan())
         try:
+            if self.startup_profile is not None:
+                #report once serving, rather than once the reactor exits
+                program.root.start()
+                self.startup_profile.report()
             program.root.run()
         except KeyboardInterrupt:
             print('KeyboardInterrupt', file = sys.stderr)
@@ -288,6 +442,20 @@ class CAS9CmdLine(
             __usage_prog__ = (' '.join(sys.argv[:idx + 1])),
         )
 
+    @declarg.command(takes_arguments = True)
+    def snap(self, argv):
+        """
+        Compare burt snapshots with each other or with the live channels, optionally restoring the differences (takes subcommand arguments)
+        """
+        #TODO, make this a nicer hack for the usage_prog
+        idx = sys.argv.index(self.__cls_argparse_cmd__)
+
+        return program.snap.SnapArgs.__cls_argparse__(
+            argv,
+            cmd = self,
+            __usage_prog__ = (' '.join(sys.argv[:idx + 1])),
+        )
+
 
 class CAS9Module(cascore.CASUser):
     t_cas9cmdline = CAS9CmdLine
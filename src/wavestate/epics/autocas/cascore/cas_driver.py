@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+The driver hosting the generated db on a CA server, shared by the server backends.
+
+The driver relays between the RelayValues of the db and the channel parameters of
+the server. The backends combine it with the Driver of their server library, which
+provides setParam, setParamInfo, getParam and updatePV(s), and set t_server and
+t_server_thread to the server and thread types of the library.
+
+Client writes are either applied from the server thread, holding the reactor
+task_lock, or with write_inbox set, queued to the reactor to be applied in batches.
+The server thread then never waits on the reactor. The channels are asynchronous
+(asyn) in that mode, so put-callback clients are answered once the write is applied.
+"""
+
+import collections
+
+import numpy as np
+
+from . import relay_values
+from . import relay_throttle
+from ..utilities.pprint import pprint
+
+# EPICS alarm condition and severity of channels whose writes failed
+WRITE_ALARM = 2
+INVALID_ALARM = 3
+
+
+class CADriverBase(object):
+    t_server = None
+    t_server_thread = None
+    # the most queued writes applied by each reactor task
+    write_inbox_batch = 256
+
+    # createPV settings, which may be given by RelayValues
+    _cas_elems_info = [
+        "count",  # 1 	Number of elements
+        "enums",  # [] 	String representations of the enumerate states
+        "states",  # [] 	Severity values of the enumerate states.
+        "prec",  # 0 	Data precision
+        "unit",  # '' 	Physical meaning of data
+        "lolim",  # 0 	Data low limit for graphics display
+        "hilim",  # 0 	Data high limit for graphics display
+        "low",  # 0 	Data low limit for alarm
+        "high",  # 0 	Data high limit for alarm
+        "lolo",  # 0 	Data low low limit for alarm
+        "hihi",  # 0 	Data high high limit for alarm
+        "adel",  # 0 	Archive deadband
+        "mdel",  # 0 	Monitor,                    value change deadband
+    ]
+    # createPV settings which are fixed
+    _cas_elems_fixed = [
+        "type",  # 'float' PV data type. enum, string, char, float or int
+        "scan",  # 0 	Scan period in second. 0 means passive
+        "asyn",  # False 	Process finishes asynchronously if True
+        "asg",  # '' 	Access security group name
+    ]
+
+    def _cas_static_compile(self, db_entry):
+        """
+        The createPV settings of a db entry which only depend on the db layout, and
+        the list of the settings given by RelayValues. Those and the initial value
+        are added at each run.
+        """
+        entry_use = {}
+        elems_relay = []
+        for elem in self._cas_elems_info:
+            if elem in db_entry:
+                elem_val = db_entry[elem]
+                if isinstance(elem_val, relay_values.RelayValueDecl):
+                    elems_relay.append(elem)
+                else:
+                    entry_use[elem] = elem_val
+        for elem in self._cas_elems_fixed:
+            if elem in db_entry:
+                entry_use[elem] = db_entry[elem]
+        return entry_use, elems_relay
+
+    def _put_cb_generator_immediate(self, channel):
+        def put_cb(value):
+            self.setParam(channel, value)
+            self.updatePV(channel)
+
+        return put_cb
+
+    def _put_cb_generator_deferred(self, channel):
+        def put_cb(value):
+            # the value itself is read back from the rv during updatePVs_dirty
+            self._dirty.add(channel)
+
+        return put_cb
+
+    def _put_elem_cb_generator(self, channel, elem):
+        def put_cb(value):
+            use_entry = self.db_cas_raw[channel]
+            # TODO 'value' maybe shouldn't be in this..
+            use_entry[elem] = value
+            # I "type" is included in setParamInfo, it crashes pcaspy
+            dtemp = dict(use_entry)
+            dtemp.pop("type", None)
+            self.setParamInfo(channel, dtemp)
+            self._dirty.add(channel)
+
+        return put_cb
+
+    def __init__(
+        self,
+        db,
+        reactor,
+        saver=None,
+        deferred_write_period=1 / 4.0,
+        write_inbox=None,
+        db_cas_static=None,
+    ):
+        """
+        write_inbox is the most client writes queued to the reactor before further
+        writes are rejected. If None, writes are applied from the server thread.
+
+        db_cas_static is the db_cas_static of a previous run with the same db layout,
+        such as from the db_cache, so that the createPV settings of its channels are
+        not compiled again. It maps the channels to their settings and the list of
+        those given by RelayValues.
+        """
+        self.db = db
+        self.reactor = reactor
+        self.saver = saver
+        # channels touched since the last updatePVs_dirty. Only modified while
+        # holding the reactor task_lock.
+        self._dirty = set()
+        self.write_inbox = write_inbox
+        # (channel, value, token) of the queued client writes, where token is from
+        # write_token. deque appends and pops are atomic, so the server thread and the
+        # reactor do not share a lock.
+        self._inbox = collections.deque()
+        self._inbox_scheduled = False
+
+        self.cas = self.t_server()
+        self.cas_thread = self.t_server_thread(self.cas)
+        self.cas_thread.daemon = True
+
+        db_cas_raw = {}
+        cas_static = {}
+
+        for channel, db_entry in self.db.items():
+            # ignore the remote entries
+            if db_entry["remote"]:
+                # print('REMOTE')
+                # print(channel, db_entry)
+                continue
+            rv = db_entry["rv"]
+
+            # provide a callback key so that we can avoid the callback during the write method
+            # print("ENTRY", db_entry)
+            if not db_entry["deferred"]:
+                put_cb = self._put_cb_generator_immediate(channel)
+            else:
+                if deferred_write_period is not None and deferred_write_period > 0:
+                    put_cb = self._put_cb_generator_deferred(channel)
+                else:
+                    put_cb = self._put_cb_generator_immediate(channel)
+            rv.register(
+                callback=relay_throttle.throttled(self.reactor, put_cb, db_entry),
+                key=self,
+            )
+
+            static = None
+            if db_cas_static is not None:
+                static = db_cas_static.get(channel, None)
+            if static is None:
+                static = self._cas_static_compile(db_entry)
+            cas_static[channel] = static
+            entry_static, elems_relay = static
+            entry_use = dict(entry_static)
+
+            # setup relays for any of the channel values to be inserted
+            for elem in elems_relay:
+                elem_val = db_entry[elem]
+                entry_use[elem] = elem_val.value
+                elem_val.register(callback=self._put_elem_cb_generator(channel, elem))
+
+            if "value" in db_entry:
+                entry_use["value"] = db_entry["value"]
+            else:
+                entry_use["value"] = rv.value
+            if self._inbox_uses(channel):
+                # completed by write_complete once the reactor applies the write
+                entry_use["asyn"] = True
+            db_cas_raw[channel] = entry_use
+
+        self.db_cas_raw = db_cas_raw
+        self.db_cas_static = cas_static
+        # print("INT:")
+        # dprint(self.db_cas_raw)
+        # have to setup createPV before starting the driver
+        self.cas.createPV("", self.db_cas_raw)
+        super(CADriverBase, self).__init__()
+
+        # pre-set all values, since this is apparently not done for you
+        for channel, db_entry in self.db_cas_raw.items():
+            self.setParam(channel, db_entry["value"])
+            # If "type" is included in setParamInfo, it crashes pcaspy
+            dtemp = dict(db_entry)
+            dtemp.pop("type", None)
+            self.setParamInfo(channel, dtemp)
+        self.updatePVs()
+        self._dirty.clear()
+
+        # the deferred writes will happen this often
+        if deferred_write_period is not None and deferred_write_period > 0:
+            self.reactor.enqueue_looping(
+                self.updatePVs_dirty,
+                period_s=deferred_write_period,
+            )
+
+        if self.saver is not None:
+            self.saver.set_db_driver(self.db, self)
+            self.saver.folders_make_ready()
+            self.saver.load_snap()
+        return  # ~__init__
+
+    def write(self, channel, value):
+        # NOTE: for enum records the value here is the numeric value,
+        # not the string.  setParam() expects the numeric value.
+
+        # reject writes to non-writable channels
+        if self.db[channel]["interaction"] == "report":
+            return False
+
+        ctype = self.db[channel]["type"]
+        ctype_strlike = False
+
+        if ctype in ["string", "char"]:
+            ctype_strlike = True
+
+        # reject values that don't correspond to an actual index of
+        # the enum
+        # FIXME: this is apparently a feature? of cas that allows for
+        # setting numeric values higher than the enum?
+        if ctype == "enum" and (value >= len(self.db[channel]["enums"]) or value < 0):
+            return False
+
+        if self._inbox_uses(channel):
+            if len(self._inbox) >= self.write_inbox:
+                return False
+            self._inbox.append((channel, value, self.write_token(channel)))
+            if not self._inbox_scheduled:
+                self._inbox_scheduled = True
+                self.reactor.send_task(self._inbox_drain)
+            return True
+
+        db = self.db[channel]
+        rv = db["rv"]
+        mt_assign = db.get("mt_assign", False)
+
+        if self.saver is not None:
+            urgentsave_s = db.get("urgentsave_s", None)
+            if urgentsave_s is not None and urgentsave_s >= 0:
+                self.saver.urgentsave_notify(channel, urgentsave_s)
+
+        try:
+            if mt_assign:
+                rv.put_exclude_cb(value, key=self)
+            else:
+                with self.reactor.task_lock:
+                    rv.put_exclude_cb(value, key=self)
+        except relay_values.RelayValueCoerced as E:
+            # print(value, type(value))
+            value = E.preferred
+            # print(value, type(value))
+            if mt_assign:
+                rv.put_valid_exclude_cb(E.preferred, key=self)
+            else:
+                with self.reactor.task_lock:
+                    rv.put_valid_exclude_cb(E.preferred, key=self)
+
+            self.setParam(channel, value)
+
+            self.updatePV(channel)
+            return False
+        except relay_values.RelayValueRejected:
+            return False
+        else:
+            self.setParam(channel, value)
+            # self.updatePVs()
+            return True
+
+    def _inbox_uses(self, channel):
+        """
+        If writes to the channel are queued to the reactor. Channels with mt_assign
+        may be assigned from any thread, so they are still written directly.
+        """
+        db_entry = self.db[channel]
+        return (
+            self.write_inbox is not None
+            and db_entry["interaction"] != "report"
+            and not db_entry.get("mt_assign", False)
+        )
+
+    def _inbox_drain(self):
+        """
+        Apply a batch of the queued client writes. Runs in the reactor, and sends
+        itself again while writes remain.
+        """
+        # cleared first, so that writes queued while draining schedule another drain
+        self._inbox_scheduled = False
+        inbox = self._inbox
+        for _ in range(self.write_inbox_batch):
+            try:
+                channel, value, token = inbox.popleft()
+            except IndexError:
+                break
+            success = self._write_apply(channel, value)
+            if not success:
+                self.setParamStatus(channel, WRITE_ALARM, INVALID_ALARM)
+            self.updatePV(channel)
+            self.write_complete(channel, success, token)
+        if inbox and not self._inbox_scheduled:
+            self._inbox_scheduled = True
+            self.reactor.send_task(self._inbox_drain)
+        return
+
+    def _write_apply(self, channel, value):
+        """
+        Put a queued client write to the rv, holding the task_lock. Coerced values
+        are applied but reported as failed, as for direct writes.
+        """
+        db = self.db[channel]
+        rv = db["rv"]
+
+        if self.saver is not None:
+            urgentsave_s = db.get("urgentsave_s", None)
+            if urgentsave_s is not None and urgentsave_s >= 0:
+                self.saver.urgentsave_notify(channel, urgentsave_s)
+
+        try:
+            rv.put_exclude_cb(value, key=self)
+        except relay_values.RelayValueCoerced as E:
+            rv.put_valid_exclude_cb(E.preferred, key=self)
+            self.setParam(channel, E.preferred)
+            return False
+        except relay_values.RelayValueRejected:
+            return False
+        else:
+            self.setParam(channel, value)
+            return True
+
+    def write_token(self, channel):
+        """
+        Called from write as a client write to an asynchronous channel is queued.
+        Returns the token with which write_complete completes the put-callback of
+        that write, or None if it has none, as for plain puts. The backends override
+        this, since plain puts and put-callbacks may be queued in any order.
+        """
+        return None
+
+    def write_complete(self, channel, success, token):
+        """
+        Complete the put-callback of a queued write from its write_token. The
+        backends override this to complete that write and report failed writes.
+        """
+        if token is not None:
+            self.callbackPV(channel)
+
+    def write_sync_typecast(self, channel, value):
+        """
+        This is a special write function for burt/autosave and other users of the synchronous system. It does two things different:
+
+        A: it writes without grabbing the lock, since it should be called only with the lock held
+        B: It typecasts its input values, this allows them to be input as strings from a burt loader
+        """
+        # NOTE: for enum records the value here is the numeric value,
+        # not the string.  setParam() expects the numeric value.
+
+        # reject writes to non-writable channels
+        if self.db[channel]["interaction"] == "report":
+            return False
+
+        ctype = self.db[channel]["type"]
+        ctype_strlike = False
+        # waveforms are arrays whatever their length. Snapshots hold those of length 1
+        # as scalars.
+        is_array = self.db[channel].get("count", 1) != 1 or isinstance(
+            self.db[channel]["rv"], relay_values.RelayValueWaveform
+        )
+        if ctype == "float":
+            if not is_array:
+                value = float(value)
+            else:
+                value = np.atleast_1d(np.asarray(value, dtype=float))
+        elif ctype == "int":
+            if not is_array:
+                try:
+                    value = int(value)
+                except ValueError:
+                    value = float(value)
+            else:
+                # not cast here, so that the relay sees lossy writes as coerced
+                value = np.atleast_1d(np.asarray(value))
+        elif ctype == "enum":
+            try:
+                value = int(value)
+            except ValueError:
+                value = self.db[channel]["enums"].index(value)
+        elif ctype == "string":
+            # should be happy
+            value = str(value)
+            ctype_strlike = True
+        elif ctype == "char":
+            # also should be happy as a str
+            value = str(value)
+            ctype_strlike = True
+
+        # reject values that don't correspond to an actual index of
+        # the enum
+        # FIXME: this is apparently a feature? of cas that allows for
+        # setting numeric values higher than the enum?
+        if ctype == "enum" and (value >= len(self.db[channel]["enums"]) or value < 0):
+            return False
+
+        db = self.db[channel]
+        rv = db["rv"]
+        if self.saver is not None:
+            urgentsave_s = db.get("urgentsave_s", None)
+            if urgentsave_s is not None and urgentsave_s >= 0:
+                self.saver.urgentsave_notify(channel, urgentsave_s)
+
+        try:
+            rv.put_exclude_cb(value, key=self)
+        except relay_values.RelayValueCoerced as E:
+            # print("COERCED")
+            value = E.preferred
+            rv.put_valid_exclude_cb(
+                E.preferred,
+                key=self,
+            )
+
+            self.setParam(channel, value)
+
+            self.updatePV(channel)
+            return False
+        except relay_values.RelayValueRejected:
+            return False
+        else:
+            self.setParam(channel, value)
+            # posted with the next updatePVs_dirty, as the caller may be bulk loading
+            self._dirty.add(channel)
+            return True
+
+    def write_sync_typecast_bulk(self, values):
+        """
+        write_sync_typecast of each channel, value in the dictionary values, for bulk
+        loads such as a burt restore. Like write_sync_typecast, it must be called with
+        the lock held, so the whole batch is applied under it. Values which fail to
+        typecast are rejected rather than raising. The monitors of all written channels
+        are posted together at the end.
+
+        Returns the list of channels whose writes failed.
+        """
+        failed = []
+        for channel, value in values.items():
+            try:
+                did_write = self.write_sync_typecast(channel, value)
+            except (ValueError, TypeError):
+                did_write = False
+            if not did_write:
+                failed.append(channel)
+        self.updatePVs_dirty()
+        return failed
+
+    def updatePVs_dirty(self):
+        """
+        Post monitors for the channels marked dirty since the last call, rather than
+        iterating the whole database as updatePVs does. The current value of each
+        dirty channel is read from its RelayValue, so a channel set many times
+        between calls is only copied and posted once. Values unchanged within mdel
+        are not reposted. Must be called holding the task_lock (from the reactor).
+        """
+        if not self._dirty:
+            return
+        dirty = self._dirty
+        self._dirty = set()
+        db = self.db
+        for channel in dirty:
+            value = db[channel]["rv"].value
+            if self._value_changed(channel, value):
+                self.setParam(channel, value)
+            # also posts alarm and metadata changes flagged by setParamInfo
+            self.updatePV(channel)
+        return
+
+    def _value_changed(self, channel, value):
+        """
+        Compare a value against the last one given to setParam. pcaspy applies mdel
+        to scalars itself but always posts arrays, so waveforms are compared here.
+        """
+        prev = self.getParam(channel)
+        if isinstance(value, str) or not isinstance(value, (np.ndarray, list, tuple)):
+            try:
+                return bool(prev != value)
+            except ValueError:
+                return True
+        mdel = self.db_cas_raw[channel].get("mdel", 0)
+        if mdel < 0:
+            return True
+        value = np.asarray(value)
+        prev = np.asarray(prev)
+        if value.shape != prev.shape or value.dtype.kind != prev.dtype.kind:
+            return True
+        if mdel > 0 and value.dtype.kind in "iuf":
+            return bool(np.max(np.abs(value - prev), initial=0) > mdel)
+        return not np.array_equal(value, prev)
+
+    def start(self):
+        self.cas_thread.start()
+
+    def stop(self):
+        self.cas_thread.stop()
+        # join needed to prevent a sigabrt in python3
+        self.cas_thread.join()
+
+    def __enter__(self):
+        self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
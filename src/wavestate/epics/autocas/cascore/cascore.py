@@ -10,16 +10,56 @@
 from wavestate import declarative
 
 from . import reactor
-from . import pcaspy_backend
-from . import pyepics_backend
+from . import asyncio_reactor
+from . import simulated_reactor
 from . import base_backend
 from . import cas9declarative
 from . import ctree
 
 
 class InstaCAS(base_backend.CASCollector, declarative.OverridableObject):
+    @cas9declarative.dproperty_ctree(default="threading")
+    def reactor_type(self, val):
+        """
+        Reactor implementation driving the tasks, may be one of [threading, asyncio, simulated].
+        The asyncio reactor runs the task queue from an asyncio event loop, so tasks
+        may return coroutines. The simulated reactor runs on a virtual clock which
+        jumps to each deadline rather than sleeping, for simulations and tests.
+        """
+        val = val.lower()
+        assert val in ["threading", "asyncio", "simulated"]
+        return val
+
+    @cas9declarative.dproperty_ctree(default="pcaspy")
+    def cas_backend(self, val):
+        """
+        Channel Access server hosting the channels, may be one of [pcaspy, python].
+        The python server is implemented in ca_server and does not need the EPICS
+        libraries, unless the program also connects to remote channels.
+        """
+        val = val.lower()
+        assert val in ["pcaspy", "python"]
+        return val
+
+    @cas9declarative.dproperty_ctree(default=None)
+    def cas_write_inbox(self, val):
+        """
+        Most client writes queued for the reactor to apply. Queued writes do not hold
+        up the CA server while the reactor runs long tasks, and further writes are
+        rejected once it is full. If null, writes are applied from the CA server
+        thread, waiting for the reactor between its tasks.
+        """
+        if val is not None:
+            val = int(val)
+            assert val > 0
+        return val
+
     @cas9declarative.dproperty
     def reactor(self):
+        if self.reactor_type == "asyncio":
+            return asyncio_reactor.AsyncioReactor()
+        elif self.reactor_type == "simulated":
+            return simulated_reactor.SimulatedReactor()
         return reactor.Reactor()
 
     @cas9declarative.dproperty
@@ -31,6 +71,15 @@ class InstaCAS(base_backend.CASCollector, declarative.OverridableObject):
             name="burt",
         )
 
+    @cas9declarative.dproperty
+    def statelog(self):
+        from ..subservices import state_log
+
+        return state_log.StateLog(
+            parent=self,
+            name="statelog",
+        )
+
     @cas9declarative.dproperty
     def settings(self):
         from ..subservices import program_status
@@ -70,8 +119,38 @@ class InstaCAS(base_backend.CASCollector, declarative.OverridableObject):
             val = "{0}{1}unnamed".format(
                 self.prefix_base, self.prefix_subsystem
             ).lower()
+        if self.shard_plan is not None and self.shard_plan.shard is not None:
+            val = "{0}_{1}".format(val, self.shard_plan.shard)
+        return val
+
+    @cas9declarative.dproperty
+    def shard_plan(self, val=None):
+        """
+        shard.ShardPlan if the program is split over several processes, or None
+        """
         return val
 
+    @cas9declarative.dproperty
+    def shard_service(self):
+        """
+        The supervisor of the worker processes, or the report to the supervisor in a worker
+        """
+        if self.shard_plan is None:
+            return None
+        from ..subservices import shards
+
+        if self.shard_plan.shard is None:
+            return shards.ShardSupervisor(
+                parent=self,
+                name="shard_supervisor",
+                prefix=self.prefix + (self.module_name, "shards"),
+            )
+        return shards.ShardReport(
+            parent=self,
+            name="shard_report",
+            report_fd=self.shard_plan.report_fd,
+        )
+
     @cas9declarative.dproperty
     def prefix(self):
         if self.prefix_subsystem is None:
@@ -87,22 +166,62 @@ class InstaCAS(base_backend.CASCollector, declarative.OverridableObject):
 
     def start(self):
         if self._db_generated is None:
+            # the CA libraries are only loaded once serving, so that the command line
+            # tools which only generate the db start quickly
+            if self.cas_backend == "python":
+                from . import ca_server_backend as server_backend
+            else:
+                from . import pcaspy_backend as server_backend
+
             self._db_generated = self.cas_db_generate()
-            self._cas_generated = pcaspy_backend.CADriverServer(
-                self._db_generated,
-                self.reactor,
-                saver=self.autosave,
-            )
-            self._cas_remote = pyepics_backend.CAEpicsClient(
+            # the createPV settings compiled by a previous start of the same layout
+            db_cas_static = None
+            if self.db_cache is not None:
+                cache = self.db_cache.load()
+                if cache is not None:
+                    db_cas_static = cache.get("cas_raw", None)
+            self._cas_generated = server_backend.CADriverServer(
                 self._db_generated,
                 self.reactor,
                 saver=self.autosave,
+                write_inbox=self.cas_write_inbox,
+                db_cas_static=db_cas_static,
             )
+            # pyepics is only needed to connect to remote channels, but the pcaspy
+            # backend has always loaded it
+            if self.cas_backend == "pcaspy" or any(
+                db_entry["remote"] for db_entry in self._db_generated.values()
+            ):
+                from . import pyepics_backend
+
+                self._cas_remote = pyepics_backend.CAEpicsClient(
+                    self._db_generated,
+                    self.reactor,
+                    saver=self.autosave,
+                )
             self._cas_generated.start()
-            self._cas_remote.start()
+            if self._cas_remote is not None:
+                self._cas_remote.start()
+            if self.db_cache is not None and db_cas_static is None:
+                try:
+                    self.db_cache.save(
+                        self._db_generated,
+                        self._cas_generated.db_cas_static,
+                    )
+                except (IOError, OSError) as E:
+                    # TODO, log better
+                    print("WARNING: could not write the PV db cache: {0}".format(E))
+            self.statelog.start_logging()
             return True
         return False
 
+    @cas9declarative.dproperty
+    def db_cache(self, val=None):
+        """
+        db_cache.PVDBCache to store the db layout in once started, or None
+        """
+        return val
+
     _db_generated = None
     _cas_generated = None
     _cas_remote = None
@@ -127,9 +246,11 @@ class InstaCAS(base_backend.CASCollector, declarative.OverridableObject):
     def stop(self):
         if self._db_generated is not None:
             self._cas_generated.stop()
-            self._cas_remote.stop()
+            if self._cas_remote is not None:
+                self._cas_remote.stop()
             self._db_generated = None
             self._cas_generated = None
+            self._cas_remote = None
 
     @cas9declarative.dproperty
     def config_files(self, val=None):
@@ -162,6 +283,20 @@ class InstaCAS(base_backend.CASCollector, declarative.OverridableObject):
 class CASUser(declarative.OverridableObject):
     name_default = None
 
+    def __new__(cls, **kwargs):
+        parent = kwargs.get("parent", None)
+        if parent is not None:
+            plan = parent.root.shard_plan
+            if plan is not None:
+                name = kwargs.get("name", None)
+                if name is None:
+                    name = cls.name_default
+                # objects hosted by other shard processes are never constructed
+                stub = plan.stub(parent, name, parent.ctree._path + (name,))
+                if stub is not None:
+                    return stub
+        return super(CASUser, cls).__new__(cls)
+
     @cas9declarative.dproperty
     def parent(self, val):
         return val
@@ -223,6 +358,10 @@ class CASUser(declarative.OverridableObject):
         return self.parent.ctree[self.name]
 
     def cas_host(self, rv, name=None, **kwargs):
+        plan = self.root.shard_plan
+        if plan is not None and not plan.hosts(self.ctree._path):
+            # the supervisor hosts the channels of the objects above the shard nodes
+            return
         return self.root.cas_host(
             rv=rv, name=name, self_prefix=self.prefix, ctree=self.ctree["PVs"], **kwargs
         )
@@ -8,18 +8,26 @@
 """
 """
 import logging
-from collections import namedtuple, Mapping
+from collections import namedtuple
+from collections.abc import Mapping
 
-from wavestate.bunch.deep_bunch import DeepBunchSingleAssign, DeepBunch
+from wavestate.bunch.deep_bunch import DeepBunch
 
 CTreeKey = namedtuple('CTreeKey', ['namespace', 'name'])
 
+#unique element to use as a default argument distinct from None
+_NOARG = ('no arg',)
+
+
 class ConfigTree(object):
     """
     This object is an access wrapper for configuration tree needs. Values can only be gathered using specific methods, rather than the typical
     dictionary/mapping interface.
+
+    It is a view of a path into the ConfigTreeRoot, which indexes the nodes by path and tracks their type, so views are cheap to
+    create and their nodes are only created once something is stored in them.
     """
-    __slots__ = ('_dict',)
+    __slots__ = ('_root', '_path')
     VALUE_KEY                = CTreeKey('ctree', 'value')
     CONFIG_KEY               = CTreeKey('ctree', 'config')
     DEFAULT_KEY              = CTreeKey('ctree', 'default')
@@ -27,24 +35,32 @@ class ConfigTree(object):
     CLASSIFICATION_KEY       = CTreeKey('ctree', 'classification')
     CLASSIFICATION_PRIME_KEY = CTreeKey('ctree', 'classification_prime')
 
-    def __init__(self, _subdict):
-        self._dict = _subdict
+    def __init__(self, _root, _path = ()):
+        self._root = _root
+        self._path = _path
         return
 
     def _keygen(self, name):
         return CTreeKey('ctree extra', name)
 
+    @property
+    def _dict(self):
+        """
+        The node dictionary of this view, or an empty dictionary if it has not been created
+        """
+        return self._root._nodes.get(self._path, {})
+
     def __getitem__(self, key):
-        subdict = self._dict[key]
+        path = self._path + (key,)
 
-        if self._check_type(subdict) in ['bad', 'value']:
+        if self._root._kinds.get(path, 'empty') in ['bad', 'value']:
             #TODO, make this check as safe as possible given what can come from configuration files
             logging.warning((
                 'Accessing Configuration Subtree For key {0} but'
                 ' it is storing a value for this key'
             ).format(key))
 
-        return self.__class__(_subdict = subdict,)
+        return self.__class__(_root = self._root, _path = path)
 
     #not wanted for config tree's, too confusing
     #def __getattr__(self, key):
@@ -53,22 +69,14 @@ class ConfigTree(object):
     #    except KeyError:
     #        raise AttributeError("'{0}' not in {1}".format(key, self))
 
-    def _check_type(self, subdict):
-        ctreekeys = 0
-        otherkeys = 0
-        for k in subdict:
-            if isinstance(k, CTreeKey):
-                ctreekeys += 1
-            else:
-                otherkeys += 1
-        if ctreekeys > 0 and otherkeys > 0:
-            return 'bad'
-        elif ctreekeys > 0:
-            return 'value'
-        elif otherkeys > 0:
-            return 'tree'
-        else:
-            return 'empty'
+    def _check_type(self, key = None):
+        """
+        The type of this node, or of its child key, one of 'tree', 'value', 'bad' or 'empty'
+        """
+        path = self._path
+        if key is not None:
+            path = path + (key,)
+        return self._root._kinds.get(path, 'empty')
 
     def get_configured(
             self,
@@ -88,34 +96,39 @@ class ConfigTree(object):
         validator: a function to validate/cast both the default setting and the configured setting
         to ensure correct typing. It may generate warnings
         """
-        cdict = self._dict[key]
+        root = self._root
+        path = self._path + (key,)
 
-        if self._check_type(cdict) in ['bad', 'tree']:
+        if root._kinds.get(path, 'empty') in ['bad', 'tree']:
             #TODO, make this check as safe as possible given what can come from configuration files
             logging.warning((
                 'Accessing Configuration For key {0} but'
                 ' it is storing a subtree rather than a single value'
             ).format(key))
 
-        try:
-            return cdict.get(self.VALUE_KEY)
-        except KeyError:
-            pass
+        cdict = root._nodes.get(path, None)
+        if cdict is not None:
+            value = cdict.get(self.VALUE_KEY, _NOARG)
+            if value is not _NOARG:
+                return value
+        else:
+            cdict = root._node_require(path)
 
         #normalize the classification if it is a single string
         if isinstance(classification, str):
             classification = [classification]
 
+        #values are only assigned once, the first annotation wins
         #add in annotation information if the keys are set
         if self.ABOUT_KEY is not None and about is not None:
-            cdict[self.ABOUT_KEY] = about
+            cdict.setdefault(self.ABOUT_KEY, about)
         if self.CLASSIFICATION_KEY is not None and classification is not None:
             #convert to a set for easier search later
-            cdict[self.CLASSIFICATION_KEY] = set(classification)
+            cdict.setdefault(self.CLASSIFICATION_KEY, set(classification))
         if self.CLASSIFICATION_PRIME_KEY is not None and classification is not None:
-            cdict[self.CLASSIFICATION_PRIME_KEY] = classification[0]
+            cdict.setdefault(self.CLASSIFICATION_PRIME_KEY, classification[0])
         for k, v in kwargs.items():
-            cdict[self._keygen(k)] = v
+            cdict.setdefault(self._keygen(k), v)
 
         #if the key is None then we are not storing defaults
         if self.DEFAULT_KEY is not None:
@@ -128,11 +141,8 @@ class ConfigTree(object):
                 ).format(key, default, ctdefault))
 
         #now check if it is already configured
-        try:
-            config = cdict.get(self.CONFIG_KEY)
-        except KeyError:
-            #no configuration, so use default
-            config = default
+        #no configuration, so use default
+        config = cdict.get(self.CONFIG_KEY, default)
 
         if validator is not None:
             use_value = validator(config)
@@ -145,13 +155,11 @@ class ConfigTree(object):
             use_value = config
 
         cdict[self.VALUE_KEY] = use_value
+        root._kind_add(path, True)
         return use_value
 
     def __contains__(self, key):
-        for d in self._dicts:
-            if key in d:
-                return True
-        return False
+        return key in self._dict
 
     def has_key(self, key):
         return key in self
@@ -171,17 +179,12 @@ class ConfigTree(object):
         if cycle:
             p.text(self.__class__.__name__ + '(<recurse>)')
         else:
-            with p.group(4, self.__class__.__name__ + '([', '])'):
-                first = True
-                for d in self._dicts:
-                    p.pretty(d)
-                    p.breakable()
-                if not first:
-                    p.text(',')
-                    p.breakable()
+            with p.group(4, self.__class__.__name__ + '(', ')'):
+                p.pretty(self._dict)
         return
 
 class ConfigTreeBare(ConfigTree):
+    __slots__ = ()
     #set these to None so that they are not stored
     DEFAULT_KEY        = None
     ABOUT_KEY          = None
@@ -189,32 +192,67 @@ class ConfigTreeBare(ConfigTree):
 
 
 class ConfigTreeRoot(object):
+    """
+    Stores the configuration tree as nested dictionaries. All nodes are indexed by their path in _nodes, built as the
+    configuration is loaded and as settings are requested, so lookups never walk the tree. _kinds tracks whether each
+    node holds a value (ctree keys), a subtree (other keys) or, erroneously, both. It is updated as nodes are modified
+    through ConfigTree or the loaders, which are the only writers.
+    """
 
     def __init__(
         self,
         annotations = True,
     ):
-        self._dict = DeepBunchSingleAssign()
+        self._dict = dict()
+        self._nodes = {(): self._dict}
+        self._kinds = dict()
         self.annotations = annotations
         if annotations:
-            self._ctree = ConfigTree(_subdict = self._dict)
+            self._ctree = ConfigTree(_root = self)
         else:
-            self._ctree = ConfigTreeBare(_subdict = self._dict)
+            self._ctree = ConfigTreeBare(_root = self)
 
     @property
     def ctree(self):
         return self._ctree
 
+    def _node_require(self, path):
+        """
+        The node dictionary at path, created along with its parents if needed
+        """
+        node = self._nodes.get(path, None)
+        if node is not None:
+            return node
+        parent_path = path[:-1]
+        parent = self._node_require(parent_path)
+        node = parent.setdefault(path[-1], dict())
+        self._nodes[path] = node
+        self._kind_add(parent_path, False)
+        return node
+
+    def _kind_add(self, path, ctreekey):
+        """
+        Update the type of the node at path for the addition of a ctree key (ctreekey = True) or of a subtree
+        """
+        kind = self._kinds.get(path, 'empty')
+        kind_new = 'value' if ctreekey else 'tree'
+        if kind == 'empty':
+            self._kinds[path] = kind_new
+        elif kind != kind_new and kind != 'bad':
+            self._kinds[path] = 'bad'
+        return
+
     def _key_load_recursive(self, key, nested_dict):
-        #subCD is the inner configuration dict
         #subND is the inner nested dict
-        def load_recursive(subCD, subND):
+        def load_recursive(path, subND):
             if isinstance(subND, Mapping):
                 for k, v in subND.items():
-                    load_recursive(subCD[k], v)
+                    load_recursive(path + (k,), v)
             else:
-                subCD[key] = subND
-        load_recursive(self._dict, nested_dict)
+                #assigned once, as for all ctree keys
+                self._node_require(path).setdefault(key, subND)
+                self._kind_add(path, True)
+        load_recursive((), nested_dict)
         return
 
     def _key_retrieve_recursive(self, key):
@@ -222,33 +260,23 @@ class ConfigTreeRoot(object):
         #storage dict
         SD = DeepBunch()
 
-        #subCD is the inner configuration dict
-        #subSD is the inner nested storage dict
-        def retrieve_recursive(subCD, subSD, elem_key):
-            ctreekeys = 0
-            otherkeys = 0
-            for k, v in subCD.items():
-                if isinstance(k, CTreeKey):
-                    ctreekeys += 1
-                else:
-                    otherkeys += 1
-                    #the key access of subSD is staggered with subCD
-                    #since the current key of subSD must be the previous key of subCD
-                    retrieve_recursive(v, subSD[elem_key], k)
-
-            if ctreekeys > 0 and otherkeys > 0:
+        for path, node in self._nodes.items():
+            if not path:
+                continue
+            kind = self._kinds.get(path, 'empty')
+            if kind == 'bad':
                 raise RuntimeError("Config tree somehow has both kinds of keys, internal ctree keys and standard keys")
-            elif ctreekeys > 0:
-                #didn't do the assignment during the for loop, so do it now
-                try:
-                    subSD[elem_key] = subCD.get(ctree_key)
-                except KeyError:
-                    #missing this type of ctree key, oh well
-                    pass
-
-        #the bottom should always have sub-dictionaries
-        for k, v in self._dict.items():
-            retrieve_recursive(v, SD, k)
+            elif kind != 'value':
+                continue
+            try:
+                value = node[ctree_key]
+            except KeyError:
+                #missing this type of ctree key, oh well
+                continue
+            subSD = SD
+            for k in path[:-1]:
+                subSD = subSD[k]
+            subSD[path[-1]] = value
         return SD
 
     def config_load_recursive(self, nested_dict):
@@ -270,5 +298,4 @@ class ConfigTreeRoot(object):
         return self._key_retrieve_recursive(ConfigTree.CLASSIFICATION_PRIME_KEY)
 
     def extra_retrieve_recursive(self, key):
-        return self._key_retrieve_recursive(self._dict._keygen(key))
-
+        return self._key_retrieve_recursive(self._ctree._keygen(key))
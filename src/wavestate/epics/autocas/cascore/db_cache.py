@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+On-disk cache of the generated PV db layout.
+
+The RelayValues are created by the program on each run, so the db itself must
+always be generated to serve. The layout (the channel names and their static
+settings) only depends on the configuration and the program source though, so the
+command line tools read it from this cache rather than constructing the program.
+Once served, the cache also holds the compiled createPV settings of the CAS driver
+(its db_cas_static), which later starts with the same key reuse.
+"""
+import os
+import sys
+import json
+import hashlib
+import importlib
+import tempfile
+from os import path
+
+import numpy as np
+
+from . import relay_values
+
+CACHE_VERSION = 2
+
+
+def package_source_files(names):
+    """
+    Source files of the modules or packages in names. All of the source files under
+    the package folders are included, since the modules of a program that are loaded
+    lazily may not have been imported yet.
+    """
+    fpaths = set()
+    for name in names:
+        module = sys.modules.get(name, None)
+        if module is None:
+            try:
+                module = importlib.import_module(name)
+            except ImportError:
+                continue
+        fpath = getattr(module, "__file__", None)
+        if fpath is not None and fpath.endswith(".py"):
+            fpaths.add(path.abspath(fpath))
+        for folder in getattr(module, "__path__", []):
+            for dirpath, dirnames, fnames in os.walk(folder):
+                dirnames[:] = [
+                    d for d in dirnames if d != "__pycache__" and not d.startswith(".")
+                ]
+                for fname in fnames:
+                    if fname.endswith(".py"):
+                        fpaths.add(path.abspath(path.join(dirpath, fname)))
+    return sorted(fpaths)
+
+
+def cache_key(config_files=(), source_files=(), extra=()):
+    """
+    Hash of the contents of the configuration and source files, and of the strings in extra
+    """
+    h = hashlib.sha256()
+    h.update("version {0}\n".format(CACHE_VERSION).encode("utf-8"))
+    for fpath in list(config_files) + list(source_files):
+        h.update(fpath.encode("utf-8"))
+        try:
+            with open(fpath, "rb") as F:
+                h.update(F.read())
+        except IOError:
+            h.update(b"<missing>")
+    for val in extra:
+        h.update(str(val).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _jsonable(val):
+    if isinstance(val, relay_values.RelayValueDecl):
+        val = val.value
+    if isinstance(val, np.ndarray):
+        return val.tolist()
+    if isinstance(val, np.generic):
+        return val.item()
+    if isinstance(val, (list, tuple)):
+        return [_jsonable(v) for v in val]
+    if val is None or isinstance(val, (bool, int, float, str)):
+        return val
+    return repr(val)
+
+
+def db_layout(db):
+    """
+    The static layout of a generated db, channel name to settings with the RelayValues removed
+    """
+    layout = dict()
+    for channel, db_entry in db.items():
+        layout[channel] = {
+            k: _jsonable(v) for k, v in db_entry.items() if k != "rv"
+        }
+    return layout
+
+
+class PVDBCache(object):
+    """
+    Cache file of a program's db layout. The file is replaced whenever the key changes.
+    """
+
+    def __init__(self, folder, name, key):
+        self.folder = folder
+        self.key = key
+        self.fpath = path.join(folder, "{0}.pvdb.json".format(name))
+
+    def load(self):
+        """
+        The cached dictionary with "channels", the db_layout, and "cas_raw", the
+        db_cas_static of the CAS driver if the program has been served. Returns None
+        if there is no cache for the current key.
+        """
+        try:
+            with open(self.fpath, "r") as F:
+                cache = json.load(F)
+        except (IOError, ValueError):
+            return None
+        if cache.get("key", None) != self.key:
+            return None
+        return cache
+
+    def save(self, db, db_cas_static=None):
+        """
+        Write the layout of the generated db, and optionally the db_cas_static of the
+        CAS driver serving it
+        """
+        cache = dict(
+            key=self.key,
+            channels=db_layout(db),
+        )
+        if db_cas_static is not None:
+            cache["cas_raw"] = {
+                channel: [
+                    {k: _jsonable(v) for k, v in entry.items()},
+                    list(elems_relay),
+                ]
+                for channel, (entry, elems_relay) in db_cas_static.items()
+            }
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            if not path.isdir(self.folder):
+                raise
+        # atomic rename, so concurrent readers only see complete caches
+        fd, fpath_temp = tempfile.mkstemp(dir=self.folder, suffix=".pvdb_temp")
+        try:
+            with os.fdopen(fd, "w") as F:
+                json.dump(cache, F)
+            os.rename(fpath_temp, self.fpath)
+        except Exception:
+            os.unlink(fpath_temp)
+            raise
+        return
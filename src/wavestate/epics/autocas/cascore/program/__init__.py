@@ -9,4 +9,4 @@
 """
 
 
-from . import config, list
+from . import config, list, snap
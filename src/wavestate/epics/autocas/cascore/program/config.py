@@ -11,6 +11,7 @@
 
 from wavestate import declarative
 from wavestate.declarative import argparse as declarg
+from wavestate.bunch.deep_bunch import DeepBunch
 
 from ...config import nested_dict_utils
 from ...config import pytoml
@@ -26,9 +26,7 @@ class ListArgs(
         """
         List the CAS PVs hosted by this task
         """
-        program = self.cmd.meta_program_generate()
-        #TODO, make this not list external
-        cas_db = program.root.cas_db_generate()
+        cas_db = self.cmd.db_layout()
         pvs = list(cas_db.keys())
         pvs.sort()
         for pv in pvs:
@@ -40,9 +38,7 @@ class ListArgs(
         """
         List the external PVs connected by this task
         """
-        program = self.cmd.meta_program_generate()
-        #TODO, make this not list external
-        cas_db = program.root.cas_db_generate()
+        cas_db = self.cmd.db_layout()
         pvs = list(cas_db.keys())
         pvs.sort()
         for pv in pvs:
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+"""
+import sys
+
+from wavestate import declarative
+from wavestate.declarative import argparse as declarg
+
+from ...subservices import snap_diff
+
+
+class SnapArgs(
+    declarg.OOArgParse,
+    declarative.OverridableObject
+):
+    """
+    Compare burt snapshots. Options must be given before the command.
+    """
+    @declarative.dproperty
+    def cmd(self, val):
+        return val
+
+    @declarg.argument(['-t', '--atol'], type = float, metavar = 'tol')
+    @declarative.dproperty
+    def atol(self, val = 0):
+        """
+        Absolute tolerance to consider numeric values equal
+        """
+        return val
+
+    @declarg.argument(['-r', '--rtol'], type = float, metavar = 'tol')
+    @declarative.dproperty
+    def rtol(self, val = 0):
+        """
+        Relative tolerance to consider numeric values equal
+        """
+        return val
+
+    @declarg.store_true(['-O', '--RO'])
+    @declarative.dproperty
+    def include_RO(self, val = False):
+        """
+        Also compare the read-only channels
+        """
+        return val
+
+    @declarg.store_true(['-A', '--apply'])
+    @declarative.dproperty
+    def apply(self, val = False):
+        """
+        When comparing live values, write the differing settings of the snapshot to the live channels. Read-only channels are never written.
+        """
+        return val
+
+    @declarg.command(takes_arguments = True)
+    def diff(self, argv):
+        """
+        diff [A.snap] B.snap. Compare two snapshots, or the live channels against a snapshot if only one is given. The live channels are read over channel access.
+        """
+        if len(argv) == 2:
+            fname_a, fname_b = argv
+            vals_a = snap_diff.snap_file_load(fname_a, include_RO = self.include_RO)
+            vals_b = snap_diff.snap_file_load(fname_b, include_RO = self.include_RO)
+            if self.apply:
+                print("Can only --apply to live channels", file = sys.stderr)
+                return 1
+        elif len(argv) == 1:
+            fname_b, = argv
+            vals_b = snap_diff.snap_file_load(fname_b, include_RO = self.include_RO)
+            vals_a = self.live_values(vals_b.keys())
+        else:
+            print("diff takes one or two snapshot files", file = sys.stderr)
+            return 1
+
+        diff = snap_diff.snap_diff(vals_a, vals_b, atol = self.atol, rtol = self.rtol)
+        for line in snap_diff.snap_diff_lines(diff):
+            print(line)
+
+        if self.apply:
+            return self.apply_diff(fname_b, vals_a, diff)
+        return 0
+
+    def live_values(self, pvs):
+        """
+        Dictionary of the current values of the channels pvs. Disconnected channels are left out.
+        """
+        import epics
+        pvs = sorted(pvs)
+        values = epics.caget_many(pvs)
+        return {pv: val for pv, val in zip(pvs, values) if val is not None}
+
+    def apply_diff(self, fname, vals_live, diff):
+        """
+        Write the changed settings of the snapshot to the live channels.
+        """
+        import epics
+        RO = snap_diff.snap_file_RO(fname)
+        pvs = []
+        values = []
+        for pv, (val_live, val_snap) in sorted(diff.changed.items()):
+            if pv in RO:
+                continue
+            pvs.append(pv)
+            values.append(snap_diff.value_typecast_like(val_snap, val_live))
+        if not pvs:
+            return 0
+        results = epics.caput_many(pvs, values, wait = True)
+        failed = 0
+        for pv, result in zip(pvs, results):
+            if result != 1:
+                print("WARNING: failed to write {0}".format(pv), file = sys.stderr)
+                failed += 1
+        print("Applied {0} of {1} settings".format(len(pvs) - failed, len(pvs)))
+        return 1 if failed else 0
@@ -9,6 +9,7 @@
 """
 import epics
 import time
+import threading
 import numpy as np
 
 from wavestate import declarative
@@ -16,10 +17,17 @@ from wavestate import declarative
 import warnings
 
 from . import relay_values
+from . import relay_throttle
 
 ca_element_count = epics.ca.element_count
 
 
+class _PV(epics.PV):
+    # newer pyepics defines __eq__ without __hash__, but PVs are used as keys
+    # for the connection bookkeeping. Only one PV is made per channel.
+    __hash__ = object.__hash__
+
+
 class CAEpicsClient(declarative.OverridableObject):
     @declarative.callbackmethod
     def connections_changed(self):
@@ -121,6 +129,14 @@ class CAEpicsClient(declarative.OverridableObject):
         self.reactor = reactor
         self.saver = saver
 
+        # CA callbacks only record events here, under the _events_lock. A single
+        # reactor task, sent when the first event arrives, delivers all of them.
+        # Connection events are kept in order, while monitor events are kept as an
+        # ordered set so that only the latest value of each PV is transferred.
+        self._events_lock = threading.Lock()
+        self._conn_events = []
+        self._monitor_events = {}
+
         db_cas_raw = {}
         rvdb_cas_raw = {}
 
@@ -135,21 +151,16 @@ class CAEpicsClient(declarative.OverridableObject):
             self.RV_connection_attached[rv] = False
             # provide a callback key so that we can avoid the callback during the write method
             if not db_entry["deferred"]:
-                rv.register(
-                    callback=self._put_cb_generator_immediate(rv),
-                    key=self,
-                )
+                put_cb = self._put_cb_generator_immediate(rv)
             else:
                 if deferred_write_period is not None and deferred_write_period > 0:
-                    rv.register(
-                        callback=self._put_cb_generator_deferred(rv),
-                        key=self,
-                    )
+                    put_cb = self._put_cb_generator_deferred(rv)
                 else:
-                    rv.register(
-                        callback=self._put_cb_generator_immediate(rv),
-                        key=self,
-                    )
+                    put_cb = self._put_cb_generator_immediate(rv)
+            rv.register(
+                callback=relay_throttle.throttled(self.reactor, put_cb, db_entry),
+                key=self,
+            )
 
             # setup relays for any of the channel values to be inserted
             for elem in [
@@ -212,72 +223,92 @@ class CAEpicsClient(declarative.OverridableObject):
 
     def _put_cb_generator_immediate(self, rv):
         def put_cb(value):
-            # a python2 safety as unicode objects crash the CAS
-            self.xfer_RV_to_PV(rv)
+            pv = self.RV_PV_map.get(rv, None)
+            if pv is None:
+                # not started, the connection will transfer the value
+                return
+            self.xfer_RV_to_PV(rv, pv)
 
         return put_cb
 
     def _put_cb_generator_deferred(self, rv):
         def put_cb(value):
-            pv = self.RV_to_PV[rv]
+            pv = self.RV_PV_map.get(rv, None)
+            if pv is None:
+                # not started, the connection will transfer the value
+                return
             self.pending_writes.add((rv, pv))
-            pass
 
         return put_cb
 
-    def _conn_cb_generator_deferred(self, rv):
+    def _connection_cb(self, pvname=None, conn=None, pv=None, **kwargs):
         """
         This gets called from the epics thread
         """
+        if conn is None or pv is None:
+            return
+        with self._events_lock:
+            send = not self._conn_events and not self._monitor_events
+            self._conn_events.append((pv, conn))
+        if send:
+            self.reactor.send_task(self._events_deliver)
+        return
 
-        def first_CB_event_deferred(*value, **kwargs):
-            conn = kwargs.get("conn", None)
-            pv = self.RV_PV_map[rv]
-            if conn is None:
-                return
-            elif conn:
+    def _monitor_cb(self, cb_info=None, **kwargs):
+        """
+        This gets called from the epics thread. The value is not kept, since
+        the PV holds the latest one when the events are delivered.
+        """
+        pv = cb_info[1]
+        with self._events_lock:
+            send = not self._conn_events and not self._monitor_events
+            self._monitor_events[pv] = None
+        if send:
+            self.reactor.send_task(self._events_deliver)
+        return
 
-                def conn_task():
-                    self._connection_start(rv, pv)
+    def _events_deliver(self):
+        with self._events_lock:
+            conn_events = self._conn_events
+            monitor_events = self._monitor_events
+            self._conn_events = []
+            self._monitor_events = {}
 
+        for pv, conn in conn_events:
+            rv = self.PV_RV_map.get(pv, None)
+            if rv is None:
+                continue
+            if conn:
+                self._connection_start(rv, pv)
             else:
+                self._connection_end(rv, pv)
 
-                def conn_task():
-                    self._connection_end(rv, pv)
-
-            self.reactor.send_task(conn_task)
-            return
-
-        return first_CB_event_deferred
+        for pv in monitor_events:
+            rv = self.PV_RV_map.get(pv, None)
+            if rv is None:
+                continue
+            # TODO, deal with deferred type
+            self.xfer_PV_to_RV(rv, pv)
+        return
 
     def start(self):
         for chn, db in self.db_cas_raw.items():
             rv = db["rv"]
-            pv = epics.PV(
+            # channels are created without waiting on them. Their searches are
+            # all sent by the single poll below.
+            pv = _PV(
                 chn,
-                connection_callback=self._conn_cb_generator_deferred(rv),
+                connection_callback=self._connection_cb,
                 auto_monitor=True,
             )
-
-            def cb_gen(rv, pv):
-                def update_cb_reactor():
-                    # TODO, deal with deferred type
-                    self.xfer_PV_to_RV(rv, pv)
-                    return
-
-                # this callback runs in the epics thread, so enqueue
-                # it in the reactor to be in the main thread
-                def update_cb(value, *args, **kwargs):
-                    return self.reactor.send_task(update_cb_reactor)
-
-                return update_cb
-
-            pv.add_callback(callback=cb_gen(rv, pv), index=self)
+            pv.add_callback(callback=self._monitor_cb, index=self)
 
             # register the PV as wanting a connection
             self.epics_pending_connections.add(pv)
             self.PV_RV_map[pv] = rv
             self.RV_PV_map[rv] = pv
+        if self.db_cas_raw:
+            epics.ca.poll()
         self.connections_changed()
         return
 
@@ -350,8 +381,8 @@ class CAEpicsClient(declarative.OverridableObject):
         return
 
     def write_pending(self):
-        for rv in self.pending_writes:
-            self.xfer_RV_to_PV(rv)
+        for rv, pv in self.pending_writes:
+            self.xfer_RV_to_PV(rv, pv)
         self.pending_writes.clear()
 
     def read_pending(self):
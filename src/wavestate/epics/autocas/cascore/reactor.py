@@ -6,25 +6,33 @@
 # NOTICE: authors should document their contributions in concisely in NOTICE
 # with details inline in source files, comments, and docstrings.
 """
+The Reactor runs the tasks of a program from a single thread, holding the task_lock.
+
+Deadlines are kept on the monotonic clock, so that steps of the wall clock neither
+burst nor stall the timed tasks. The times given to the scheduling methods
+(mtime_at, mtime_to, run_at and the modulo_s alignment) are wall-clock (UNIX) times,
+which are converted to the clock as they are scheduled. Looping tasks re-align to
+the wall-clock period boundaries every run, so they stay phase-locked to the seconds
+of the wall clock across its steps.
 """
 
+import math
 import threading
 import time
 import functools
 from wavestate.bunch import Bunch
 
-try:
-    import queue as queue
-except ImportError:
-    import Queue as queue
+import queue
 import sys
 import collections
+import itertools
 
 from declarative.callbacks import callbackmethod
-from ..utilities.priority_queue import HeapPriorityQueue
+from ..utilities.priority_queue import IndexedPriorityQueue
 
 
 from . import interrupt_delay
+from . import reactor_stats
 
 TThread = threading.Thread
 
@@ -38,11 +46,16 @@ class Reactor(object):
     time = time.time
     Event = threading.Event
     Queue = queue.Queue
-    max_wait_s = 1 / 4.0
 
-    _task_queue = None
+    _task_deque = None
 
-    def __init__(self, task_lock=None):
+    def __init__(self, task_lock=None, batch_max=256, batch_max_s=0.02):
+        """
+        batch_max is the most ready tasks drained per acquisition of the task_lock and
+        SIGINT guard, and batch_max_s is the time budget after which the rest of a batch
+        is put back so that other threads may take the task_lock. batch_max=1 runs each
+        task under its own acquisition. batch_max_s of None removes the time budget.
+        """
         self._current_reactor_thread = None
         self._canary_thread = None
         self._task_num = 0
@@ -55,10 +68,24 @@ class Reactor(object):
         else:
             self.task_lock = task_lock
         self.rate_latency_check = 1000
-
-        # rendezvous point for the queue to be generated
-        self._task_queue = queue.Queue()
-        self._pqueue = HeapPriorityQueue()
+        self.batch_max = batch_max
+        self.batch_max_s = batch_max_s
+
+        # a single condition guards both the immediate deque and the timed heap.
+        # The reactor sleeps on it until the earliest deadline and is only notified
+        # for immediate sends or for timed sends that preempt that deadline.
+        self._task_cv = threading.Condition(threading.Lock())
+        # immediate tasks are stored as (mtime_sent, item) pairs, so that the queue wait can be measured
+        self._task_deque = collections.deque()
+        # timed tasks are indexed by key so that keyed tasks from _enqueue can be rescheduled
+        # or cancelled in place. Anonymous timed sends use integer keys from _pqueue_count,
+        # while _enqueue keys are wrapped in a 1-tuple so the two never collide.
+        self._pqueue = IndexedPriorityQueue()
+        self._pqueue_count = itertools.count()
+        # set while the reactor sleeps on _task_cv so the canary doesn't mistake idle for stuck
+        self._task_waiting = False
+        # set to a reactor_stats.ReactorStats to record per-task wait and run times
+        self.stats = None
 
         # this is a map from task keys to bunches storing run metadata for eager-rate-limiting queuing
         self._task_map = dict()
@@ -86,8 +113,8 @@ class Reactor(object):
         while True:
             tnum = self._task_num
             if tnum is not None:
-                time_now = time.time()
-                if tnum != last_task_num:
+                time_now = time.monotonic()
+                if tnum != last_task_num or self._task_waiting:
                     if last_task_time == sys.float_info.max:
                         self.canary_revived()
                     last_task_num = tnum
@@ -116,134 +143,230 @@ class Reactor(object):
         modulo_s=None,
         mtime_to=None,
     ):
-        if for_s is not None:
-            if mtime_to is None:
-                mtime_to = time.time()
-            mtime_to += for_s
-
-        if modulo_s is not None:
-            if mtime_to is None:
-                mtime_to = time.time()
-            mtime_to = mtime_to + modulo_s - mtime_to % modulo_s
+        mtime_to = self._flush_mtime_to(
+            for_s=for_s,
+            modulo_s=modulo_s,
+            mtime_to=mtime_to,
+        )
         # if mtime_to is None at this point, then it means to flush and quit immediately
 
         self._queue_lock.acquire()
         self.task_lock.release()
         self._current_reactor_thread = threading.current_thread()
         try:
-            task_num = self._task_num
+            # with no mtime_to, only flush what is ready and return immediately
+            block = mtime_to is not None
             while True:
-                task_num += 1
-                self._task_num = task_num
-                mtime = time.time()
-                if self._pqueue:
-                    ntime, nitem = self._pqueue.peek()
-                    if ntime < mtime:
-                        item = nitem
-                        self._pqueue.pop()
-                    else:
-                        try:
-                            item = self._task_queue.get(False)
-                        except queue.Empty:
-                            if mtime_to is None or mtime >= mtime_to:
-                                break
-                            try:
-                                self._queue_lock.release()
-                                item = self._task_queue.get(
-                                    True,
-                                    min(
-                                        mtime_to - mtime, ntime - mtime, self.max_wait_s
-                                    ),
-                                )
-                            except queue.Empty:
-                                continue
-                            finally:
-                                self._queue_lock.acquire()
-                else:
-                    try:
-                        item = self._task_queue.get(False)
-                    except queue.Empty:
-                        if mtime_to is None or mtime >= mtime_to:
-                            break
-                        try:
-                            self._queue_lock.release()
-                            item = self._task_queue.get(
-                                True, min(mtime_to - mtime, self.max_wait_s)
-                            )
-                        except queue.Empty:
-                            continue
-                        finally:
-                            self._queue_lock.acquire()
-                if item is _EXIT:
+                batch = self._next_batch(mtime_to=mtime_to, block=block)
+                if not batch:
+                    break
+                do_exit = batch[-1][1] is _EXIT
+                if do_exit:
+                    batch.pop()
+                # print("FLUSH: ", batch)
+                self._run_batch(batch)
+                if do_exit:
                     break
-                else:
-                    # print("FLUSH: ", item)
-                    with self.task_lock, keyboard_interrupt_delay:
-                        item()
         finally:
             self._current_reactor_thread = None
             self.task_lock.acquire()
             self._queue_lock.release()
         return
 
+    def _flush_mtime_to(self, for_s=None, modulo_s=None, mtime_to=None):
+        """
+        The clock deadline to flush to from the wall-clock mtime_to, for_s and
+        modulo_s, or None to only flush what is ready
+        """
+        if mtime_to is None:
+            if modulo_s is None:
+                if for_s is None:
+                    return None
+                return self.clock() + for_s
+            mtime_to = self.time()
+        if for_s is not None:
+            mtime_to += for_s
+
+        if modulo_s is not None:
+            mtime_to = mtime_to + modulo_s - mtime_to % modulo_s
+        return self._clock_at(mtime_to)
+
     def time(self):
+        """
+        The wall-clock (UNIX) time, which mtime_at, mtime_to and modulo_s refer to
+        """
         return time.time()
 
+    def clock(self):
+        """
+        The monotonic time of the task deadlines, unaffected by steps of the wall clock
+        """
+        return time.monotonic()
+
+    def _clock_at(self, mtime):
+        """
+        The clock deadline of a wall-clock time, at the current offset of the clocks
+        """
+        return mtime - self.time() + self.clock()
+
+    def _pop_ready(self, mtime):
+        """
+        Pops up to batch_max (mtime_ready, item) pairs that are runnable at mtime.
+        Timed items that are due come first, then immediate ones. The batch stops
+        after an _EXIT item. Must be called holding the _task_cv.
+        """
+        batch = []
+        pqueue = self._pqueue
+        task_deque = self._task_deque
+        batch_max = self.batch_max
+        while pqueue and len(batch) < batch_max:
+            ntime, nitem = pqueue.peek()
+            if ntime > mtime:
+                break
+            pqueue.pop()
+            batch.append((ntime, nitem))
+        while task_deque and len(batch) < batch_max:
+            pair = task_deque.popleft()
+            batch.append(pair)
+            if pair[1] is _EXIT:
+                break
+        if batch and self.stats is not None:
+            self.stats.record_fill(len(batch) + len(task_deque))
+        return batch
+
+    def _next_batch(self, mtime_to=None, block=True):
+        """
+        Pops a batch using _pop_ready under one acquisition of the task condition.
+        If nothing is runnable, sleeps on the task condition until either a task is
+        sent or the earliest deadline (or mtime_to) arrives.
+
+        Returns an empty list if nothing is runnable by mtime_to, or right away if
+        not block and mtime_to is None. Must be called holding the _queue_lock,
+        which is released while sleeping.
+        """
+        cv = self._task_cv
+        cv.acquire()
+        try:
+            while True:
+                mtime = self.clock()
+                batch = self._pop_ready(mtime)
+                if batch:
+                    return batch
+
+                if mtime_to is not None:
+                    if mtime >= mtime_to:
+                        return batch
+                elif not block:
+                    return batch
+                wait_s = self._wait_s(mtime, mtime_to)
+
+                self._task_waiting = True
+                self._queue_lock.release()
+                try:
+                    cv.wait(wait_s)
+                finally:
+                    self._task_waiting = False
+                    # drop the condition before retaking the queue lock, since a
+                    # thread holding capture() may be blocked sending a task
+                    cv.release()
+                    try:
+                        self._queue_lock.acquire()
+                    finally:
+                        cv.acquire()
+        finally:
+            cv.release()
+
+    def _wait_s(self, mtime, mtime_to=None):
+        """
+        Time to sleep until the earliest deadline or mtime_to, None if there is neither.
+        Must be called holding the _task_cv.
+        """
+        wait_s = None
+        if self._pqueue:
+            wait_s = self._pqueue.peek()[0] - mtime
+        if mtime_to is not None:
+            if wait_s is None or mtime_to - mtime < wait_s:
+                wait_s = mtime_to - mtime
+        return wait_s
+
+    def _run_batch(self, batch):
+        """
+        Runs the items of a batch under a single task_lock and SIGINT guard. If the
+        batch_max_s budget runs out or an item raises, the items not yet run are put
+        back at the front of the immediate queue.
+        """
+        if not batch:
+            return
+        idx = 0
+        stats = self.stats
+        try:
+            with self._batch_lock(), keyboard_interrupt_delay:
+                if self.batch_max_s is not None:
+                    mtime_end = self.clock() + self.batch_max_s
+                else:
+                    mtime_end = None
+                for mtime_ready, item in batch:
+                    self._task_num += 1
+                    idx += 1
+                    if stats is None:
+                        ret = item()
+                    else:
+                        mtime_start = self.clock()
+                        ret = item()
+                        stats.record(
+                            item, mtime_start - mtime_ready, self.clock() - mtime_start
+                        )
+                    if ret is not None:
+                        self._item_returned(ret)
+                    if mtime_end is not None and self.clock() > mtime_end:
+                        break
+        finally:
+            if idx < len(batch):
+                with self._task_cv:
+                    self._task_deque.extendleft(reversed(batch[idx:]))
+        return
+
+    def _batch_lock(self):
+        """
+        The lock held while running a batch
+        """
+        return self.task_lock
+
+    def _item_returned(self, ret):
+        """
+        Called with the return value of any task returning something other than None
+        """
+        return
+
+    def _wake(self):
+        """
+        Wake the sleeping reactor. Must be called holding the _task_cv.
+        """
+        self._task_cv.notify()
+
     def _reactor_loop(self):
         self._queue_lock.acquire()
         self.task_lock.release()
         try:
             self._current_reactor_thread = threading.current_thread()
-            task_num = self._task_num
             while True:
-                task_num += 1
-                self._task_num = task_num
-                mtime = time.time()
-                if self._pqueue:
-                    ntime, nitem = self._pqueue.peek()
-                    if ntime <= mtime:
-                        item = nitem
-                        self._pqueue.pop()
-                    else:
-                        try:
-                            item = self._task_queue.get(False)
-                        except queue.Empty:
-                            try:
-                                self._queue_lock.release()
-                                item = self._task_queue.get(
-                                    True, min(ntime - mtime, self.max_wait_s)
-                                )
-                            except queue.Empty:
-                                continue
-                            finally:
-                                self._queue_lock.acquire()
-                else:
-                    try:
-                        item = self._task_queue.get(False)
-                    except queue.Empty:
-                        try:
-                            self._queue_lock.release()
-                            item = self._task_queue.get(True, self.max_wait_s)
-                        except queue.Empty:
-                            continue
-                        finally:
-                            self._queue_lock.acquire()
-                if item is _EXIT:
+                batch = self._next_batch()
+                do_exit = batch[-1][1] is _EXIT
+                if do_exit:
+                    batch.pop()
+                self._run_batch(batch)
+                if do_exit:
                     break
-                else:
-                    with self.task_lock, keyboard_interrupt_delay:
-                        item()
-            try:
-                # slurp up remaining tasks
-                while True:
-                    task_num += 1
-                    self._task_num = task_num
-
-                    item = self._task_queue.get_nowait()
-                    with self.task_lock, keyboard_interrupt_delay:
-                        item()
-            except queue.Empty:
-                pass
+            # slurp up remaining tasks
+            while True:
+                with self._task_cv:
+                    batch = [
+                        pair for pair in self._task_deque if pair[1] is not _EXIT
+                    ]
+                    self._task_deque.clear()
+                if not batch:
+                    break
+                self._run_batch(batch)
         finally:
             self._current_reactor_thread = None
             self.task_lock.acquire()
@@ -251,35 +374,62 @@ class Reactor(object):
         return
 
     def loop_kill(self):
-        self._task_queue.put(_EXIT)
+        with self._task_cv:
+            self._task_deque.append((self.clock(), _EXIT))
+            self._wake()
 
     def reactor_shutdown(self):
         return self.loop_kill()
 
     def _check_latency(self, send_time):
-        now_time = time.time()
-        self.latency_cb(now_time - send_time, self._task_queue.qsize())
+        now_time = self.clock()
+        self.latency_cb(now_time - send_time, len(self._task_deque))
 
     def send_task(self, item, run_at=None):
-        if not isinstance(item, collections.Callable):
+        """
+        Send a nullary callable to be run by the reactor, once the wall-clock time
+        run_at has passed if given.
+        """
+        if not callable(item):
             raise RuntimeError("Reactor Item must be a nullary Callable")
         self._task_send_num += 1
         if (self._task_send_num % self.rate_latency_check) == 0:
-            my_time = time.time()
+            my_time = self.clock()
             self.send_task(lambda: self._check_latency(my_time))
-        _queue = self._task_queue
-        if _queue is None:
+        if self._task_deque is None:
             print(("Send occured after queue death! {0}".format(item)))
             return
         if run_at is None:
-            _queue.put(item)
+            cv = self._task_cv
+            with cv:
+                self._task_deque.append((self.clock(), item))
+                self._wake()
         else:
-            self._pqueue.push(QueueItem(run_at, item))
-            # put a do nother item in the main queue to force a wakeup if nothing is currently in it
-            # TODO see if this can be avoided if an item is already in the queue (race condition?)
-            _queue.put(lambda: None)
+            self._send_timed(next(self._pqueue_count), self._clock_at(run_at), item)
+        return
+
+    def _send_timed(self, pkey, run_at, item):
+        """
+        Insert or reschedule the timed item stored under pkey in the priority queue,
+        to run at the clock deadline run_at
+        """
+        cv = self._task_cv
+        with cv:
+            pqueue = self._pqueue
+            # only wake the reactor if this deadline preempts the one it is sleeping toward
+            if not pqueue or run_at < pqueue.peek()[0]:
+                self._wake()
+            pqueue.push(pkey, run_at, item)
         return
 
+    def _cancel_timed(self, pkey):
+        """
+        Remove the timed item stored under pkey from the priority queue, if it is still queued.
+        No wakeup is needed since removal can only push the next deadline later.
+        """
+        with self._task_cv:
+            return self._pqueue.discard(pkey)
+
     def cb_send_task(self, cb):
         def deferred(*args, **kwargs):
             self.send_task(lambda: cb(*args, **kwargs))
@@ -317,11 +467,15 @@ class Reactor(object):
         """
         a period_s of None (default) stops any looping!
         skip_cb is called if the loop is ever skipped
+
+        The runs are aligned to multiples of period_s of the wall clock. How late
+        each run starts is recorded, see loop_jitters.
         """
         loop_settings = Bunch()
         loop_settings.period_s = period_s
         loop_settings.skip_fraction = skip_fraction
         loop_settings.skip_cb = skip_cb
+        loop_settings.jitter = reactor_stats.StreamingHistogram()
         if period_s is not None:
             return self._enqueue(
                 command,
@@ -340,6 +494,17 @@ class Reactor(object):
                 force_requeue=True,
             )
 
+    def loop_jitters(self):
+        """
+        Returns a dictionary of the keys of the looping tasks to StreamingHistograms of
+        how late their runs started after their deadlines, in seconds
+        """
+        jitters = dict()
+        for key, qdata in list(self._task_map.items()):
+            if qdata.loop_settings is not None:
+                jitters[key] = qdata.loop_settings.jitter
+        return jitters
+
     def _enqueue(
         self,
         command,
@@ -350,6 +515,7 @@ class Reactor(object):
         modulo_s=None,
         force_requeue=False,
         loop_settings=None,
+        clock_at=None,
     ):
         """
         Specialty method for rate-limited queuing. The task is keyed and so this can be called multiple times and it won't requeue. If it is already queued, the timing can be
@@ -361,20 +527,27 @@ class Reactor(object):
 
         if mtime_at, future_s and modulo_s are all None, then the task is unqueued. force_requeue does not need to be specified for this to happen
         if loop_settings is set, then the command will be re-queued
+
+        mtime_at and the modulo_s alignment are in wall-clock time, but the queue time is
+        kept on the clock. clock_at gives the queue time on the clock directly instead.
         """
         if key is None:
             key = command
 
-        mtime = mtime_at
-        if future_s is not None:
+        if clock_at is not None:
+            mtime = clock_at
+        elif mtime_at is None and future_s is None and modulo_s is None:
+            mtime = None
+        else:
+            mtime = mtime_at
             if mtime is None:
-                mtime = time.time()
-            mtime += future_s
+                mtime = self.time()
+            if future_s is not None:
+                mtime += future_s
 
-        if modulo_s is not None:
-            if mtime is None:
-                mtime = time.time()
-            mtime = mtime + modulo_s - mtime % modulo_s
+            if modulo_s is not None:
+                mtime = mtime + modulo_s - mtime % modulo_s
+            mtime = self._clock_at(mtime)
         # if mtime is None at this point, then it means to not enqueue or to cancel queuing if force_requeue is set
 
         qdat_prev = self._task_history.get(key, None)
@@ -384,9 +557,13 @@ class Reactor(object):
             if limit_s is not None and (mtime - qdat_prev.mtime < limit_s):
                 mtime = qdat_prev.mtime + limit_s
 
+        # keyed tasks occupy a single slot in the priority queue, rescheduling replaces it
+        pkey = (key,)
+
         # create a closure for the task which is aware of the qdata bunch.
-        # that bunch allows this task wrapper to be cancellable and loopable
-        # if the qdata has_run is changed to False, then the task will be cancelled
+        # that bunch allows this task wrapper to be loopable. Cancelled tasks are removed from
+        # the priority queue, but has_run is still set so that a task already popped by the
+        # reactor (racing with an enqueue from another thread) cannot run twice.
         def inner_task():
             if not qdata.has_run:
                 qdata.has_run = True
@@ -402,29 +579,40 @@ class Reactor(object):
 
                 if loop_settings is not None:
                     if loop_settings.period_s is not None:
-                        mtime_current = time.time()
-                        mtime_last = qdata.mtime
-                        mtime_next = (
-                            mtime_last
-                            + loop_settings.period_s
-                            - mtime_last % loop_settings.period_s
+                        period_s = loop_settings.period_s
+                        mtime_current = self.clock()
+                        loop_settings.jitter.add(max(mtime_current - qdata.mtime, 0))
+                        # the next period on the clock, re-aligned to the nearest
+                        # wall-clock period boundary. Steps of the wall clock only
+                        # shift the loop by up to half a period.
+                        mtime_next = qdata.mtime + period_s
+                        wtime_next = mtime_next + self.time() - mtime_current
+                        mtime_next += (
+                            round(wtime_next / period_s) * period_s - wtime_next
                         )
 
-                        fraction = (mtime_next - mtime_current) / loop_settings.period_s
+                        fraction = (mtime_next - mtime_current) / period_s
                         if fraction < loop_settings.skip_fraction:
-                            mtime_next += loop_settings.period_s
+                            # skip every missed period, rather than running in a burst
+                            mtime_next += period_s * math.ceil(
+                                loop_settings.skip_fraction - fraction
+                            )
                             skip_cb = loop_settings.skip_cb
                             if skip_cb is not None:
                                 skip_cb()
                         self._enqueue(
                             qdata.command,
                             qdata.key,
-                            mtime_at=mtime_next,
+                            clock_at=mtime_next,
                             loop_settings=loop_settings,
                         )
 
-                # run the task last, after updating the task run setup
-                qdata.command()
+                # run the task last, after updating the task run setup. The result is
+                # returned so that reactors may run the coroutines of async tasks.
+                return qdata.command()
+
+        # lets instrumentation see the command rather than this wrapper
+        inner_task.__wrapped__ = command
 
         if qdat_current is not None:
             # task currently exists and we need to update the time
@@ -433,24 +621,26 @@ class Reactor(object):
                 # remove the task
                 # first tell the task not to run itself
                 qdat_current.has_run = True
+                self._cancel_timed(pkey)
                 # set it to None so the later block can return the correct value
                 qdat_current = None
                 self._task_map.pop(key)
             elif mtime < qdat_current.mtime:
-                # push up the run time and reinject the task
+                # push up the run time, replacing the queued task in-place
                 qdat_current.mtime = mtime
                 # have to specify qdata because the closure of inner_task needs it
                 qdata = qdat_current
-                self.send_task(inner_task, run_at=mtime)
+                self._send_timed(pkey, mtime, inner_task)
             elif force_requeue or loop_settings is not None:
                 qdat_current.has_run = True
+                self._cancel_timed(pkey)
                 # go ahead and remove it from the map for safety
                 self._task_map.pop(key)
-                # set it to None so the later block reqeueues it
-                qdat_current = None
                 # carry over if the task was looping and it is not forcing new loop settings
                 if loop_settings is None:
                     loop_settings = qdat_current.loop_settings
+                # set it to None so the later block reqeueues it
+                qdat_current = None
                 # this is more complex as we have to cancel the current task and recreate the qdata
 
         # handle task creation and injection
@@ -465,7 +655,7 @@ class Reactor(object):
                 qdata.loop_settings = loop_settings
 
                 self._task_map[key] = qdata
-                self.send_task(inner_task, run_at=mtime)
+                self._send_timed(pkey, mtime, inner_task)
             else:
                 # if mtime is None here, then the task should NOT be queued or re-queued
                 pass
@@ -556,27 +746,3 @@ class Reactor(object):
     def latency_cb(self, latency_s, latency_items):
         return
 
-
-class QueueItem(collections.namedtuple("QueueTuple", ["run_at", "item"])):
-    """
-    Need a special container for the (mtime_run, item) pairs used in the scheduler.
-    The heap queue sometimes sorts on the second item and function callbacks cannot be sorted.
-    """
-
-    def __lt__(self, other):
-        return self[0] < other[0]
-
-    def __gt__(self, other):
-        return self[0] > other[0]
-
-    def __eq__(self, other):
-        return self[0] == other[0]
-
-    def __le__(self, other):
-        return self[0] <= other[0]
-
-    def __ge__(self, other):
-        return self[0] >= other[0]
-
-    def __ne__(self, other):
-        return self[0] != other[0]
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Instrumentation for the Reactor. When a ReactorStats object is set as
+Reactor.stats, every task run records its queue-wait (time from being ready
+to starting) and its run time, both globally and per task label.
+"""
+import math
+import heapq
+
+
+class StreamingHistogram(object):
+    """
+    Fixed-memory histogram of durations in seconds using logarithmically spaced
+    bins, so quantiles are accurate to a relative bin width regardless of scale.
+    The exact maximum is tracked separately.
+    """
+
+    __slots__ = ("min_s", "bins_per_decade", "counts", "count", "max", "total")
+
+    def __init__(self, min_s=1e-6, max_s=100.0, bins_per_decade=20):
+        self.min_s = min_s
+        self.bins_per_decade = bins_per_decade
+        Nbins = int(math.ceil(math.log10(max_s / min_s) * bins_per_decade)) + 2
+        self.counts = [0] * Nbins
+        self.count = 0
+        self.max = 0
+        self.total = 0
+
+    def add(self, val_s):
+        if val_s <= self.min_s:
+            idx = 0
+        else:
+            idx = int(math.log10(val_s / self.min_s) * self.bins_per_decade) + 1
+            if idx >= len(self.counts):
+                idx = len(self.counts) - 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += val_s
+        if val_s > self.max:
+            self.max = val_s
+
+    def quantile(self, q):
+        """
+        Return the upper edge of the bin containing the q quantile (0 <= q <= 1),
+        clipped to the maximum seen. Returns 0 if empty.
+        """
+        if self.count == 0:
+            return 0
+        target = q * self.count
+        accum = 0
+        for idx, cnt in enumerate(self.counts):
+            accum += cnt
+            if accum >= target and cnt > 0:
+                edge = self.min_s * 10 ** (idx / self.bins_per_decade)
+                return min(edge, self.max)
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return 0
+        return self.total / self.count
+
+    def clear(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.max = 0
+        self.total = 0
+
+
+class TaskStats(object):
+    """
+    Cumulative statistics for a single task label
+    """
+
+    __slots__ = ("label", "wait", "run")
+
+    def __init__(self, label):
+        self.label = label
+        self.wait = StreamingHistogram()
+        self.run = StreamingHistogram()
+
+
+def task_label(item):
+    """
+    Generate a readable label for a reactor item. Wrappers, such as the keyed
+    tasks of Reactor.enqueue, expose the user command through __wrapped__.
+    """
+    item = getattr(item, "__wrapped__", item)
+    func = getattr(item, "func", None)
+    if func is not None:
+        # functools.partial
+        item = func
+    name = getattr(item, "__qualname__", None)
+    if name is None:
+        name = getattr(item, "__name__", None)
+    if name is None:
+        return repr(item)
+    owner = getattr(item, "__self__", None)
+    if owner is not None:
+        oname = getattr(owner, "name", None)
+        if isinstance(oname, str):
+            return "{0}[{1}]".format(name, oname)
+    return name
+
+
+class ReactorStats(object):
+    """
+    Collects queue-wait and run time for every task run by a Reactor.
+
+    The global wait and run histograms, the run count and the maximum fill form
+    a window which is restarted by :meth:`window_reset`, typically each time the
+    statistics are published. Per-label statistics accumulate until :meth:`reset`.
+    """
+
+    def __init__(self):
+        self.wait = StreamingHistogram()
+        self.run = StreamingHistogram()
+        self.fill_max = 0
+        self.tasks = dict()
+        self.window_mtime = None
+
+    def record(self, item, wait_s, run_s):
+        self.wait.add(wait_s)
+        self.run.add(run_s)
+
+        # keyed on the underlying callable to avoid building labels every run. Plain
+        # functions key on their code object, so that lambdas sent from the same
+        # place in the source share statistics rather than growing the dict forever.
+        ident = getattr(item, "__wrapped__", item)
+        ident = getattr(ident, "func", ident)
+        if getattr(ident, "__self__", None) is None:
+            ident = getattr(ident, "__code__", ident)
+        tstats = self.tasks.get(ident, None)
+        if tstats is None:
+            try:
+                tstats = self.tasks[ident] = TaskStats(task_label(item))
+            except TypeError:
+                # unhashable callables are lumped together by label
+                label = task_label(item)
+                tstats = self.tasks.setdefault(label, TaskStats(label))
+        tstats.wait.add(wait_s)
+        tstats.run.add(run_s)
+
+    def record_fill(self, fill):
+        if fill > self.fill_max:
+            self.fill_max = fill
+
+    def top_slowest(self, N=5):
+        """
+        Returns the TaskStats of the N labels with the largest maximum run time
+        """
+        return heapq.nlargest(N, self.tasks.values(), key=lambda ts: ts.run.max)
+
+    def top_total(self, N=5):
+        """
+        Returns the TaskStats of the N labels with the largest total run time
+        """
+        return heapq.nlargest(N, self.tasks.values(), key=lambda ts: ts.run.total)
+
+    def window_reset(self, mtime):
+        """
+        Restart the global window. Returns the window duration in seconds, or None for the first window.
+        """
+        if self.window_mtime is None:
+            duration_s = None
+        else:
+            duration_s = mtime - self.window_mtime
+        self.window_mtime = mtime
+        self.wait.clear()
+        self.run.clear()
+        self.fill_max = 0
+        return duration_s
+
+    def reset(self):
+        self.window_mtime = None
+        self.wait.clear()
+        self.run.clear()
+        self.fill_max = 0
+        self.tasks.clear()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Throttling of RelayValue callbacks to the CA backends, configured through the
+max_rate_hz and deadband arguments of cas_host.
+"""
+import numpy as np
+
+_NOVALUE = ("no value",)
+
+
+class RelayThrottle(object):
+    """
+    Wraps a RelayValue callback so that it is called at most max_rate_hz times per
+    second and only for changes larger than deadband from the last delivered value.
+    Updates held back by either are coalesced, and the latest is always delivered
+    as a trailing update through the reactor. Those held by the rate are delivered
+    once it allows, while changes within the deadband are delivered once the value
+    has settled for trailing_s.
+
+    Must be called from the reactor (holding the task_lock), like the callbacks it wraps.
+    """
+
+    # the settling time before a change inside the deadband is delivered
+    trailing_s = 1.0
+
+    def __init__(
+        self,
+        reactor,
+        callback,
+        max_rate_hz=None,
+        deadband=None,
+        trailing_s=None,
+    ):
+        self.reactor = reactor
+        self.callback = callback
+        if max_rate_hz is not None and max_rate_hz > 0:
+            self.period_s = 1.0 / max_rate_hz
+        else:
+            self.period_s = 0
+        self.deadband = deadband
+        if trailing_s is not None:
+            self.trailing_s = trailing_s
+        self._last_value = _NOVALUE
+        # on the monotonic reactor clock, so that wall-clock steps don't stall delivery
+        self._last_clock = -float("inf")
+        self._pending = _NOVALUE
+
+    def __call__(self, value):
+        clock = self.reactor.clock()
+        if self._within_deadband(value):
+            self._pending = value
+            # pushed back by every update, so it is only delivered once settled
+            self.reactor.enqueue(
+                self._trailing,
+                future_s=self.trailing_s,
+                force_requeue=True,
+            )
+        elif clock - self._last_clock >= self.period_s:
+            self._pending = _NOVALUE
+            self._deliver(value, clock)
+        else:
+            self._pending = value
+            # keyed on this method, so this only moves it earlier if already queued
+            self.reactor.enqueue(
+                self._trailing,
+                future_s=self._last_clock + self.period_s - clock,
+            )
+        return
+
+    def _trailing(self):
+        value = self._pending
+        if value is _NOVALUE:
+            return
+        self._pending = _NOVALUE
+        self._deliver(value, self.reactor.clock())
+        return
+
+    def _deliver(self, value, clock):
+        self._last_clock = clock
+        if self.deadband is not None:
+            if isinstance(value, np.ndarray):
+                # waveform values may be views which change in place
+                self._last_value = value.copy()
+            else:
+                self._last_value = value
+        self.callback(value)
+        return
+
+    def _within_deadband(self, value):
+        last = self._last_value
+        if self.deadband is None or last is _NOVALUE:
+            return False
+        if isinstance(value, (int, float)) and isinstance(last, (int, float)):
+            return abs(value - last) <= self.deadband
+        try:
+            diff = np.asarray(value) - last
+        except (TypeError, ValueError):
+            return False
+        if diff.dtype.kind not in "biuf":
+            return False
+        return bool(np.max(np.abs(diff), initial=0) <= self.deadband)
+
+
+def throttled(reactor, callback, db_entry):
+    """
+    Wraps callback in a RelayThrottle if the cas_host db_entry specifies
+    max_rate_hz or deadband, otherwise returns it unchanged.
+    """
+    max_rate_hz = db_entry.get("max_rate_hz", None)
+    deadband = db_entry.get("deadband", None)
+    if max_rate_hz is None and deadband is None:
+        return callback
+    return RelayThrottle(
+        reactor,
+        callback,
+        max_rate_hz=max_rate_hz,
+        deadband=deadband,
+    )
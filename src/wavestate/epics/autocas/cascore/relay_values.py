@@ -211,24 +211,155 @@ class RelayValueLongString(CASRelay, RelayValueDecl):
 
 
 class RelayValueWaveform(CASRelay, RelayValueDecl):
+    """
+    Waveform of up to max_length elements held in a preallocated buffer of a fixed
+    dtype. Puts copy into the buffer in place rather than allocating a new array,
+    and the value is a read-only, contiguous view of the leading elements in use.
+    Since the view changes with later puts, consumers that hold onto a value
+    (rather than forwarding it, as the CA backends do) must copy it.
+    """
+
     max_length = 100
+    dtype = np.dtype(float)
+
+    def __init__(
+        self,
+        initial_value,
+        max_length=None,
+        dtype=None,
+        validator=None,
+        **kwargs
+    ):
+        if max_length is not None:
+            self.max_length = int(max_length)
+        if dtype is not None:
+            self.dtype = np.dtype(dtype)
+        self._buffer = np.zeros(self.max_length, dtype=self.dtype)
+        self._length = 0
+        super(RelayValueWaveform, self).__init__(
+            self._view(0), validator=validator, **kwargs
+        )
+        self._update(initial_value, coerce=True)
+        return
 
     def validator(self, value):
+        """
+        Validates in one vectorized pass without copying arrays of a numeric dtype.
+        Returns the array to copy into the buffer.
+        """
         try:
-            new_val = np.asarray(value, float)[: self.max_length]
-        except ValueError:
+            new_val = np.asarray(value)
+            if new_val.dtype.kind not in "biuf":
+                new_val = new_val.astype(self.dtype)
+        except (ValueError, TypeError):
             raise RelayValueRejected()
-        if not np.all(np.isfinite(new_val)):
+        coerced = False
+        if new_val.ndim != 1:
+            new_val = new_val.reshape(-1)
+            coerced = True
+        if len(new_val) > self.max_length:
+            new_val = new_val[: self.max_length]
+            coerced = True
+        if new_val.dtype.kind == "f" and not np.isfinite(new_val).all():
             raise RelayValueRejected()
-        if new_val != value:
+        if self.dtype.kind in "biu" and not np.can_cast(new_val.dtype, self.dtype):
+            # as for the scalar relays, lossy casts are coercions
+            if self.dtype.kind != "b" and len(new_val) > 0:
+                info = np.iinfo(self.dtype)
+                if new_val.min() < info.min or new_val.max() > info.max:
+                    raise RelayValueRejected()
+            cast_val = new_val.astype(self.dtype)
+            if not np.array_equal(cast_val, new_val):
+                new_val = cast_val
+                coerced = True
+        if coerced:
             raise RelayValueCoerced(new_val)
-        # TODO catch shape mismatch and convert to Coerced
         return new_val
 
+    def max_length_set(self, max_length):
+        """
+        Reallocate the buffer for a new max_length, truncating the current value.
+        Only to be used while setting up, before the value is hosted.
+        """
+        max_length = int(max_length)
+        if max_length == self.max_length:
+            return
+        N = min(self._length, max_length)
+        buffer = np.zeros(max_length, dtype=self.dtype)
+        buffer[:N] = self._buffer[:N]
+        self.max_length = max_length
+        self._buffer = buffer
+        self._length = N
+        self._value = self._view(N)
+        return
+
+    def _view(self, N):
+        view = self._buffer[:N]
+        view.flags.writeable = False
+        return view
+
+    def _store(self, value):
+        """
+        Copy an already validated array into the buffer, returning False if it is unchanged
+        """
+        N = len(value)
+        if N == self._length and np.array_equal(self._buffer[:N], value):
+            return False
+        self._buffer[:N] = value
+        if N != self._length:
+            self._length = N
+            self._value = self._view(N)
+        return True
+
+    def _update(self, val, validate=True, coerce=False, key=None):
+        retval = True
+        if validate:
+            try:
+                val = self.validator(val)
+            except RelayValueCoerced as E:
+                if not coerce:
+                    raise
+                val = E.preferred
+                retval = False
+        else:
+            val = np.asarray(val).reshape(-1)[: self.max_length]
+        if self._store(val):
+            value = self._value
+            for cb_key, cb in list(self.callbacks.items()):
+                if cb_key is not key:
+                    cb(value)
+        return retval
+
+    def put(self, val):
+        self._update(val)
+
+    def put_exclude_cb(self, val, key):
+        self._update(val, key=key)
+
+    def put_coerce(self, val):
+        return self._update(val, coerce=True)
+
+    def put_coerce_exclude_cb(self, val, key):
+        return self._update(val, coerce=True, key=key)
+
+    def put_valid(self, val):
+        self._update(val, validate=False)
+
+    def put_valid_exclude_cb(self, val, key):
+        self._update(val, validate=False, key=key)
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, val):
+        self._update(val)
+
     def db_defaults(self):
         return {
             "value": self.value,
-            "type": "float",
+            "type": "float" if self.dtype.kind == "f" else "int",
             "rv": self,
             "count": self.max_length,
             "burt": False,
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Partitioning of a program into shards, each hosted by its own process.
+
+The shards are configured as nodes of the task's CASUser tree, named by their
+configuration (ctree) paths. Each worker process constructs only the subtrees of
+its own nodes, along with the chain of objects above them and the root services
+(status, burt, ...). The supervisor process constructs everything else. Objects
+which are not constructed are replaced by a ShardStub, so the shard nodes must
+not be used by objects outside of them.
+
+The objects above the shard nodes are constructed by every process, but their
+channels are only hosted by the supervisor, so they should be little more than
+containers of the shard nodes.
+"""
+import collections
+
+
+class ShardStub(object):
+    """
+    Placeholder for a CASUser which is constructed by another shard process.
+    """
+
+    def __init__(self, parent, name, path, shard):
+        self._shard_parent = parent
+        self._shard_name = name
+        self._shard_path = path
+        self._shard = shard
+
+    def __getattr__(self, key):
+        raise AttributeError(
+            (
+                "'{0}' is hosted by {1}, so '{2}' is not available in this process."
+                " Shard at nodes which are not used by the rest of the program."
+            ).format(
+                ".".join(self._shard_path),
+                (
+                    "the shard '{0}'".format(self._shard)
+                    if self._shard is not None
+                    else "the shard supervisor"
+                ),
+                key,
+            )
+        )
+
+    def __repr__(self):
+        return "ShardStub({0})".format(".".join(self._shard_path))
+
+
+def shards_parse(shards, task_path=("task",)):
+    """
+    Parse the "shards" configuration, a list whose entries are the node paths, dot
+    separated and relative to the task, to host in each process. An entry may also
+    hold several comma separated paths (or be a list of them) to host from a single
+    process. Returns an ordered dictionary of shard names to lists of node path tuples.
+    """
+    nodes = collections.OrderedDict()
+    for entry in shards:
+        if isinstance(entry, str):
+            entry = entry.split(",")
+        paths = [
+            tuple(task_path) + tuple(node.strip().split(".")) for node in entry
+        ]
+        if not paths:
+            raise RuntimeError("Empty shard in configuration: {0}".format(shards))
+        name = "_".join(p[-1] for p in paths).lower()
+        if name in nodes:
+            raise RuntimeError("Shards must have unique names, '{0}' is repeated".format(name))
+        nodes[name] = paths
+
+    all_paths = [p for paths in nodes.values() for p in paths]
+    for path_a in all_paths:
+        for path_b in all_paths:
+            if path_a is not path_b and path_b[: len(path_a)] == path_a:
+                raise RuntimeError(
+                    "Shard nodes may not be nested, {0} contains {1}".format(
+                        ".".join(path_a), ".".join(path_b)
+                    )
+                )
+    return nodes
+
+
+class ShardPlan(object):
+    """
+    The shards of a program and the role of this process within them. The shard is
+    None in the supervisor, otherwise it is the name of the worker's shard.
+    """
+
+    def __init__(
+        self,
+        nodes,
+        shard=None,
+        module_name=None,
+        report_fd=None,
+        argv=None,
+        argv_command=None,
+    ):
+        self.nodes = nodes
+        self.shard = shard
+        self.module_name = module_name
+        self.report_fd = report_fd
+        # the command line of the supervisor, split around its command
+        self.argv = argv
+        self.argv_command = argv_command
+
+        self.owners = dict()
+        for name, paths in nodes.items():
+            for path in paths:
+                self.owners[path] = name
+
+        if shard is None:
+            self.nodes_own = ()
+        else:
+            if shard not in nodes:
+                raise RuntimeError(
+                    "Unknown shard '{0}', the configured shards are {1}".format(
+                        shard, list(nodes.keys())
+                    )
+                )
+            self.nodes_own = nodes[shard]
+        return
+
+    def stub(self, parent, name, path):
+        """
+        A ShardStub if the CASUser at path is constructed by another process, otherwise None
+        """
+        if self.shard is None:
+            owner = self.owners.get(path, None)
+            if owner is None:
+                return None
+            return ShardStub(parent, name, path, owner)
+
+        related = False
+        for node in self.nodes_own:
+            N = min(len(node), len(path))
+            if path[:N] == node[:N]:
+                # above or within one of the nodes
+                return None
+            if path[0] == node[0]:
+                related = True
+        if not related:
+            # root services
+            return None
+        return ShardStub(parent, name, path, self.owners.get(path, None))
+
+    def hosts(self, path):
+        """
+        If the channels of the (constructed) CASUser at path are hosted by this process
+        """
+        if self.shard is None:
+            return True
+        related = False
+        for node in self.nodes_own:
+            if path[: len(node)] == node:
+                return True
+            if path[0] == node[0]:
+                related = True
+        return not related
+
+    def worker_argv(self, shard, report_fd):
+        """
+        The command line to start the worker of the shard, reporting to report_fd
+        """
+        return (
+            list(self.argv)
+            + ["--shard", shard, "--shard-fd", str(report_fd)]
+            + list(self.argv_command)
+        )
+
+    def module_name_shard(self, shard):
+        return "{0}_{1}".format(self.module_name, shard)
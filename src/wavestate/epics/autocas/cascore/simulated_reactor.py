@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Reactor variant running on a virtual clock, for simulations and for testing the
+scheduling of looping tasks, rate limits and rollovers over simulated days.
+"""
+import time
+
+from . import reactor
+
+
+class SimulatedReactor(reactor.Reactor):
+    """
+    A Reactor whose clock is virtual. Rather than sleeping until the next deadline,
+    the clock jumps straight to it, so flush(for_s=...) runs all of the tasks due
+    within for_s without waiting for them. The scheduling is otherwise that of
+    Reactor, with time() offset from the virtual clock by a fixed wall-clock start.
+
+    The clock only advances between tasks, so tasks take no virtual time unless they
+    call sleep. Tasks reading time.time() directly rather than Reactor.time() see
+    the real time. Once nothing is scheduled, the reactor waits in real time for
+    tasks sent from other threads.
+    """
+
+    def __init__(self, mtime_start=None, **kwargs):
+        """
+        mtime_start is the wall-clock time at which the virtual clock starts,
+        defaulting to the current time
+        """
+        if mtime_start is None:
+            mtime_start = time.time()
+        # the virtual clock and its offset to the wall clock
+        self._clock = 0.0
+        self._time_offset = mtime_start
+        super(SimulatedReactor, self).__init__(**kwargs)
+        return
+
+    def clock(self):
+        return self._clock
+
+    def time(self):
+        return self._clock + self._time_offset
+
+    def sleep(self, duration_s):
+        """
+        Advance the virtual clock, as if the calling task took duration_s
+        """
+        self._clock += duration_s
+        return
+
+    def step_time(self, step_s):
+        """
+        Step the wall clock by step_s, as an NTP or leap second adjustment does,
+        without moving the virtual clock
+        """
+        self._time_offset += step_s
+        return
+
+    def _wait_s(self, mtime, mtime_to=None):
+        mtime_next = mtime_to
+        if self._pqueue:
+            mtime_deadline = self._pqueue.peek()[0]
+            if mtime_next is None or mtime_deadline < mtime_next:
+                mtime_next = mtime_deadline
+        if mtime_next is None:
+            return None
+        # jump to the deadline rather than sleeping toward it
+        if mtime_next > self._clock:
+            self._clock = mtime_next
+        return 0
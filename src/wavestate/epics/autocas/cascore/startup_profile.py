@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Startup profiling, used by the --profile-startup option of CAS9CmdLine.
+"""
+import sys
+import time
+import atexit
+import collections
+
+from wavestate.declarative.properties import memoized
+
+
+# the code of the descriptor methods which call the dproperty and mproperty functions
+_property_get_codes = frozenset(
+    [
+        memoized.MemoizedDescriptor.__get__.__code__,
+        memoized.MemoizedDescriptorFNoSet.__get__.__code__,
+    ]
+)
+
+
+class StartupProfile(object):
+    """
+    Times the construction of each dproperty (and mproperty), and the modules imported,
+    while active. This uses sys.setprofile, so nothing is added to the properties
+    themselves, but the times include the profiling overhead and are best compared
+    with each other.
+
+    Properties are accumulated by class and name over all instances. Their self time
+    excludes the nested properties and imports.
+    """
+
+    def __init__(self, import_time_s=None, N_report=25, file=None):
+        self.import_time_s = import_time_s
+        self.N_report = N_report
+        self.file = file
+        # key -> [count, inclusive time, self time]
+        self.stats = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        self._stack = []
+        self._active = False
+        self._reported = False
+        self._mtime_start = None
+        self._time_total_s = 0
+
+    def start(self):
+        if self._active or self._reported:
+            return
+        self._active = True
+        self._mtime_start = time.perf_counter()
+        sys.setprofile(self._profile)
+        atexit.register(self.report)
+        return
+
+    def stop(self):
+        if not self._active:
+            return
+        sys.setprofile(None)
+        self._active = False
+        self._time_total_s = time.perf_counter() - self._mtime_start
+        return
+
+    def _frame_key(self, frame):
+        code = frame.f_code
+        if code.co_name == "<module>":
+            return ("import", frame.f_globals.get("__name__", "?"))
+        caller = frame.f_back
+        if caller is not None and caller.f_code in _property_get_codes:
+            caller_locals = caller.f_locals
+            desc = caller_locals.get("self", None)
+            # the descriptor may call other functions, e.g. through isinstance
+            if getattr(getattr(desc, "fget", None), "__code__", None) is not code:
+                return None
+            obj = caller_locals.get("obj", None)
+            return (
+                "property",
+                "{0}.{1}".format(
+                    obj.__class__.__name__,
+                    getattr(desc, "__name__", "?"),
+                ),
+            )
+        return None
+
+    def _profile(self, frame, event, arg):
+        if event == "call":
+            key = self._frame_key(frame)
+            if key is not None:
+                self._stack.append([frame, key, time.perf_counter(), 0])
+        elif event == "return":
+            stack = self._stack
+            if stack and stack[-1][0] is frame:
+                frame, key, mtime_start, time_children = stack.pop()
+                time_s = time.perf_counter() - mtime_start
+                stat = self.stats[key]
+                stat[0] += 1
+                stat[1] += time_s
+                stat[2] += time_s - time_children
+                if stack:
+                    stack[-1][3] += time_s
+        return
+
+    def report(self):
+        """
+        Stop profiling and print the report, only the first time this is called
+        """
+        if self._reported:
+            return
+        self.stop()
+        self._reported = True
+        F = self.file
+        if F is None:
+            F = sys.stderr
+
+        def line(time_s, text):
+            print("{0:10.1f} ms  {1}".format(1e3 * time_s, text), file=F)
+
+        print("Startup profile:", file=F)
+        if self.import_time_s is not None:
+            line(self.import_time_s, "importing wavestate.epics.autocas")
+        line(self._time_total_s, "profiled construction and startup")
+
+        imports = []
+        props = []
+        for (kind, name), (count, time_s, time_self_s) in self.stats.items():
+            if kind == "import":
+                imports.append((time_s, name))
+            else:
+                props.append((time_self_s, time_s, count, name))
+
+        if imports:
+            print("Modules imported while profiling (inclusive):", file=F)
+            for time_s, name in sorted(imports, reverse=True)[: self.N_report]:
+                line(time_s, name)
+
+        if props:
+            print(
+                "Properties by self time (inclusive time, count):",
+                file=F,
+            )
+            for time_self_s, time_s, count, name in sorted(props, reverse=True)[
+                : self.N_report
+            ]:
+                line(
+                    time_self_s,
+                    "{0} ({1:.1f} ms, {2})".format(name, 1e3 * time_s, count),
+                )
+        return
@@ -8,13 +8,13 @@
 """
 """
 from wavestate.bunch.deep_bunch import DeepBunch
-import collections
+import collections.abc
 
 
 def remap_recursive(d, remap=None):
     if remap is not None:
         d = remap(d)
-    if isinstance(d, collections.Mapping):
+    if isinstance(d, collections.abc.Mapping):
         d2 = dict()
         for k, v in d.items():
             d2[remap_recursive(k, remap)] = remap_recursive(v, remap)
@@ -48,8 +48,8 @@ def _dict_diff(d1, d2, d_unused, d1_diff, d2_diff, k_prev):
     """
     determines d1 - d2 in the set-subtraction sense. Separates d_unused and d1_diff and d2_diff
     """
-    if isinstance(d1, collections.Mapping):
-        if not isinstance(d2, collections.Mapping):
+    if isinstance(d1, collections.abc.Mapping):
+        if not isinstance(d2, collections.abc.Mapping):
             d1_diff[k_prev] = d1
             d2_diff[k_prev] = d2
 
@@ -75,8 +75,8 @@ def dict_kinclude(d1, d2, d_keep):
     """
     Keep only keys of d1 that are in d2
     """
-    if isinstance(d1, collections.Mapping):
-        if not isinstance(d2, collections.Mapping):
+    if isinstance(d1, collections.abc.Mapping):
+        if not isinstance(d2, collections.abc.Mapping):
             return True
 
         for k, v in d1.items():
@@ -94,7 +94,7 @@ def dict_about_merge(d1, d2):
     """
     Merges d2 into d1, adds "about" keys which are missing from d2. Intended to merge the CAS9CmdLine._ctree_about with the root.ctree.about dictionary
     """
-    if not isinstance(d2, collections.Mapping):
+    if not isinstance(d2, collections.abc.Mapping):
         d1["about"] = d2
     else:
         for k, v in d2.items():
@@ -80,7 +80,13 @@ class USBPrologixGPIB(SerialConnection):
     _serial_obj = None
 
     def _connect_task(self):
-        assert self._serial_obj is None
+        # with io_worker, the I/O thread owns the device and so also opens it
+        self.io_call(self._connect)
+
+    def _connect(self):
+        if self._serial_obj is not None:
+            # queued for the I/O thread before the previous call connected
+            return
         try:
             print("CHECKING: ", self.device_path)
             sdev = serial.Serial(
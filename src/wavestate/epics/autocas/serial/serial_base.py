@@ -10,7 +10,12 @@ TODO, make a burt.req generator and a monitor.req generator, as well as a utilit
 """
 
 
+import asyncio
+import inspect
+import threading
+import traceback
 from wavestate import declarative
+from wavestate.bunch import Bunch
 
 from .. import cascore
 from ..subservices import error
@@ -63,6 +68,120 @@ class SerialConnection(
     def _blocks_queued(self):
         return []
 
+    @cascore.dproperty_ctree(default=False)
+    def io_worker(self, val):
+        """
+        Run the serial block tree on a dedicated I/O thread rather than in the reactor.
+        The block functions then run holding the reactor task_lock, which is released
+        during the blocking calls of the command object, so a slow device no longer
+        stalls the reactor. Block functions must not call send_task_synchronous.
+        """
+        return bool(val)
+
+    @declarative.dproperty
+    def rv_io_queue(self):
+        """
+        Number of blocks waiting for the I/O thread, only hosted with io_worker
+        """
+        if not self.io_worker:
+            return None
+        rv = cascore.RelayValueInt(0)
+        self.cas_host(
+            rv,
+            name="IO_QUEUE",
+            unit="blocks",
+            interaction="report",
+        )
+        return rv
+
+    # With io_worker, the I/O thread owns the device. The connection (such as the
+    # _serial_obj of the subclasses) is only opened, used and dropped on it, through
+    # run and io_call, so reactor tasks never touch it. The blocks and io_call
+    # functions run holding the task_lock, except while a command call blocks. Other
+    # reactor tasks run then, so RelayValues read by a block before a command call
+    # may have changed after it, and blocks may be queued meanwhile.
+    _io_thread = None
+    _io_cv = None
+    _io_requested = False
+    _io_calls = None
+
+    def io_call(self, func):
+        """
+        Run func where the device is owned: on the I/O thread with io_worker, holding
+        the task_lock as the block tree does, otherwise directly. Calls of a func
+        still waiting for the I/O thread are not queued again.
+        """
+        if not self.io_worker or self._in_io_worker():
+            return func()
+        self._io_submit(func)
+        return
+
+    def _io_submit(self, func=None):
+        """
+        Request that the I/O thread runs func, or the queued blocks if None. Requests
+        for the blocks made while it is busy coalesce into a single further run.
+        """
+        if self._io_cv is None:
+            self._io_cv = threading.Condition()
+            self._io_calls = []
+        with self._io_cv:
+            if func is None:
+                self._io_requested = True
+            elif func not in self._io_calls:
+                self._io_calls.append(func)
+            if self._io_thread is None:
+                self._io_thread = threading.Thread(
+                    target=self._io_loop,
+                    name="serial I/O {0}".format(self.name),
+                )
+                self._io_thread.daemon = True
+                self._io_thread.start()
+            self._io_cv.notify()
+        return
+
+    def _io_loop(self):
+        while True:
+            with self._io_cv:
+                while not self._io_requested and not self._io_calls:
+                    self._io_cv.wait()
+                calls = self._io_calls[:]
+                self._io_calls[:] = []
+                if self._io_requested:
+                    calls.append(self.run)
+                self._io_requested = False
+            with self.reactor.task_lock:
+                for func in calls:
+                    try:
+                        func()
+                    except Exception as E:
+                        # the reactor would have died here, the I/O thread reports and carries on
+                        traceback.print_exc()
+                        self.rb_running.assign(False)
+                        self.error(0, str(E))
+            self.reactor.send_task(self._io_queue_update)
+
+    def _io_queue_update(self):
+        self.rv_io_queue.value = len(self._blocks_queued)
+
+    def _in_io_worker(self):
+        return threading.current_thread() is self._io_thread
+
+    def _io_unlocked(self, func):
+        """
+        Wrap a blocking command-object call to release the reactor task_lock while it waits.
+        The call may only use device state owned by the I/O thread, see io_call.
+        """
+        task_lock = self.reactor.task_lock
+
+        def unlocked_call(*args, **kwargs):
+            task_lock.release()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                task_lock.acquire()
+
+        return unlocked_call
+
     def cmd_object(self):
         b = Bunch()
 
@@ -80,6 +199,8 @@ class SerialConnection(
     def block_enqueue(self, blockfunc):
         self._block_data[blockfunc]
         self._blocks_queued.append(blockfunc)
+        if self.io_worker:
+            self.rv_io_queue.value = len(self._blocks_queued)
 
         self.reactor.enqueue(self.run, future_s=0.1, limit_s=1)
         return
@@ -135,7 +256,19 @@ class SerialConnection(
         """
         generates the block-chain run tree and serial command object through the block-parents and chains. Doesn't need to check for parent loop because that is prevented currently
         through the block creation convention that parents are specified.
+
+        With io_worker set, calls from the reactor only hand the run to the I/O thread,
+        which calls run again. Subclass run wrappers then handle errors on that thread.
+
+        If any of the queued block functions are async def, the block tree runs as a
+        coroutine. It is returned to be scheduled when called from a running event
+        loop, as in the AsyncioReactor, and otherwise run to completion here. Async
+        block functions await cmd.block_remainder().
         """
+        if self.io_worker and not self._in_io_worker():
+            self._io_submit()
+            return
+
         self.rb_running.assign(True)
 
         # first to bfunc completion
@@ -161,8 +294,24 @@ class SerialConnection(
                 stack.append(bparent)
 
         cmd = self.cmd_object()
+        if self.io_worker:
+            for k, v in list(cmd.items()):
+                if callable(v):
+                    cmd[k] = self._io_unlocked(v)
         # utilities.dprint(plists)
 
+        if any(
+            inspect.iscoroutinefunction(self._block_data[bfunc]["func"])
+            for plist in plists.values()
+            for bfunc in plist
+        ):
+            coro = self._run_async(plists, cmd)
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(coro)
+            return coro
+
         # get first list
         def block_call(bfunc):
             plist = plists.get(bfunc, [])
@@ -185,6 +334,34 @@ class SerialConnection(
         # the block list is a sequence of bfunc, list pairs. The bfunc serial functions are called and any associated inner blocks are in the following sequence
         self.rb_running.assign(False)
 
+    async def _run_async(self, plists, cmd):
+        """
+        The block tree of run, awaiting the block functions which return awaitables
+        """
+
+        async def block_call(bfunc):
+            plist = plists.get(bfunc, [])
+            plist.sort(key=lambda bfunc: self._block_data[bfunc]["ordering"])
+            for bfunc in plist:
+                was_called = [False]
+
+                async def remainder_call():
+                    # only set once awaited, so that a remainder which is never
+                    # awaited still runs after the block function
+                    was_called[0] = True
+                    return await block_call(bfunc)
+
+                cmd.block_remainder = remainder_call
+                ret = self._block_data[bfunc]["func"](cmd)
+                if inspect.isawaitable(ret):
+                    await ret
+                cmd.block_remainder = None
+                if not was_called[0]:
+                    await remainder_call()
+
+        await block_call(None)
+        self.rb_running.assign(False)
+
 
 class SerialSubBlock(
     cascore.CASUser,
@@ -10,32 +10,62 @@
 
 
 from wavestate import declarative
+from wavestate.bunch import Bunch
 import sys
 import os
 import datetime
-import time
 import errno
+import threading
+import functools
+import traceback
+import shutil
+import collections
+import gzip
+import bz2
+import lzma
 from os import path
 
 from .. import cascore
 from . import autosave_base
 
-save_programs = dict(
-    gzip=["gzip"],
-    bzip2=["bzip2"],
+# compression is done in-process, these all accept file names or file objects
+zip_open = dict(
+    gzip=gzip.open,
+    bzip2=bz2.open,
+    xz=lzma.open,
 )
 
-load_programs = dict(
-    gzip=["gzip", "-c", "-d"],
-    bzip2=["bzip2", "-c", "-d"],
+zip_suffixes = dict(
+    gzip=".gz",
+    bzip2=".bz2",
+    xz=".xz",
 )
 
 suffix_programs = {
     ".gz": "gzip",
     ".bz": "bzip2",
+    ".bz2": "bzip2",
+    ".xz": "xz",
 }
 
 
+def snap_open(fname):
+    """
+    Open a snapshot for reading as text, decompressing it in-process if its suffix
+    is one of suffix_programs.
+    """
+    # store the program to unzip in zipper_prog
+    for suffix, zipper_prog in suffix_programs.items():
+        if fname.endswith(suffix):
+            break
+    else:
+        zipper_prog = None
+
+    if zipper_prog is not None:
+        return zip_open[zipper_prog](fname, "rt")
+    return open(fname, "rt")
+
+
 class AutoSave(autosave_base.AutoSaveBase):
     """
     The writing within the rollover rate is atomic. Writes are done to a temp file, then atomically moved to the old snapshot.
@@ -57,12 +87,33 @@ class AutoSave(autosave_base.AutoSaveBase):
         """
         return val
 
-    # @cascore.dproperty_ctree(default = 'bzip')
-    # def zip_rollover_program(self, val):
-    #    """
-    #    Use this program to zip files as they rollover to take less space. If null, then the files will not be zipped. Good values are ['gzip', 'bzip']
-    #    """
-    #    return val
+    @cascore.dproperty_ctree(default=False)
+    def save_RO_changes(self, val):
+        """
+        If true, changes to read-only channels alone cause the snapshot to be rewritten.
+        Otherwise the snapshot is only rewritten when settings change or at rollover, and
+        the read-only values are refreshed along with it.
+        """
+        return bool(val)
+
+    @cascore.dproperty_ctree(default=True)
+    def save_background(self, val):
+        """
+        Write snapshots from a background thread so that slow (e.g. NFS) burt folders
+        never stall the reactor. The values are still taken on the reactor.
+        """
+        return bool(val)
+
+    @cascore.dproperty_ctree(default="bzip2")
+    def zip_rollover_program(self, val):
+        """
+        Compress snapshots as they rollover to take less space, may be one of [gzip, bzip2, xz].
+        If null, then the files will not be compressed. Compression is done in-process by the
+        autosave I/O thread.
+        """
+        if val is not None:
+            assert val in zip_open
+        return val
 
     @cascore.dproperty_ctree(default=lambda self: path.abspath("./burt/"))
     def save_folder(self, val):
@@ -111,6 +162,45 @@ class AutoSave(autosave_base.AutoSaveBase):
             return None
         return path.join(self.load_folder, self.load_fname.format(modname=self.modname))
 
+    @cascore.dproperty_ctree(default="{modname}_shards.snap")
+    def shards_fname(self, val):
+        """
+        File name of the snapshot merged from all of the processes of a sharded program.
+        It is written by the shard supervisor into the load_folder. May use {modname} template.
+        """
+        return val
+
+    @cascore.dproperty
+    def load_fallback_fpaths(self, val=None):
+        """
+        Snapshots to load, in order, if load_fpath does not exist yet. Shard workers fall
+        back to the merged snapshot and then to the snapshot of the supervisor, so that their
+        channels keep their settings when a program is first split into shards.
+        """
+        if val is None:
+            val = []
+            plan = self.root.shard_plan
+            if (
+                plan is not None
+                and plan.shard is not None
+                and self.load_folder is not None
+            ):
+                if self.shards_fname is not None:
+                    val.append(
+                        path.join(
+                            self.load_folder,
+                            self.shards_fname.format(modname=plan.module_name),
+                        )
+                    )
+                if self.load_fname is not None:
+                    val.append(
+                        path.join(
+                            self.load_folder,
+                            self.load_fname.format(modname=plan.module_name),
+                        )
+                    )
+        return list(val)
+
     def folders_make_ready(self):
         if self.save_folder is not None and self.save_fname_template is not None:
             try:
@@ -132,25 +222,37 @@ class AutoSave(autosave_base.AutoSaveBase):
         Loads the configured snapshot into the CAS Driver database
         """
         load_fpath = path.join(self.load_folder, self.load_fpath)
+        if not path.exists(load_fpath):
+            fpaths = [f for f in self.load_fallback_fpaths if path.exists(f)]
+            if fpaths:
+                print(
+                    "WARNING: No snapshot {0}, loading {1}".format(
+                        load_fpath, ", ".join(fpaths)
+                    )
+                )
+                self.load_snap_fallback(fpaths)
+                return
         self.load_snap_file(load_fpath)
 
-    def load_snap_file(self, fname):
+    def load_snap_fallback(self, fpaths):
         """
-        May need to unzip first.
+        Load the channels from several snapshots, those earlier in fpaths taking precedence
         """
-        # store the program to unzip in zipper_prog
-        for suffix, zipper_prog in suffix_programs.items():
-            if fname.endswith(suffix):
-                break
-        else:
-            zipper_prog = None
-
-        # TODO
-        if zipper_prog is not None:
-            raise NotImplementedError("Can't unzip yet")
+        PV_vals = dict()
+        ROPV_vals = dict()
+        for fpath in reversed(fpaths):
+            with snap_open(fpath) as F:
+                PV_vals_f, ROPV_vals_f = autosave_base.snap_parse(F)
+            PV_vals.update(PV_vals_f)
+            ROPV_vals.update(ROPV_vals_f)
+        self.load_snap_values(PV_vals, ROPV_vals)
 
+    def load_snap_file(self, fname):
+        """
+        Compressed snapshots are decompressed in-process, based on their suffix.
+        """
         try:
-            with open(fname, "r") as F:
+            with snap_open(fname) as F:
                 self.load_snap_file_raw(F)
         except IOError as E:
             if E.errno == errno.ENOENT:
@@ -175,10 +277,11 @@ class AutoSave(autosave_base.AutoSaveBase):
         return
 
     _last_linkpath = None
+    _last_savepath = None
 
     def save_snap_rolling(self):
         self._future_savesnap = None
-        ptime_now = time.time()
+        ptime_now = self.reactor.time()
         ptime_epoch = ptime_now - (ptime_now % self.rollover_rate_s)
         dt_epoch = datetime.datetime.fromtimestamp(ptime_epoch)
 
@@ -198,20 +301,147 @@ class AutoSave(autosave_base.AutoSaveBase):
         )
         fpath_save = path.abspath(path.join(self.save_folder, fname))
 
-        prev_file_exists = path.exists(fpath_save)
+        # the current file already holds the latest values, so it needn't be rewritten
+        if fpath_save == self._last_savepath and not self.snap_changed(
+            include_RO=self.save_RO_changes
+        ):
+            self.save_notify(ptime_now, ptime_epoch)
+            return
 
-        if prev_file_exists:
-            fbase, fext = path.splitext(fpath_save)
-            fpath_temp = fbase + "_temp" + fext
+        self._last_savepath = fpath_save
+        job = Bunch(
+            fpath_save=fpath_save,
+            chn_values=self.snap_values(),
+            ptime_now=ptime_now,
+            ptime_epoch=ptime_epoch,
+        )
+        if self.save_background:
+            self._save_submit(job)
         else:
-            fpath_temp = fpath_save
+            try:
+                self._save_write(job)
+            except Exception:
+                self._save_failed(job)
+                raise
+            self.save_notify(ptime_now, ptime_epoch)
+        return
+
+    _save_thread = None
+    _save_cv = None
+    _save_job = None
+    _zip_queue = None
+
+    def _save_thread_start(self):
+        if self._save_thread is None:
+            self._save_cv = threading.Condition()
+            self._zip_queue = collections.deque()
+            self._save_thread = threading.Thread(
+                target=self._save_loop,
+                name="autosave I/O",
+            )
+            self._save_thread.daemon = True
+            self._save_thread.start()
+        return
+
+    def _save_submit(self, job):
+        """
+        Hand a save job to the writer thread. A job still pending is replaced, with
+        its values merged into the newer job so that no channel changes are lost.
+        """
+        self._save_thread_start()
+        with self._save_cv:
+            job_prev = self._save_job
+            if job_prev is not None:
+                job_prev.chn_values.update(job.chn_values)
+                job.chn_values = job_prev.chn_values
+            self._save_job = job
+            self._save_cv.notify()
+        return
+
+    def _zip_submit(self, fpath):
+        """
+        Queue a rolled over snapshot to be compressed by the writer thread
+        """
+        self._save_thread_start()
+        with self._save_cv:
+            self._zip_queue.append(fpath)
+            self._save_cv.notify()
+        return
+
+    def _save_loop(self):
+        while True:
+            with self._save_cv:
+                while self._save_job is None and not self._zip_queue:
+                    self._save_cv.wait()
+                job = self._save_job
+                self._save_job = None
+                fpaths_zip = list(self._zip_queue)
+                self._zip_queue.clear()
+
+            if job is not None:
+                try:
+                    self._save_write(job)
+                except Exception:
+                    # TODO, log better
+                    traceback.print_exc()
+                    self.reactor.send_task(functools.partial(self._save_failed, job))
+                else:
+                    self.reactor.send_task(
+                        functools.partial(
+                            self.save_notify, job.ptime_now, job.ptime_epoch
+                        )
+                    )
+
+            for fpath in fpaths_zip:
+                try:
+                    self._zip_file(fpath)
+                except Exception:
+                    # TODO, log better
+                    traceback.print_exc()
+
+    def _zip_file(self, fpath):
+        """
+        Compress a snapshot in-process with zip_rollover_program, replacing the
+        original once the compressed file is complete.
+        """
+        zipper_prog = self.zip_rollover_program
+        if zipper_prog is None or not path.exists(fpath):
+            return
+        fpath_zip = fpath + zip_suffixes[zipper_prog]
+        fpath_temp = fpath + "_temp" + zip_suffixes[zipper_prog]
+        with open(fpath, "rb") as Fin, open(fpath_temp, "wb") as Fraw:
+            with zip_open[zipper_prog](Fraw, "wb") as Fout:
+                shutil.copyfileobj(Fin, Fout)
+            Fraw.flush()
+            os.fsync(Fraw.fileno())
+        os.rename(fpath_temp, fpath_zip)
+        os.unlink(fpath)
+        return
+
+    def _save_failed(self, job):
+        """
+        Force the next save to rewrite the file, with the channels the job lost
+        """
+        self._last_savepath = None
+        self.snap_values_restore(job.chn_values)
+        return
+
+    def _save_write(self, job):
+        """
+        Serialize and write a save job, then update the load symlink. Runs in the
+        writer thread when save_background is set.
+        """
+        fpath_save = job.fpath_save
+        fbase, fext = path.splitext(fpath_save)
+        fpath_temp = fbase + "_temp" + fext
 
         with open(fpath_temp, "w") as F:
-            self.save_snap_file_raw(F)
+            self.save_snap_file_raw(F, values=job.chn_values)
+            F.flush()
+            os.fsync(F.fileno())
 
         # atomic rename, so the existing snap file is always correct
-        if fpath_temp != fpath_save:
-            os.rename(fpath_temp, fpath_save)
+        os.rename(fpath_temp, fpath_save)
 
         fpath_previous = self._last_linkpath
         fpath_do_link = True
@@ -236,9 +466,12 @@ class AutoSave(autosave_base.AutoSaveBase):
                 # then update!
                 os.symlink(fpath_save, self.load_fpath)
                 self._last_linkpath = fpath_save
-                # TODO, optionally zip the previous path
-
-        self.save_notify(ptime_now, ptime_epoch)
+                if fpath_previous is not None and self.zip_rollover_program is not None:
+                    for suffix in suffix_programs:
+                        if fpath_previous.endswith(suffix):
+                            break
+                    else:
+                        self._zip_submit(fpath_previous)
         return
 
     @cascore.dproperty
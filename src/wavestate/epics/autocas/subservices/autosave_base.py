@@ -12,7 +12,9 @@
 import sys
 import os
 from os import path
+import re
 import datetime
+import numpy as np
 
 from .. import cascore
 
@@ -26,6 +28,13 @@ class AutoSaveBase(cascore.CASUser):
     _my_chnlist = None
     _my_casdriver = None
 
+    # serialized snapshot line of each saved channel, regenerated only for channels
+    # in _snap_dirty. _snap_dirty_settings marks that a non-RO channel has changed.
+    _my_chnRO = None
+    _snap_lines = None
+    _snap_dirty = None
+    _snap_dirty_settings = True
+
     @cascore.dproperty
     def username(self):
         import getpass
@@ -47,65 +56,97 @@ class AutoSaveBase(cascore.CASUser):
             chnlist.append((pv, RO))
         chnlist.sort()
         self._my_chnlist = chnlist
+        self._my_chnRO = dict(chnlist)
 
-    def load_snap_file_raw(self, fobj):
-        # "--- Start BURT header"
-        # "--- End BURT header"
-
-        PV_vals = dict()
-        ROPV_vals = dict()
-
-        while True:
-            line = fobj.readline()
-            # check if it is the header bunch
-            if line.startswith("---") and line.lower().find("start burt header") != 1:
-                while True:
-                    line = fobj.readline()
-                    if not line:
-                        # can only happen if it is the last line of the file, otherwise '\n' is left on
-                        break
-
-                    if (
-                        line.startswith("---")
-                        and line.lower().find("end burt header") != 1
-                    ):
-                        # load the next line before continuing so that the line can have PVinfo on it
-                        line = fobj.readline()
-                        break
-                    # ignore any other data in the header
-            if not line:
-                # can only happen if it is the last line of the file, otherwise '\n' is left on
-                break
-
-            line = line.strip().split()
-            if line[0] == "RO":
-                isRO = True
-                line = line[1:]
-            else:
-                isRO = False
+        self._snap_lines = dict()
+        self._snap_dirty = set()
+        self._snap_dirty_settings = True
+        for pv, RO in chnlist:
+            db_entry = db[pv]
+            # TODO, make the internal/remote save decision better
+            if db_entry.get("remote", False):
+                continue
+            self._snap_dirty.add(pv)
+            db_entry["rv"].register(
+                callback=self._snap_dirty_cb_generator(pv, RO),
+                key=self,
+            )
+        return
 
-            pv = line[0]
-            count = line[1]
+    def _snap_dirty_cb_generator(self, pv, RO):
+        def dirty_cb(value):
+            self._snap_dirty.add(pv)
+            if not RO:
+                self._snap_dirty_settings = True
 
-            if int(count) != 1:
-                print(
-                    "WARNING: can't handle PVs with count > 1 yet for PV: {0}".format(
-                        pv
-                    )
-                )
-                continue
+        return dirty_cb
 
-            val = line[2]
+    def snap_changed(self, include_RO=False):
+        """
+        True if any non-RO channel (or any channel at all, if include_RO) changed since the last snap_values
+        """
+        if self._snap_dirty_settings:
+            return True
+        return include_RO and bool(self._snap_dirty)
 
-            # check for null strings
-            if val == r"\0":
-                val = ""
+    def snap_values(self):
+        """
+        Returns a dict of the values of the channels changed since the last call. Arrays
+        are copied so that the dict may be handed to another thread for snap_lines.
+        """
+        dirty = self._snap_dirty
+        self._snap_dirty = set()
+        self._snap_dirty_settings = False
+        pvdb = self._my_pvdb
+        values = dict()
+        for pv in dirty:
+            val = pvdb[pv]["rv"].value
+            if isinstance(val, np.ndarray):
+                val = val.copy()
+            values[pv] = val
+        return values
 
-            if isRO:
-                ROPV_vals[pv] = val
-            else:
-                PV_vals[pv] = val
+    def snap_values_restore(self, values):
+        """
+        Marks the channels of values, as returned by snap_values, as changed again, so
+        that the next snap_values includes them after a failed save.
+        """
+        chnRO = self._my_chnRO
+        for pv in values:
+            self._snap_dirty.add(pv)
+            if not chnRO[pv]:
+                self._snap_dirty_settings = True
+        return
+
+    def snap_lines(self, values=None):
+        """
+        Returns the list of snapshot lines, only regenerating those of the channels in
+        values, which defaults to the channels changed since the last snap_values.
+        """
+        if values is None:
+            values = self.snap_values()
+        lines = self._snap_lines
+        chnRO = self._my_chnRO
+        for pv, val in values.items():
+            lines[pv] = self._snap_line(pv, chnRO[pv], val)
+        return [lines[pv] for pv, pvRO in self._my_chnlist if pv in lines]
+
+    def _snap_line(self, pv, pvRO, val):
+        count, val = snap_value_format(val)
+        if not pvRO:
+            return "{0} {1} {2}\n".format(pv, count, val)
+        else:
+            return "RO {0} {1} {2}\n".format(pv, count, val)
 
+    def load_snap_file_raw(self, fobj):
+        PV_vals, ROPV_vals = snap_parse(fobj)
+        self.load_snap_values(PV_vals, ROPV_vals)
+
+    def load_snap_values(self, PV_vals, ROPV_vals):
+        """
+        Load the channel dictionaries of a parsed snapshot into the CAS Driver database
+        """
+        values = dict()
         for pv, pvRO in self._my_chnlist:
             if pvRO:
                 val = ROPV_vals.get(pv, None)
@@ -131,16 +172,18 @@ class AutoSaveBase(cascore.CASUser):
             # TODO, make the internal/remote save decision better
             remote = self._my_pvdb[pv].get("remote", False)
             if not remote:
-                did_write = self._my_casdriver.write_sync_typecast(pv, val)
-                if not did_write:
-                    print(
-                        'WARNING, write failed loading non-RO PV: "{0}" with value {1}'.format(
-                            pv, val
-                        )
-                    )
+                values[pv] = val
+
+        failed = self._my_casdriver.write_sync_typecast_bulk(values)
+        for pv in failed:
+            print(
+                'WARNING, write failed loading non-RO PV: "{0}" with value {1}'.format(
+                    pv, values[pv]
+                )
+            )
         return
 
-    def save_snap_file_raw(self, fobj):
+    def save_snap_file_raw(self, fobj, values=None):
         # TODO have it write time and other info
         dt = datetime.datetime.now()
         header = burt_header_template.format(
@@ -149,24 +192,8 @@ class AutoSaveBase(cascore.CASUser):
         )
         fobj.write(header)
         fobj.write("\n")
-        for pv, pvRO in self._my_chnlist:
-            # TODO, make the internal/remote save decision better
-            remote = self._my_pvdb[pv].get("remote", False)
-            if remote:
-                continue
-            val = self._my_casdriver.read(pv)
-
-            if val == "":
-                val = r"\0"
-
-            # prevent it writing "True" and "False" for bools
-            if isinstance(val, bool):
-                val = int(val)
-
-            if not pvRO:
-                fobj.write("{0} 1 {1}\n".format(pv, val))
-            else:
-                fobj.write("RO {0} 1 {1}\n".format(pv, val))
+        # a single write of the whole body
+        fobj.write("".join(self.snap_lines(values)))
         return
 
     def save_req_file_raw(self, fobj):
@@ -184,6 +211,136 @@ class AutoSaveBase(cascore.CASUser):
         return
 
 
+# tokens of a snapshot line, either double-quoted (with backslash escapes) or bare
+_snap_token_re = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+_snap_unescape_re = re.compile(r"\\(.)")
+# strings which must be quoted to be read back as a single token
+_snap_quote_re = re.compile(r'[\s"]|^\\')
+
+
+def snap_parse(fobj):
+    """
+    Parse a BURT snapshot in a single pass. Returns the dictionaries (PV_vals, ROPV_vals)
+    of the settings and read-only channels. Values are strings, or lists of strings for
+    channels with count other than 1. Quoted strings are unescaped and the bare \\0 marker
+    is the empty string.
+    """
+    PV_vals = dict()
+    ROPV_vals = dict()
+
+    in_header = False
+    for line in fobj.read().splitlines():
+        if line.startswith("---"):
+            lline = line.lower()
+            if lline.find("start burt header") != -1:
+                in_header = True
+                continue
+            elif lline.find("end burt header") != -1:
+                in_header = False
+                continue
+        if in_header:
+            # ignore any other data in the header
+            continue
+
+        # bare \0 tokens are null strings
+        if '"' in line:
+            tokens = []
+            for quoted, bare in _snap_token_re.findall(line):
+                if bare:
+                    tokens.append("" if bare == r"\0" else bare)
+                else:
+                    tokens.append(_snap_unescape_re.sub(r"\1", quoted))
+        else:
+            tokens = line.split()
+            if r"\0" in line:
+                tokens = ["" if t == r"\0" else t for t in tokens]
+        if not tokens:
+            continue
+
+        if tokens[0] == "RO":
+            vals = ROPV_vals
+            tokens = tokens[1:]
+        else:
+            vals = PV_vals
+
+        if len(tokens) < 2:
+            print("WARNING: malformed snapshot line: {0}".format(line))
+            continue
+
+        pv = tokens[0]
+        try:
+            count = int(tokens[1])
+        except ValueError:
+            print("WARNING: malformed count in snapshot line: {0}".format(line))
+            continue
+
+        if count == 1:
+            if len(tokens) == 2:
+                val = ""
+            elif len(tokens) == 3:
+                val = tokens[2]
+            else:
+                # older snapshots wrote strings with spaces unquoted
+                val = " ".join(tokens[2:])
+        else:
+            val = tokens[2:]
+            if len(val) != count:
+                print(
+                    "WARNING: PV {0} has {1} values, but a count of {2}".format(
+                        pv, len(val), count
+                    )
+                )
+        vals[pv] = val
+    return PV_vals, ROPV_vals
+
+
+def snap_value_format(val):
+    """
+    Returns (count, text) of a value to write into a snapshot line, the inverse of snap_parse.
+    """
+    if isinstance(val, str):
+        if val == "":
+            return 1, r"\0"
+        if _snap_quote_re.search(val):
+            val = val.replace("\\", "\\\\").replace('"', '\\"')
+            return 1, '"{0}"'.format(val)
+        return 1, val
+
+    # prevent it writing "True" and "False" for bools
+    if isinstance(val, (bool, np.bool_)):
+        return 1, int(val)
+
+    if isinstance(val, (np.ndarray, list, tuple)):
+        vals = np.asarray(val)
+        if vals.dtype.kind == "b":
+            vals = vals.astype(int)
+        return len(vals), " ".join(str(v) for v in vals.tolist())
+    return 1, val
+
+
+def snap_write(fobj, PV_vals, ROPV_vals=None, username="", comments=""):
+    """
+    Write a BURT snapshot of the channel dictionaries, as returned by snap_parse
+    """
+    dt = datetime.datetime.now()
+    header = burt_header_template.format(
+        uname=username,
+        time=dt.strftime("%c"),
+    )
+    if comments:
+        header = header.replace("Comments:", "Comments: {0}".format(comments))
+    lines = [header, "\n"]
+    for pv in sorted(PV_vals):
+        count, val = snap_value_format(PV_vals[pv])
+        lines.append("{0} {1} {2}\n".format(pv, count, val))
+    if ROPV_vals is not None:
+        for pv in sorted(ROPV_vals):
+            count, val = snap_value_format(ROPV_vals[pv])
+            lines.append("RO {0} {1} {2}\n".format(pv, count, val))
+    fobj.write("".join(lines))
+    return
+
+
 burt_header_template = """
 --- Start BURT header
 Time:     {time}
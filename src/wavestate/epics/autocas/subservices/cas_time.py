@@ -9,7 +9,6 @@
 """
 
 
-import time
 import datetime
 
 from .. import cascore
@@ -50,4 +49,4 @@ class CASDateTime(cascore.CASUser):
         self.rv_str.value = dt.strftime("%X %x")
 
     def update_now(self):
-        self.update_unix_time(time.time())
+        self.update_unix_time(self.reactor.time())
@@ -9,7 +9,11 @@
 """
 
 
+import heapq
+import numpy as np
+
 from .. import cascore
+from ..cascore import reactor_stats
 from . import cas_time
 
 
@@ -78,6 +82,117 @@ class ProgramStatus(cascore.CASUser):
         )
         return rv
 
+    @cascore.dproperty
+    def rv_reactor_stats_ms(self):
+        """
+        Waveform of reactor timings over the last publishing window in milliseconds:
+        [wait p50, wait p99, wait max, run p50, run p99, run max]
+        """
+        rv = cascore.RelayValueWaveform(np.zeros(6), max_length=6)
+        self.cas_host(
+            rv,
+            "REACTOR_STATS_MS",
+            unit="milliseconds",
+            burt=False,
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_reactor_hot(self):
+        """
+        The task labels with the longest single run times and those times in milliseconds
+        """
+        rv = cascore.RelayValueLongString("")
+        self.cas_host(
+            rv,
+            "REACTOR_HOT",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_reactor_jitter(self):
+        """
+        The looping task labels with the latest starts after their deadlines and those times in milliseconds
+        """
+        rv = cascore.RelayValueLongString("")
+        self.cas_host(
+            rv,
+            "REACTOR_JITTER",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty_ctree(default=1)
+    def reactor_stats_period_s(self, val):
+        """
+        Period to publish the reactor instrumentation into the REACTOR PVs. If null, then the reactor is not instrumented.
+        """
+        if val is not None:
+            val = float(val)
+            assert val > 0
+        return val
+
+    @cascore.dproperty_ctree(default=5)
+    def reactor_stats_top_N(self, val):
+        """
+        Number of the slowest reactor tasks to list in REACTOR_HOT and REACTOR_JITTER
+        """
+        return int(val)
+
+    @cascore.dproperty
+    def setup_reactor_stats(self):
+        if self.reactor_stats_period_s is None:
+            return
+        if self.reactor.stats is None:
+            self.reactor.stats = reactor_stats.ReactorStats()
+        self.reactor.enqueue_looping(
+            self._reactor_stats_publish,
+            period_s=self.reactor_stats_period_s,
+        )
+
+    def _reactor_stats_publish(self):
+        stats = self.reactor.stats
+        if stats is None:
+            return
+        wait = stats.wait
+        run = stats.run
+        ms = 1e3
+        self.rv_reactor_latency_ms.value = ms * wait.quantile(0.99)
+        self.rv_reactor_fill.value = int(stats.fill_max)
+        self.rv_reactor_stats_ms.value = np.array(
+            [
+                ms * wait.quantile(0.5),
+                ms * wait.quantile(0.99),
+                ms * wait.max,
+                ms * run.quantile(0.5),
+                ms * run.quantile(0.99),
+                ms * run.max,
+            ]
+        )
+        hot = " ".join(
+            "{0}:{1:.1f}".format(tstats.label, ms * tstats.run.max)
+            for tstats in stats.top_slowest(self.reactor_stats_top_N)
+        )
+        self.rv_reactor_hot.value = hot[: self.rv_reactor_hot.max_length]
+        jitters = heapq.nlargest(
+            self.reactor_stats_top_N,
+            self.reactor.loop_jitters().items(),
+            key=lambda item: item[1].max,
+        )
+        jitter = " ".join(
+            "{0}:{1:.1f}".format(reactor_stats.task_label(key), ms * hist.max)
+            for key, hist in jitters
+        )
+        self.rv_reactor_jitter.value = jitter[: self.rv_reactor_jitter.max_length]
+
+        count = run.count
+        duration_s = stats.window_reset(self.reactor.clock())
+        if duration_s is not None and duration_s > 0:
+            self.rv_reactor_rate.value = int(count / duration_s)
+        return
+
     @cascore.dproperty
     def rv_reactor_canary(self):
         dt = cas_time.CASDateTime(parent=self, name="REACTOR_FAULT")
@@ -13,9 +13,6 @@ import sys
 import os
 from os import path
 
-# TODO import this later or make it failsafe
-import inotify_simple
-
 from .. import cascore
 
 
@@ -34,6 +31,8 @@ class RestartOnEdit(cascore.CASUser):
         self.reactor.enqueue(self._startup_task, future_s=3)
 
     def _startup_task(self):
+        import inotify_simple
+
         modfiles = modlist(
             ignores=self.ignore_list,
             accepts=self.accept_list,
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Supervision of the worker processes of a sharded program, see cascore.shard.
+
+Each worker reports its health to the supervisor as lines of JSON over a pipe.
+The supervisor aggregates the reports into its own channels and merges the
+snapshots of all of the processes into a single snapshot.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import getpass
+import functools
+import threading
+import traceback
+import subprocess
+from os import path
+
+from wavestate.bunch import Bunch
+
+from .. import cascore
+from . import autosave
+from . import autosave_base
+from . import cas_time
+
+
+class ShardReport(cascore.CASUser):
+    """
+    Reports the health of a worker process to the shard supervisor. The worker exits
+    once the supervisor is gone.
+    """
+
+    @cascore.dproperty
+    def report_fd(self, val):
+        return val
+
+    @cascore.dproperty_ctree(default=1)
+    def report_period_s(self, val):
+        """
+        Period for shard workers to report their health to the supervisor
+        """
+        val = float(val)
+        assert val > 0
+        return val
+
+    _report_file = None
+    _burt_time = None
+
+    @cascore.dproperty
+    def setup_report(self):
+        def notify(time_now, time_epoch):
+            self._burt_time = time_now
+
+        self.root.autosave.save_notify.register(
+            callback=notify,
+        )
+        self.reactor.enqueue_looping(
+            self.report_send,
+            period_s=self.report_period_s,
+        )
+
+    def report(self):
+        """
+        The report dictionary sent to the supervisor
+        """
+        status = self.root.status
+        return dict(
+            shard=self.root.shard_plan.shard,
+            pid=os.getpid(),
+            time=time.time(),
+            reactor_latency_ms=status.rv_reactor_latency_ms.value,
+            reactor_fill=status.rv_reactor_fill.value,
+            PVs_hosted=len(self.root.rv_db),
+            burt_time=self._burt_time,
+            burt_fpath=self.root.autosave.load_fpath,
+        )
+
+    def report_send(self):
+        if self._report_file is None:
+            self._report_file = os.fdopen(self.report_fd, "w", buffering=1)
+        try:
+            self._report_file.write(json.dumps(self.report()) + "\n")
+            self._report_file.flush()
+        except (BrokenPipeError, ValueError):
+            print("Shard supervisor is gone, exiting")
+            sys.exit(0)
+        return
+
+
+class ShardSupervisor(cascore.CASUser):
+    """
+    Starts, watches and restarts the worker processes of the shards, hosting their
+    aggregated health and merging their snapshots with that of the supervisor.
+    """
+
+    @cascore.dproperty
+    def plan(self):
+        return self.root.shard_plan
+
+    @cascore.dproperty_ctree(default=10)
+    def report_timeout_s(self, val):
+        """
+        Time without a report from a worker before the shard is considered down
+        """
+        return float(val)
+
+    @cascore.dproperty_ctree(default=10)
+    def restart_delay_s(self, val):
+        """
+        Time to wait before restarting a worker process which exited. If null, then workers are not restarted.
+        """
+        if val is not None:
+            val = float(val)
+        return val
+
+    @cascore.dproperty_ctree(default=lambda self: self.root.autosave.save_rate_s)
+    def merge_rate_s(self, val):
+        """
+        Rate to merge the snapshots of all of the shards into the autosave shards_fname.
+        Defaults to the autosave save_rate_s. If null, then the snapshots are not merged.
+        """
+        return val
+
+    @cascore.dproperty
+    def rv_shards_up(self):
+        rv = cascore.RelayValueInt(0)
+        self.cas_host(
+            rv,
+            "UP",
+            unit="number",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_shards_down(self):
+        """
+        Names of the shards without a recent report
+        """
+        rv = cascore.RelayValueLongString("")
+        self.cas_host(
+            rv,
+            "DOWN",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_restarts(self):
+        rv = cascore.RelayValueInt(0)
+        self.cas_host(
+            rv,
+            "RESTARTS",
+            unit="number",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_reactor_latency_ms(self):
+        """
+        Largest reactor latency of the supervisor and the shards
+        """
+        rv = cascore.RelayValueFloat(-1)
+        self.cas_host(
+            rv,
+            "REACTOR_LAT_MS",
+            unit="milliseconds",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_reactor_fill(self):
+        """
+        Largest reactor queue depth of the supervisor and the shards
+        """
+        rv = cascore.RelayValueInt(-1)
+        self.cas_host(
+            rv,
+            "REACTOR_FILL",
+            unit="number",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_PVs_hosted(self):
+        """
+        Total number of channels hosted by the supervisor and the shards
+        """
+        rv = cascore.RelayValueInt(0)
+        self.cas_host(
+            rv,
+            "PVS_HOSTED",
+            unit="number",
+            interaction="report",
+        )
+        return rv
+
+    @cascore.dproperty
+    def rv_merge_time(self):
+        dt = cas_time.CASDateTime(parent=self, name="BURT_MERGE_TIME")
+        return dt
+
+    @cascore.dproperty
+    def workers(self):
+        workers = dict()
+        for shard in self.plan.nodes:
+            workers[shard] = Bunch(
+                shard=shard,
+                proc=None,
+                report=None,
+                mtime_report=None,
+                mtime_exit=None,
+            )
+        return workers
+
+    @cascore.dproperty
+    def setup_workers(self):
+        # processes are only started once the reactor runs, not on construction
+        self.reactor.send_task(self._workers_start)
+        self.reactor.enqueue_looping(self._workers_check, period_s=1)
+        if self.merge_rate_s is not None:
+            self.reactor.enqueue_looping(self.burt_merge, period_s=self.merge_rate_s)
+        atexit.register(self.workers_stop)
+
+    def _workers_start(self):
+        for worker in self.workers.values():
+            if worker.proc is None:
+                self._worker_start(worker)
+        return
+
+    def _worker_start(self, worker):
+        fd_read, fd_write = os.pipe()
+        argv = self.plan.worker_argv(worker.shard, fd_write)
+        try:
+            proc = subprocess.Popen(argv, pass_fds=[fd_write])
+        except Exception:
+            os.close(fd_read)
+            raise
+        finally:
+            os.close(fd_write)
+        worker.proc = proc
+        worker.mtime_exit = None
+        # the mtime of the start, so that slow starting workers aren't immediately down
+        worker.mtime_report = time.monotonic()
+        thread = threading.Thread(
+            target=self._worker_read,
+            args=(worker, proc, fd_read),
+            name="shard {0} reports".format(worker.shard),
+        )
+        thread.daemon = True
+        thread.start()
+        return
+
+    def _worker_read(self, worker, proc, fd_read):
+        """
+        Reads the reports of a worker until it exits. Runs in a thread per worker.
+        """
+        with os.fdopen(fd_read, "r") as F:
+            for line in F:
+                try:
+                    report = json.loads(line)
+                except ValueError:
+                    continue
+                self.reactor.send_task(
+                    functools.partial(self._report_receive, worker, proc, report)
+                )
+        return
+
+    def _report_receive(self, worker, proc, report):
+        # reports of previous processes of the shard may arrive late
+        if worker.proc is proc:
+            worker.report = report
+            worker.mtime_report = time.monotonic()
+        return
+
+    def _workers_check(self):
+        mtime = time.monotonic()
+        down = []
+        latency_ms = self.root.status.rv_reactor_latency_ms.value
+        fill = self.root.status.rv_reactor_fill.value
+        PVs_hosted = len(self.root.rv_db)
+        for shard, worker in self.workers.items():
+            if worker.proc is not None and worker.proc.poll() is not None:
+                print(
+                    "WARNING: shard {0} exited with {1}".format(
+                        shard, worker.proc.returncode
+                    ),
+                    file=sys.stderr,
+                )
+                worker.proc = None
+                worker.report = None
+                worker.mtime_exit = mtime
+
+            if worker.proc is None:
+                down.append(shard)
+                # workers not yet started have no mtime_exit
+                if (
+                    self.restart_delay_s is not None
+                    and worker.mtime_exit is not None
+                    and mtime - worker.mtime_exit >= self.restart_delay_s
+                ):
+                    self._worker_start(worker)
+                    self.rv_restarts.value = self.rv_restarts.value + 1
+                continue
+
+            if mtime - worker.mtime_report > self.report_timeout_s:
+                down.append(shard)
+            report = worker.report
+            if report is not None:
+                latency_ms = max(latency_ms, report["reactor_latency_ms"])
+                fill = max(fill, report["reactor_fill"])
+                PVs_hosted += report["PVs_hosted"]
+
+        self.rv_shards_up.value = len(self.workers) - len(down)
+        down_str = " ".join(down)
+        self.rv_shards_down.value = down_str[: self.rv_shards_down.max_length]
+        self.rv_reactor_latency_ms.value = latency_ms
+        self.rv_reactor_fill.value = fill
+        self.rv_PVs_hosted.value = PVs_hosted
+        return
+
+    def workers_stop(self, timeout_s=5):
+        """
+        Terminate the worker processes, killing those which do not exit within timeout_s
+        """
+        procs = []
+        for worker in self.workers.values():
+            if worker.proc is not None and worker.proc.poll() is None:
+                worker.proc.terminate()
+                procs.append(worker.proc)
+        mtime_end = time.monotonic() + timeout_s
+        for proc in procs:
+            try:
+                proc.wait(max(0, mtime_end - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        return
+
+    def burt_fpaths(self):
+        """
+        The snapshots of the supervisor and of each shard, which may not exist yet
+        """
+        saver = self.root.autosave
+        fpaths = []
+        if saver.load_fpath is not None:
+            fpaths.append(saver.load_fpath)
+            for shard, worker in self.workers.items():
+                fpath = None
+                if worker.report is not None:
+                    fpath = worker.report["burt_fpath"]
+                if fpath is None:
+                    fpath = path.join(
+                        saver.load_folder,
+                        saver.load_fname.format(
+                            modname=self.plan.module_name_shard(shard)
+                        ),
+                    )
+                fpaths.append(fpath)
+        return fpaths
+
+    _merge_thread = None
+    _merge_stats = None
+
+    def burt_merge(self):
+        """
+        Merge the latest snapshots of the supervisor and the shards into the autosave
+        shards_fname. The files are read and written from a thread, and only if any of
+        them changed since the last merge.
+        """
+        saver = self.root.autosave
+        if saver.shards_fname is None or saver.load_folder is None:
+            return
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return
+        fpath_merge = path.join(
+            saver.load_folder, saver.shards_fname.format(modname=self.plan.module_name)
+        )
+        self._merge_thread = threading.Thread(
+            target=self._burt_merge_write,
+            args=(self.burt_fpaths(), fpath_merge),
+            name="shard snapshot merge",
+        )
+        self._merge_thread.daemon = True
+        self._merge_thread.start()
+        return
+
+    def _burt_merge_write(self, fpaths, fpath_merge):
+        try:
+            stats = []
+            for fpath in fpaths:
+                try:
+                    st = os.stat(fpath)
+                    stats.append((fpath, st.st_ino, st.st_mtime, st.st_size))
+                except OSError:
+                    stats.append((fpath, None, None, None))
+            if stats == self._merge_stats:
+                return
+            PV_vals = dict()
+            ROPV_vals = dict()
+            fpaths_read = []
+            for fpath, ino, mtime, size in stats:
+                if ino is None:
+                    continue
+                with autosave.snap_open(fpath) as F:
+                    PV_vals_f, ROPV_vals_f = autosave_base.snap_parse(F)
+                PV_vals.update(PV_vals_f)
+                ROPV_vals.update(ROPV_vals_f)
+                fpaths_read.append(path.basename(fpath))
+            fpath_temp = fpath_merge + "_temp"
+            with open(fpath_temp, "w") as F:
+                autosave_base.snap_write(
+                    F,
+                    PV_vals,
+                    ROPV_vals,
+                    username=getpass.getuser(),
+                    comments="merged from {0}".format(" ".join(fpaths_read)),
+                )
+                F.flush()
+                os.fsync(F.fileno())
+            # atomic rename, so the merged snapshot is always complete
+            os.rename(fpath_temp, fpath_merge)
+            self._merge_stats = stats
+        except Exception:
+            # TODO, log better
+            traceback.print_exc()
+        else:
+            self.reactor.send_task(self.rv_merge_time.update_now)
+        return
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Comparison of BURT snapshots, against each other or against live channel values.
+"""
+import math
+
+import numpy as np
+from wavestate.bunch import Bunch
+
+from . import autosave
+from . import autosave_base
+
+
+def snap_file_load(fname, include_RO=False):
+    """
+    Load a snapshot (possibly compressed) into a dictionary of channel values. The
+    values are as given by autosave_base.snap_parse. Read-only channels are only
+    included if include_RO.
+    """
+    with autosave.snap_open(fname) as F:
+        PV_vals, ROPV_vals = autosave_base.snap_parse(F)
+    if include_RO:
+        ROPV_vals.update(PV_vals)
+        return ROPV_vals
+    return PV_vals
+
+
+def snap_file_RO(fname):
+    """
+    The set of channels marked read-only in a snapshot
+    """
+    with autosave.snap_open(fname) as F:
+        PV_vals, ROPV_vals = autosave_base.snap_parse(F)
+    return set(ROPV_vals.keys())
+
+
+def _numeric(val):
+    """
+    The value as a float array, or None if it isn't numeric
+    """
+    try:
+        val = np.asarray(val, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    return val
+
+
+def snap_values_equal(val_a, val_b, atol=0, rtol=0):
+    """
+    Compare two channel values, either of which may be the strings (or lists of strings)
+    read from a snapshot. Numeric values are equal within the tolerances, as np.isclose.
+    """
+    if isinstance(val_a, str) and isinstance(val_b, str):
+        if val_a == val_b:
+            return True
+    elif isinstance(val_a, list) and isinstance(val_b, list):
+        if val_a == val_b:
+            return True
+
+    if not isinstance(val_a, (list, np.ndarray)) and not isinstance(
+        val_b, (list, np.ndarray)
+    ):
+        # scalars are compared without numpy, which dominates for large snapshots
+        try:
+            num_a = float(val_a)
+            num_b = float(val_b)
+        except (TypeError, ValueError):
+            return str(val_a) == str(val_b)
+        if num_a == num_b:
+            return True
+        if math.isinf(num_a) or math.isinf(num_b):
+            # infinities are only equal to themselves, as for np.isclose
+            return False
+        if num_a != num_a or num_b != num_b:
+            return num_a != num_a and num_b != num_b
+        return abs(num_a - num_b) <= atol + rtol * abs(num_b)
+
+    num_a = _numeric(val_a)
+    if num_a is None:
+        return False
+    num_b = _numeric(val_b)
+    if num_b is None:
+        return False
+    if num_a.shape != num_b.shape:
+        return False
+    return bool(np.all(np.isclose(num_a, num_b, atol=atol, rtol=rtol, equal_nan=True)))
+
+
+def snap_diff(vals_a, vals_b, atol=0, rtol=0):
+    """
+    Compare the channel dictionaries vals_a and vals_b. Returns a Bunch of
+
+    added: channel -> value in vals_b but not vals_a
+    removed: channel -> value in vals_a but not vals_b
+    changed: channel -> (value_a, value_b) for values unequal within the tolerances
+    """
+    keys_a = vals_a.keys()
+    keys_b = vals_b.keys()
+    added = {pv: vals_b[pv] for pv in keys_b - keys_a}
+    removed = {pv: vals_a[pv] for pv in keys_a - keys_b}
+    changed = dict()
+    for pv in keys_a & keys_b:
+        val_a = vals_a[pv]
+        val_b = vals_b[pv]
+        if not snap_values_equal(val_a, val_b, atol=atol, rtol=rtol):
+            changed[pv] = (val_a, val_b)
+    return Bunch(
+        added=added,
+        removed=removed,
+        changed=changed,
+    )
+
+
+def snap_diff_lines(diff):
+    """
+    Lines describing a snap_diff, sorted by channel. Added channels are marked with "+",
+    removed with "-" and changed with "~".
+    """
+    lines = []
+    for pv, val in diff.added.items():
+        lines.append((pv, "+ {0} {1}".format(pv, _val_str(val))))
+    for pv, val in diff.removed.items():
+        lines.append((pv, "- {0} {1}".format(pv, _val_str(val))))
+    for pv, (val_a, val_b) in diff.changed.items():
+        lines.append(
+            (pv, "~ {0} {1} -> {2}".format(pv, _val_str(val_a), _val_str(val_b)))
+        )
+    lines.sort()
+    return [line for pv, line in lines]
+
+
+def _val_str(val):
+    count, text = autosave_base.snap_value_format(val)
+    return text
+
+
+def value_typecast_like(val, like):
+    """
+    Typecast a value read from a snapshot to the type of the live value like, so that
+    it may be written back to the channel.
+    """
+    if isinstance(like, str):
+        if isinstance(val, list):
+            return " ".join(val)
+        return str(val)
+    if isinstance(like, np.ndarray):
+        return np.asarray(val, dtype=like.dtype)
+    if isinstance(like, (int, np.integer)):
+        return int(float(val))
+    return float(val)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+Time-series logging of the burt channels.
+
+Every change of a burt channel is appended as a (time, channel id, value)
+record to an append-only binary log. Records are written in chunks, and each
+log has a JSON-lines index next to it, holding the channel table and, per chunk,
+the byte offset, time span and the ids of the channels it contains. Logs roll over
+with the autosave rollover rate and start with a keyframe chunk holding every
+channel's value, so any past snapshot is rebuilt from a single log without
+scanning the history before it.
+
+StateLogReader answers queries against a folder of logs.
+"""
+import os
+import struct
+import json
+import glob
+import datetime
+import threading
+import collections
+import traceback
+from os import path
+
+import numpy as np
+from wavestate.bunch import Bunch
+
+from .. import cascore
+
+_CHUNK = struct.Struct("<4sI")
+_CHUNK_MAGIC = b"SLC1"
+_RECORD = struct.Struct("<dIB")
+_COUNT = struct.Struct("<I")
+_FLOAT = struct.Struct("<d")
+_INT = struct.Struct("<q")
+
+_TYPE_FLOAT = 0
+_TYPE_INT = 1
+_TYPE_STR = 2
+_TYPE_FLOAT_ARRAY = 3
+_TYPE_INT_ARRAY = 4
+
+_INDEX_VERSION = 1
+
+
+def encode_record(ptime, cid, val):
+    """
+    Encode a single record as bytes
+    """
+    if isinstance(val, (bool, np.bool_)):
+        val = int(val)
+    if isinstance(val, (int, np.integer)):
+        return _RECORD.pack(ptime, cid, _TYPE_INT) + _INT.pack(val)
+    elif isinstance(val, (float, np.floating)):
+        return _RECORD.pack(ptime, cid, _TYPE_FLOAT) + _FLOAT.pack(val)
+    elif isinstance(val, str):
+        bval = val.encode("utf-8")
+        return _RECORD.pack(ptime, cid, _TYPE_STR) + _COUNT.pack(len(bval)) + bval
+    val = np.asarray(val)
+    if val.ndim != 1 or val.dtype.kind not in "iubf":
+        raise TypeError(
+            "Only numbers, strings and numeric arrays can be logged, not {0!r}".format(
+                val
+            )
+        )
+    if val.dtype.kind in "iub":
+        bval = val.astype("<i8").tobytes()
+        vtype = _TYPE_INT_ARRAY
+    else:
+        bval = val.astype("<f8").tobytes()
+        vtype = _TYPE_FLOAT_ARRAY
+    return _RECORD.pack(ptime, cid, vtype) + _COUNT.pack(len(val)) + bval
+
+
+def decode_records(payload):
+    """
+    Decode a chunk payload into a list of (time, channel id, value) records
+    """
+    records = []
+    offset = 0
+    N = len(payload)
+    while offset < N:
+        ptime, cid, vtype = _RECORD.unpack_from(payload, offset)
+        offset += _RECORD.size
+        if vtype == _TYPE_FLOAT:
+            (val,) = _FLOAT.unpack_from(payload, offset)
+            offset += _FLOAT.size
+        elif vtype == _TYPE_INT:
+            (val,) = _INT.unpack_from(payload, offset)
+            offset += _INT.size
+        else:
+            (count,) = _COUNT.unpack_from(payload, offset)
+            offset += _COUNT.size
+            if vtype == _TYPE_STR:
+                val = payload[offset : offset + count].decode("utf-8")
+                offset += count
+            elif vtype == _TYPE_FLOAT_ARRAY:
+                val = np.frombuffer(payload, dtype="<f8", count=count, offset=offset)
+                offset += 8 * count
+            elif vtype == _TYPE_INT_ARRAY:
+                val = np.frombuffer(payload, dtype="<i8", count=count, offset=offset)
+                offset += 8 * count
+            else:
+                raise RuntimeError("Corrupt state log record type {0}".format(vtype))
+        records.append((ptime, cid, val))
+    return records
+
+
+class StateLog(cascore.CASUser):
+    """
+    Logs every change of the burt channels to chunked binary files. Uses the
+    channel list of the autosave and, by default, its rollover rate. Changes are
+    collected on the reactor and written by a background thread every flush_rate_s.
+    """
+
+    @cascore.dproperty_ctree(default=False)
+    def log_enable(self, val):
+        """
+        Log every change of the burt channels to the state log
+        """
+        return bool(val)
+
+    @cascore.dproperty_ctree(default=lambda self: self.root.autosave.rollover_rate_s)
+    def rollover_rate_s(self, val):
+        """
+        Rate to rollover to a new log file. Each file starts with the value of every channel. Defaults to the autosave rollover rate.
+        """
+        return val
+
+    @cascore.dproperty_ctree(default=10)
+    def flush_rate_s(self, val):
+        """
+        Rate to write the collected changes to the log as a chunk
+        """
+        return val
+
+    @cascore.dproperty_ctree(
+        default=lambda self: path.join(self.root.autosave.save_folder, "statelog")
+    )
+    def log_folder(self, val):
+        """
+        Folder to store the state logs within
+        """
+        return val
+
+    @cascore.dproperty_ctree(
+        default="{modname}_state_{year}{month}{day}_{hour}{minute}{second}.statelog"
+    )
+    def log_fname_template(self, val):
+        """
+        Template to generate log file names. It can use formatting keys:
+        {modname}, {year}, {month}, {day}, {hour}, {minute}, {second}
+        """
+        return val
+
+    @cascore.dproperty
+    def modname(self):
+        return self.root.module_name
+
+    _records = None
+    _channels = None
+    _ptime_epoch = None
+    _log_thread = None
+    _log_cv = None
+    _log_jobs = None
+
+    def start_logging(self):
+        """
+        Register for changes of the autosave channels. Called once the CAS driver
+        has given the autosave its database.
+        """
+        if not self.log_enable or self._channels is not None:
+            return
+        autosave = self.root.autosave
+        pvdb = autosave._my_pvdb
+        channels = []
+        for pv, pvRO in autosave._my_chnlist:
+            # TODO, make the internal/remote save decision better
+            if pvdb[pv].get("remote", False):
+                continue
+            cid = len(channels)
+            channels.append(pv)
+            pvdb[pv]["rv"].register(
+                callback=self._change_cb_generator(cid),
+                key=self,
+            )
+        self._channels = channels
+        self._records = []
+        try:
+            os.makedirs(self.log_folder)
+        except OSError:
+            if not path.isdir(self.log_folder):
+                raise
+        self.reactor.enqueue_looping(
+            self.log_flush,
+            period_s=self.flush_rate_s,
+        )
+        return
+
+    def _change_cb_generator(self, cid):
+        def change_cb(value):
+            if isinstance(value, np.ndarray):
+                # waveform values may be views which change in place
+                value = value.copy()
+            self._records.append((self.reactor.time(), cid, value))
+
+        return change_cb
+
+    def _keyframe(self, ptime_now):
+        pvdb = self.root.autosave._my_pvdb
+        keyframe = []
+        for cid, pv in enumerate(self._channels):
+            val = pvdb[pv]["rv"].value
+            if isinstance(val, np.ndarray):
+                val = val.copy()
+            keyframe.append((ptime_now, cid, val))
+        return keyframe
+
+    def log_flush(self):
+        """
+        Hand the collected changes to the writer thread, rolling over to a new
+        log (starting with a keyframe) at each rollover epoch.
+        """
+        if self._channels is None:
+            return
+        ptime_now = self.reactor.time()
+        ptime_epoch = ptime_now - (ptime_now % self.rollover_rate_s)
+        records = self._records
+        self._records = []
+
+        job = Bunch(records=records, keyframe=None, fpath=None)
+        if ptime_epoch != self._ptime_epoch:
+            self._ptime_epoch = ptime_epoch
+            dt_now = datetime.datetime.fromtimestamp(ptime_now)
+            fill = str("0")
+            fname = self.log_fname_template.format(
+                year=str(dt_now.year).rjust(4, fill),
+                month=str(dt_now.month).rjust(2, fill),
+                day=str(dt_now.day).rjust(2, fill),
+                hour=str(dt_now.hour).rjust(2, fill),
+                minute=str(dt_now.minute).rjust(2, fill),
+                second=str(dt_now.second).rjust(2, fill),
+                ptime=ptime_now,
+                modname=self.modname,
+            )
+            job.fpath = path.abspath(path.join(self.log_folder, fname))
+            job.ptime_start = ptime_now
+            # the records so far belong before the keyframe, in the previous log
+            job.keyframe = self._keyframe(ptime_now)
+        elif not records:
+            return
+
+        if self._log_thread is None:
+            self._log_cv = threading.Condition()
+            self._log_jobs = collections.deque()
+            self._log_thread = threading.Thread(
+                target=self._log_loop,
+                name="state log I/O",
+            )
+            self._log_thread.daemon = True
+            self._log_thread.start()
+
+        with self._log_cv:
+            self._log_jobs.append(job)
+            self._log_cv.notify()
+        return
+
+    # state of the writer thread
+    _log_file = None
+    _log_index = None
+
+    def _log_loop(self):
+        while True:
+            with self._log_cv:
+                while not self._log_jobs:
+                    self._log_cv.wait()
+                jobs = list(self._log_jobs)
+                self._log_jobs.clear()
+
+            for job in jobs:
+                try:
+                    self._log_write(job)
+                except Exception:
+                    # TODO, log better
+                    traceback.print_exc()
+
+    def _log_write(self, job):
+        if job.records and self._log_file is not None:
+            self._chunk_write(job.records)
+        if job.fpath is not None:
+            self._log_open(job.fpath, job.ptime_start)
+            self._chunk_write(job.keyframe, key=True)
+        elif job.records and self._log_file is None:
+            # the log couldn't be opened, there is nowhere to put these
+            return
+        self._log_file.flush()
+        self._log_index.flush()
+        return
+
+    def _log_open(self, fpath, ptime_start):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_index.close()
+            self._log_file = None
+            self._log_index = None
+        # created exclusively, so that a restart within the same file name starts a
+        # new log, rather than appending records of another channel table
+        fbase, fext = path.splitext(fpath)
+        idx = 0
+        while True:
+            try:
+                self._log_file = open(fpath, "xb")
+                break
+            except FileExistsError:
+                idx += 1
+                fpath = "{0}_{1}{2}".format(fbase, idx, fext)
+        self._log_index = open(fpath + ".idx", "w")
+        header = dict(
+            version=_INDEX_VERSION,
+            ptime_start=ptime_start,
+            channels=self._channels,
+        )
+        self._log_index.write(json.dumps(header) + "\n")
+        return
+
+    # ids of the channels whose values could not be logged, reported once each
+    _cids_bad = None
+
+    def _chunk_write(self, records, key=False):
+        if self._cids_bad is None:
+            self._cids_bad = set()
+        encoded = []
+        records_ok = []
+        for record in records:
+            try:
+                encoded.append(encode_record(*record))
+            except (TypeError, ValueError):
+                # drop only this record, so one bad channel keeps the history of
+                # the others
+                # TODO, log better
+                if record[1] not in self._cids_bad:
+                    self._cids_bad.add(record[1])
+                    traceback.print_exc()
+                continue
+            records_ok.append(record)
+        records = records_ok
+        payload = b"".join(encoded)
+        offset = self._log_file.tell()
+        self._log_file.write(_CHUNK.pack(_CHUNK_MAGIC, len(payload)))
+        self._log_file.write(payload)
+        entry = dict(
+            offset=offset,
+            size=len(payload),
+            t0=records[0][0] if records else 0,
+            t1=records[-1][0] if records else 0,
+            N=len(records),
+            chn=sorted(set(record[1] for record in records)),
+            key=key,
+        )
+        self._log_index.write(json.dumps(entry) + "\n")
+        return
+
+
+class StateLogFile(object):
+    """
+    One state log and its index
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        with open(fpath + ".idx", "r") as F:
+            lines = F.read().splitlines()
+        header = json.loads(lines[0])
+        self.ptime_start = header["ptime_start"]
+        self.channels = header["channels"]
+        self.cids = {pv: cid for cid, pv in enumerate(self.channels)}
+        self.chunks = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            entry = json.loads(line)
+            entry["chn"] = frozenset(entry["chn"])
+            self.chunks.append(entry)
+        if self.chunks:
+            self.ptime_end = max(c["t1"] for c in self.chunks)
+        else:
+            self.ptime_end = self.ptime_start
+
+    def chunk_records(self, chunk):
+        with open(self.fpath, "rb") as F:
+            F.seek(chunk["offset"])
+            magic, size = _CHUNK.unpack(F.read(_CHUNK.size))
+            if magic != _CHUNK_MAGIC:
+                raise RuntimeError("Corrupt state log chunk in {0}".format(self.fpath))
+            return decode_records(F.read(size))
+
+
+class StateLogReader(object):
+    """
+    Queries the state logs in a folder. Only the indexes are read up front, and
+    queries only read the chunks whose time span and channels can match.
+    """
+
+    def __init__(self, log_folder, pattern="*.statelog"):
+        self.files = []
+        for fpath in glob.glob(path.join(log_folder, pattern)):
+            if not path.exists(fpath + ".idx"):
+                continue
+            self.files.append(StateLogFile(fpath))
+        self.files.sort(key=lambda f: f.ptime_start)
+
+    def _file_at(self, ptime):
+        for f in reversed(self.files):
+            if f.ptime_start <= ptime:
+                return f
+        return None
+
+    def value_at(self, pv, ptime, default=None):
+        """
+        The value of channel pv at time ptime
+        """
+        for f in reversed(self.files):
+            if f.ptime_start > ptime:
+                continue
+            cid = f.cids.get(pv, None)
+            if cid is None:
+                continue
+            for chunk in reversed(f.chunks):
+                if chunk["t0"] > ptime or cid not in chunk["chn"]:
+                    continue
+                for rtime, rcid, val in reversed(f.chunk_records(chunk)):
+                    if rcid == cid and rtime <= ptime:
+                        return val
+        return default
+
+    def snapshot_at(self, ptime):
+        """
+        Dictionary of the value of every channel at time ptime
+        """
+        f = self._file_at(ptime)
+        if f is None:
+            return {}
+        values = {}
+        for chunk in f.chunks:
+            if chunk["t0"] > ptime:
+                break
+            for rtime, cid, val in f.chunk_records(chunk):
+                if rtime <= ptime:
+                    values[f.channels[cid]] = val
+        return values
+
+    def changes(self, ptime_start, ptime_end, pvs=None):
+        """
+        List of (time, channel, value) for all changes within [ptime_start, ptime_end],
+        optionally only of the channels in pvs
+        """
+        changes = []
+        for f in self.files:
+            if f.ptime_end < ptime_start or f.ptime_start > ptime_end:
+                continue
+            if pvs is not None:
+                cids = set(f.cids[pv] for pv in pvs if pv in f.cids)
+            else:
+                cids = None
+            for chunk in f.chunks:
+                if chunk["key"]:
+                    continue
+                if chunk["t1"] < ptime_start or chunk["t0"] > ptime_end:
+                    continue
+                if cids is not None and not (cids & chunk["chn"]):
+                    continue
+                for rtime, cid, val in f.chunk_records(chunk):
+                    if rtime < ptime_start or rtime > ptime_end:
+                        continue
+                    if cids is not None and cid not in cids:
+                        continue
+                    changes.append((rtime, f.channels[cid], val))
+        changes.sort(key=lambda c: c[0])
+        return changes
@@ -29,7 +29,10 @@ def print(*args):
     oldprint(*args)
 
 
-try:
-    from IPython.lib.pretty import pprint
-except ImportError:
-    from pprint import pprint
+def pprint(*args, **kwargs):
+    # IPython is slow to import, so it is only loaded when used
+    try:
+        from IPython.lib.pretty import pprint
+    except ImportError:
+        from pprint import pprint
+    return pprint(*args, **kwargs)
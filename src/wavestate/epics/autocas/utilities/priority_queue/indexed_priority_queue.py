@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: Apache-2.0
+# SPDX-FileCopyrightText: © 2021 Massachusetts Institute of Technology.
+# SPDX-FileCopyrightText: © 2021 Lee McCuller <mcculler@mit.edu>
+# NOTICE: authors should document their contributions in concisely in NOTICE
+# with details inline in source files, comments, and docstrings.
+"""
+.. autoclass:: IndexedPriorityQueue
+"""
+import itertools
+import queue
+
+
+class IndexedPriorityQueue(object):
+    """
+    Binary heap priority queue where every entry is stored under a hashable key.
+    The key index allows entries to be re-prioritized (in either direction) or
+    removed in O(log n), so cancelled or rescheduled entries never linger in the
+    heap. Entries of equal priority pop in insertion order.
+
+    This implementation is **not** threadsafe
+
+    .. automethod:: __init__
+
+    .. automethod:: peek
+
+    .. automethod:: peek_key
+
+    .. automethod:: is_empty
+
+    .. automethod:: pop
+
+    .. automethod:: push
+
+    .. automethod:: remove
+
+    .. automethod:: discard
+
+    .. automethod:: get
+
+    """
+
+    def __init__(self, iterable=()):
+        """
+        :param iterable: iterable of initial (key, priority, item) triples
+        """
+        # entries are lists of [priority, sequence, key, item]. The unique sequence
+        # number breaks ties so that the keys and items are never compared.
+        self.heap = []
+        self.index = {}
+        self._sequence = itertools.count()
+        for key, priority, item in iterable:
+            self.push(key, priority, item)
+
+    def peek(self):
+        """
+        View the first (priority, item) pair without discarding
+
+        :raises: :exc:`queue.Empty` if no items contained
+        """
+        try:
+            entry = self.heap[0]
+        except IndexError:
+            raise queue.Empty()
+        return entry[0], entry[3]
+
+    def peek_key(self):
+        """
+        View the key of the first entry without discarding
+
+        :raises: :exc:`queue.Empty` if no items contained
+        """
+        try:
+            return self.heap[0][2]
+        except IndexError:
+            raise queue.Empty()
+
+    def is_empty(self):
+        """
+        Returns True when empty
+        """
+        return not self.heap
+
+    def __nonzero__(self):
+        return bool(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key, default=None):
+        """
+        return the (priority, item) pair stored under key, or default if the key
+        is not queued
+        """
+        idx = self.index.get(key, None)
+        if idx is None:
+            return default
+        entry = self.heap[idx]
+        return entry[0], entry[3]
+
+    def pop(self):
+        """
+        remove and return the first (priority, item) pair
+
+        :raises: :exc:`queue.Empty` if no items contained
+        """
+        if not self.heap:
+            raise queue.Empty()
+        entry = self._remove_at(0)
+        return entry[0], entry[3]
+
+    def push(self, key, priority, item):
+        """
+        Add an item to the priority queue under key. If the key is already queued,
+        its entry is replaced and moved to the new priority (a decrease-key or
+        increase-key).
+        """
+        idx = self.index.get(key, None)
+        if idx is None:
+            entry = [priority, next(self._sequence), key, item]
+            idx = len(self.heap)
+            self.heap.append(entry)
+            self.index[key] = idx
+            self._sift_up(idx)
+        else:
+            entry = self.heap[idx]
+            prev_priority = entry[0]
+            entry[0] = priority
+            entry[3] = item
+            if priority < prev_priority:
+                self._sift_up(idx)
+            elif priority > prev_priority:
+                self._sift_down(idx)
+        return
+
+    def remove(self, key):
+        """
+        remove the entry stored under key and return its (priority, item) pair
+
+        :raises: :exc:`KeyError` if the key is not queued
+        """
+        idx = self.index[key]
+        entry = self._remove_at(idx)
+        return entry[0], entry[3]
+
+    def discard(self, key):
+        """
+        remove the entry stored under key if it is queued. Returns True if an entry was removed.
+        """
+        idx = self.index.get(key, None)
+        if idx is None:
+            return False
+        self._remove_at(idx)
+        return True
+
+    def _remove_at(self, idx):
+        heap = self.heap
+        entry = heap[idx]
+        del self.index[entry[2]]
+        last = heap.pop()
+        if idx < len(heap):
+            heap[idx] = last
+            self.index[last[2]] = idx
+            if last < entry:
+                self._sift_up(idx)
+            else:
+                self._sift_down(idx)
+        return entry
+
+    def _sift_up(self, idx):
+        heap = self.heap
+        index = self.index
+        entry = heap[idx]
+        while idx > 0:
+            pidx = (idx - 1) >> 1
+            parent = heap[pidx]
+            if entry < parent:
+                heap[idx] = parent
+                index[parent[2]] = idx
+                idx = pidx
+            else:
+                break
+        heap[idx] = entry
+        index[entry[2]] = idx
+        return
+
+    def _sift_down(self, idx):
+        heap = self.heap
+        index = self.index
+        N = len(heap)
+        entry = heap[idx]
+        while True:
+            cidx = 2 * idx + 1
+            if cidx >= N:
+                break
+            ridx = cidx + 1
+            if ridx < N and heap[ridx] < heap[cidx]:
+                cidx = ridx
+            child = heap[cidx]
+            if child < entry:
+                heap[idx] = child
+                index[child[2]] = idx
+                idx = cidx
+            else:
+                break
+        heap[idx] = entry
+        index[entry[2]] = idx
+        return
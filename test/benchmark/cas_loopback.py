@@ -0,0 +1,493 @@
+"""
+In-process loopback Channel Access harness for the benchmarks.
+
+An InstaCAS hosting synthetic RelayValueFloat and RelayValueWaveform channels is
+served on a loopback-only CA configuration, on a free port so that the benchmarks
+neither reach nor collide with the CA servers of the network. The reactor runs in the
+main thread, as it guards its tasks from SIGINT, while each benchmark drives puts and
+monitors from a pyepics client in another thread of this same process.
+
+The CA libraries read their configuration once, so a process only hosts a single
+LoopbackProgram, and loopback_env must be called before the CA libraries are used.
+"""
+import os
+import time
+import socket
+import tempfile
+import threading
+
+import numpy as np
+
+from wavestate.epics import autocas
+from wavestate.epics.autocas.cascore import ctree
+from wavestate.epics.autocas.cascore import reactor_stats
+
+_loopback_port = None
+# receives (and ignores) the beacons, which servers complain about if refused
+_beacon_sock = None
+
+
+def loopback_env():
+    """
+    Configure the CA clients and servers of this process for loopback only, on a free
+    port. Returns the port.
+    """
+    global _loopback_port, _beacon_sock
+    if _loopback_port is None:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            _loopback_port = sock.getsockname()[1]
+        _beacon_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _beacon_sock.bind(("127.0.0.1", 0))
+        os.environ.update(
+            EPICS_CA_AUTO_ADDR_LIST="NO",
+            EPICS_CA_ADDR_LIST="127.0.0.1",
+            EPICS_CA_SERVER_PORT=str(_loopback_port),
+            EPICS_CAS_SERVER_PORT=str(_loopback_port),
+            EPICS_CAS_INTF_ADDR_LIST="127.0.0.1",
+            EPICS_CAS_AUTO_BEACON_ADDR_LIST="NO",
+            EPICS_CAS_BEACON_ADDR_LIST="127.0.0.1",
+            EPICS_CAS_BEACON_PORT=str(_beacon_sock.getsockname()[1]),
+        )
+    return _loopback_port
+
+
+class BenchPVs(autocas.CASUser):
+    """
+    The synthetic channels, F0000... floats which clients may write, W0000...
+    waveforms which are only updated by the program, and R0000... floats which are
+    only used by bench_relay.
+    """
+
+    @autocas.dproperty
+    def N_float(self, val=100):
+        return val
+
+    @autocas.dproperty
+    def N_waveform(self, val=10):
+        return val
+
+    @autocas.dproperty
+    def waveform_length(self, val=1024):
+        return val
+
+    @autocas.dproperty
+    def rvs_float(self):
+        rvs = []
+        for idx in range(self.N_float):
+            rv = autocas.RelayValueFloat(0)
+            self.cas_host(
+                rv,
+                "F{0:04d}".format(idx),
+                interaction="setting",
+                burt=False,
+            )
+            rvs.append(rv)
+        return rvs
+
+    @autocas.dproperty
+    def rvs_relay(self):
+        rvs = []
+        for idx in range(self.N_float):
+            rv = autocas.RelayValueFloat(0)
+            self.cas_host(
+                rv,
+                "R{0:04d}".format(idx),
+                interaction="setting",
+                burt=False,
+            )
+            rvs.append(rv)
+        return rvs
+
+    @autocas.dproperty
+    def rvs_waveform(self):
+        rvs = []
+        for idx in range(self.N_waveform):
+            rv = autocas.RelayValueWaveform(
+                np.zeros(self.waveform_length),
+                max_length=self.waveform_length,
+            )
+            self.cas_host(
+                rv,
+                "W{0:04d}".format(idx),
+                interaction="report",
+                burt=False,
+            )
+            rvs.append(rv)
+        return rvs
+
+
+class LoopbackProgram(object):
+    """
+    An InstaCAS with BenchPVs. Once started, benchmarks are given to run, which runs the
+    reactor until they finish.
+    """
+
+    def __init__(
+        self,
+        backend="pcaspy",
+        reactor_type="threading",
+        N_float=100,
+        N_waveform=10,
+        waveform_length=1024,
+        write_inbox=None,
+    ):
+        loopback_env()
+        self.save_folder = tempfile.mkdtemp(prefix="autocas_bench_")
+        ctree_root = ctree.ConfigTreeRoot()
+        ctree_root.config_load_recursive(
+            {
+                "cas_backend": backend,
+                "reactor_type": reactor_type,
+                "cas_write_inbox": write_inbox,
+                "settings": {"time_convention": "UNIX"},
+                # the benchmarks keep their own statistics
+                "status": {"reactor_stats_period_s": None},
+                "burt": {"save_folder": self.save_folder},
+            }
+        )
+        self.root = autocas.InstaCAS(
+            prefix_base="X1",
+            prefix_subsystem="BENCH",
+            module_name="x1bench",
+            ctree_root=ctree_root,
+        )
+        self.bench = BenchPVs(
+            parent=self.root,
+            name="bench",
+            N_float=N_float,
+            N_waveform=N_waveform,
+            waveform_length=waveform_length,
+        )
+        self.reactor = self.root.reactor
+        self.channels_float = [self.channel(rv) for rv in self.bench.rvs_float]
+        self.channels_waveform = [self.channel(rv) for rv in self.bench.rvs_waveform]
+        self.channels_relay = [self.channel(rv) for rv in self.bench.rvs_relay]
+
+    def channel(self, rv):
+        return self.root.prefix2channel(self.root.rv_names[rv])
+
+    def start(self):
+        self.root.start()
+        self.reactor.stats = reactor_stats.ReactorStats()
+
+    def stop(self):
+        self.root.stop()
+
+    def run(self, bench, *args, **kwargs):
+        """
+        Run bench(self, *args, **kwargs) from a client thread, while running the reactor
+        in this thread until it finishes. Returns the result of bench.
+        """
+        result = []
+
+        def client():
+            try:
+                result.append(bench(self, *args, **kwargs))
+            except BaseException as E:
+                result.append(E)
+                raise
+            finally:
+                self.reactor.loop_kill()
+
+        thread = threading.Thread(target=client, name="bench client")
+        thread.daemon = True
+        thread.start()
+        self.reactor.run_reactor()
+        thread.join()
+        if isinstance(result[0], BaseException):
+            raise result[0]
+        return result[0]
+
+    def reactor_call(self, func, *args, **kwargs):
+        """
+        Run func in the reactor thread and return its result, for use by the benchmarks
+        """
+        return self.reactor.send_task_synchronous(func, *args, **kwargs)
+
+    def reactor_report(self):
+        """
+        Queue depth and task wait statistics of the reactor since the last call
+        """
+        stats = self.reactor.stats
+        report = dict(
+            reactor_fill_max=stats.fill_max,
+            reactor_wait_p50_ms=1e3 * stats.wait.quantile(0.5),
+            reactor_wait_p99_ms=1e3 * stats.wait.quantile(0.99),
+            reactor_wait_max_ms=1e3 * stats.wait.max,
+        )
+        stats.reset()
+        return report
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def latency_report(latency_s, prefix="latency"):
+    """
+    Percentiles of the latencies, in milliseconds
+    """
+    latency_s = np.asarray(latency_s)
+    latency_s = latency_s[np.isfinite(latency_s)]
+    if len(latency_s) == 0:
+        return {}
+    p50, p90, p99 = np.percentile(latency_s, [50, 90, 99])
+    return {
+        prefix + "_p50_ms": 1e3 * p50,
+        prefix + "_p90_ms": 1e3 * p90,
+        prefix + "_p99_ms": 1e3 * p99,
+        prefix + "_max_ms": 1e3 * np.max(latency_s),
+    }
+
+
+def _report_plain(report):
+    """
+    Convert the numpy scalars of a report, so that it may be saved as JSON
+    """
+    return {
+        key: (val.item() if isinstance(val, np.generic) else val)
+        for key, val in report.items()
+    }
+
+
+def _connect(pvs, timeout_s=10):
+    for pv in pvs:
+        if not pv.wait_for_connection(timeout=timeout_s):
+            raise RuntimeError("Could not connect to {0}".format(pv.pvname))
+
+
+def _settle(counter, quiet_s=0.5, timeout_s=30):
+    """
+    Wait until counter() stops changing for quiet_s
+    """
+    mtime_end = time.monotonic() + timeout_s
+    last = counter()
+    mtime_last = time.monotonic()
+    while time.monotonic() < mtime_end:
+        time.sleep(0.05)
+        now = counter()
+        if now != last:
+            last = now
+            mtime_last = time.monotonic()
+        elif time.monotonic() - mtime_last > quiet_s:
+            break
+    return last
+
+
+def bench_puts(prog, N_puts=5000, window=200, timeout_s=60):
+    """
+    Put sequence numbers round-robin to the float channels from a client, without
+    waiting for completion but keeping at most window puts outstanding. The latency
+    is from the put until the RelayValue in the program is updated.
+    """
+    import epics
+
+    rvs = prog.bench.rvs_float
+    mtimes_sent = np.full(N_puts + 1, np.nan)
+    mtimes_recv = np.full(N_puts + 1, np.nan)
+    received = [0]
+
+    def recv(value):
+        seq = int(value)
+        if 0 < seq <= N_puts:
+            mtimes_recv[seq] = time.monotonic()
+            received[0] += 1
+
+    def register(remove=False):
+        for rv in rvs:
+            rv.register(key=recv, callback=recv, remove=remove)
+
+    prog.reactor_call(register)
+    pvs = [epics.PV(channel, auto_monitor=False) for channel in prog.channels_float]
+    _connect(pvs)
+    prog.reactor_report()
+
+    mtime_end = time.monotonic() + timeout_s
+    for seq in range(1, N_puts + 1):
+        mtimes_sent[seq] = time.monotonic()
+        pvs[seq % len(pvs)].put(float(seq), wait=False)
+        if seq % 50 == 0:
+            epics.ca.flush_io()
+            while seq - received[0] > window and time.monotonic() < mtime_end:
+                time.sleep(0.0005)
+    epics.ca.flush_io()
+    _settle(lambda: received[0])
+    prog.reactor_call(register, remove=True)
+
+    N_recv = received[0]
+    duration_s = np.nanmax(mtimes_recv) - mtimes_sent[1] if N_recv else np.nan
+    report = dict(
+        puts=N_puts,
+        puts_lost=N_puts - N_recv,
+        puts_per_s=N_recv / duration_s,
+    )
+    report.update(latency_report(mtimes_recv - mtimes_sent))
+    report.update(prog.reactor_report())
+    return _report_plain(report)
+
+
+def _updates_drive(prog, rvs, N_rounds, period_s, done):
+    """
+    Set every RelayValue of rvs to the round's sequence number (the first element of the
+    waveforms) from a looping reactor task. Returns the array of update times by round.
+    """
+    mtimes_set = np.full(N_rounds + 1, np.nan)
+    buffers = dict()
+    for rv in rvs:
+        if isinstance(rv, autocas.RelayValueWaveform):
+            buffers[rv] = np.arange(rv.max_length, dtype=float)
+    seq = [0]
+
+    def update():
+        seq[0] += 1
+        mtimes_set[seq[0]] = time.monotonic()
+        for rv in rvs:
+            buf = buffers.get(rv, None)
+            if buf is None:
+                rv.value = float(seq[0])
+            else:
+                buf[0] = seq[0]
+                rv.value = buf
+        if seq[0] >= N_rounds:
+            prog.reactor.enqueue_looping(update, period_s=None)
+            done.set()
+
+    prog.reactor_call(prog.reactor.enqueue_looping, update, period_s=period_s)
+    return mtimes_set
+
+
+def bench_monitors(prog, N_rounds=200, period_s=0.01):
+    """
+    Update every channel from the reactor each period_s and receive the monitors in
+    a client. The latency is from the RelayValue update until the client callback.
+    Servers may coalesce the events of a channel for slow clients, which is counted
+    as monitors_coalesced, but the last update of each channel must arrive.
+    """
+    import epics
+
+    channels = prog.channels_float + prog.channels_waveform
+    rvs = prog.bench.rvs_float + prog.bench.rvs_waveform
+    events = []
+    recording = [False]
+
+    def recv(value=None, **kwargs):
+        if recording[0]:
+            events.append((time.monotonic(), kwargs["pvname"], value))
+
+    pvs = [epics.PV(channel, auto_monitor=True, callback=recv) for channel in channels]
+    _connect(pvs)
+    # the initial values
+    time.sleep(0.5)
+    recording[0] = True
+    prog.reactor_report()
+
+    done = threading.Event()
+    mtimes_set = _updates_drive(prog, rvs, N_rounds, period_s, done)
+    done.wait(timeout=N_rounds * period_s * 10 + 10)
+    _settle(lambda: len(events))
+    recording[0] = False
+    # channels are kept connected, as pyepics may not reconnect disconnected channels
+    for pv in pvs:
+        pv.clear_callbacks()
+        pv.clear_auto_monitor()
+
+    latency_s = []
+    last = dict()
+    for mtime, pvname, value in events:
+        seq = int(value if np.isscalar(value) else value[0])
+        latency_s.append(mtime - mtimes_set[seq])
+        last[pvname] = max(seq, last.get(pvname, 0))
+    N_expect = N_rounds * len(channels)
+    duration_s = events[-1][0] - mtimes_set[1] if events else np.nan
+    report = dict(
+        monitors=len(events),
+        monitors_coalesced=N_expect - len(events),
+        monitors_per_s=len(events) / duration_s,
+        channels_stale=sum(1 for channel in channels if last.get(channel, 0) != N_rounds),
+    )
+    report.update(latency_report(latency_s))
+    report.update(prog.reactor_report())
+    return _report_plain(report)
+
+
+def bench_relay(prog, N_rounds=200, period_s=0.01):
+    """
+    Mirror the R0000... channels into RelayValues of the program through the remote
+    channel client of pyepics_backend, and update the originals from the reactor. The
+    latency is from the update of the original until that of the mirror, which
+    crosses the server, the client and the reactor.
+
+    The client only learns of new connections, so this may only run once per process.
+    """
+    from wavestate.epics.autocas.cascore import pyepics_backend
+
+    db = prog.root.cas_db_generate()
+    db_remote = dict()
+    mtimes_recv = dict()
+    mirrors = []
+    for channel in prog.channels_relay:
+        rv = autocas.RelayValueFloat(0)
+        entry = dict(db[channel])
+        entry.update(rv=rv, remote=True, deferred=False)
+        db_remote[channel] = entry
+        mirrors.append(rv)
+        mtimes = mtimes_recv[rv] = np.full(N_rounds + 1, np.nan)
+
+        def recv(value, mtimes=mtimes):
+            seq = int(value)
+            if 0 < seq <= N_rounds:
+                mtimes[seq] = time.monotonic()
+
+        rv.register(callback=recv)
+
+    def client_start():
+        client = pyepics_backend.CAEpicsClient(db_remote, prog.reactor)
+        client.start()
+        return client
+
+    client = prog.reactor_call(client_start)
+    mtime_end = time.monotonic() + 10
+    while client.epics_pending_connections and time.monotonic() < mtime_end:
+        time.sleep(0.05)
+    if client.epics_pending_connections:
+        raise RuntimeError("The remote channels did not connect")
+    time.sleep(0.5)
+    prog.reactor_report()
+
+    done = threading.Event()
+    mtimes_set = _updates_drive(prog, prog.bench.rvs_relay, N_rounds, period_s, done)
+    done.wait(timeout=N_rounds * period_s * 10 + 10)
+    _settle(lambda: sum(np.count_nonzero(np.isfinite(m)) for m in mtimes_recv.values()))
+
+    def client_stop():
+        prog.reactor.enqueue_looping(client.write_pending, period_s=None)
+        for pv in client.PV_RV_map:
+            pv.clear_callbacks()
+            pv.clear_auto_monitor()
+
+    prog.reactor_call(client_stop)
+
+    latency_s = np.concatenate([m - mtimes_set for m in mtimes_recv.values()])
+    N_recv = np.count_nonzero(np.isfinite(latency_s))
+    duration_s = np.nanmax(latency_s + np.tile(mtimes_set, len(mirrors))) - mtimes_set[1]
+    report = dict(
+        relays=N_recv,
+        relays_coalesced=N_rounds * len(mirrors) - N_recv,
+        relays_per_s=N_recv / duration_s,
+        channels_stale=sum(1 for rv in mirrors if rv.value != N_rounds),
+    )
+    report.update(latency_report(latency_s))
+    report.update(prog.reactor_report())
+    return _report_plain(report)
+
+
+def report_print(name, report):
+    print("{0}:".format(name))
+    for key, val in report.items():
+        if isinstance(val, float):
+            val = "{0:.3f}".format(val)
+        print("    {0:<24} {1}".format(key, val))
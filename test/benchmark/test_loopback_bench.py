@@ -0,0 +1,110 @@
+"""
+Loopback benchmarks of the CA server backends, the remote channel client and the
+Reactor. Each benchmark reports its throughput, latency percentiles and reactor
+queue depth, which the tests also save as JSON to their test results folder to
+compare across versions.
+
+The backend and reactor are chosen with the AUTOCAS_BENCH_BACKEND (pcaspy or python)
+and AUTOCAS_BENCH_REACTOR (threading or asyncio) environment variables, and the
+write inbox size with AUTOCAS_BENCH_WRITE_INBOX, as the CA configuration of a process
+can only be set once:
+
+    AUTOCAS_BENCH_BACKEND=python pytest test/benchmark -s
+
+Run as a script for larger benchmarks:
+
+    python test/benchmark/test_loopback_bench.py --floats 1000 --puts 100000
+"""
+import os
+import sys
+import json
+import argparse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import cas_loopback  # noqa: E402
+
+pytest.importorskip("epics")
+
+
+@pytest.fixture(scope="module")
+def program():
+    prog = cas_loopback.LoopbackProgram(
+        backend=os.getenv("AUTOCAS_BENCH_BACKEND", "pcaspy"),
+        reactor_type=os.getenv("AUTOCAS_BENCH_REACTOR", "threading"),
+        write_inbox=os.getenv("AUTOCAS_BENCH_WRITE_INBOX", None),
+    )
+    with prog:
+        yield prog
+
+
+def report_save(tpath_join, report):
+    with open(tpath_join("report.json"), "w") as F:
+        json.dump(report, F, indent=4)
+
+
+def test_puts(program, tpath_join):
+    report = program.run(cas_loopback.bench_puts, N_puts=5000)
+    cas_loopback.report_print("puts", report)
+    report_save(tpath_join, report)
+    # CA does not drop puts
+    assert report["puts_lost"] == 0
+
+
+def test_monitors(program, tpath_join):
+    report = program.run(cas_loopback.bench_monitors, N_rounds=100)
+    cas_loopback.report_print("monitors", report)
+    report_save(tpath_join, report)
+    assert report["monitors"] > 0
+    assert report["channels_stale"] == 0
+
+
+def test_relay(program, tpath_join):
+    report = program.run(cas_loopback.bench_relay, N_rounds=100)
+    cas_loopback.report_print("relay", report)
+    report_save(tpath_join, report)
+    assert report["relays"] > 0
+    assert report["channels_stale"] == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", default="pcaspy", choices=["pcaspy", "python"])
+    parser.add_argument(
+        "--reactor", default="threading", choices=["threading", "asyncio"]
+    )
+    parser.add_argument(
+        "--write-inbox", type=int, default=None, help="queue writes to the reactor"
+    )
+    parser.add_argument("--floats", type=int, default=100)
+    parser.add_argument("--waveforms", type=int, default=10)
+    parser.add_argument("--waveform-length", type=int, default=1024)
+    parser.add_argument("--puts", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--period-s", type=float, default=0.01)
+    parser.add_argument("--json", metavar="fname", help="also write the reports here")
+    args = parser.parse_args()
+
+    prog = cas_loopback.LoopbackProgram(
+        backend=args.backend,
+        reactor_type=args.reactor,
+        write_inbox=args.write_inbox,
+        N_float=args.floats,
+        N_waveform=args.waveforms,
+        waveform_length=args.waveform_length,
+    )
+    reports = dict()
+    with prog:
+        reports["puts"] = prog.run(cas_loopback.bench_puts, N_puts=args.puts)
+        reports["monitors"] = prog.run(
+            cas_loopback.bench_monitors, N_rounds=args.rounds, period_s=args.period_s
+        )
+        reports["relay"] = prog.run(
+            cas_loopback.bench_relay, N_rounds=args.rounds, period_s=args.period_s
+        )
+    for name, report in reports.items():
+        cas_loopback.report_print(name, report)
+    if args.json is not None:
+        with open(args.json, "w") as F:
+            json.dump(reports, F, indent=4)
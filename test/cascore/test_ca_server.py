@@ -0,0 +1,455 @@
+"""
+Protocol tests of the pure-Python CA server, against a minimal client speaking CA
+over raw sockets on the loopback interface
+"""
+import time
+import socket
+import struct
+import threading
+
+import numpy as np
+import pytest
+
+from wavestate.epics.autocas.cascore import ca_server as cas
+from wavestate.epics.autocas.cascore import ca_server_backend
+from wavestate.epics.autocas.cascore import relay_values
+from wavestate.epics.autocas.cascore import simulated_reactor
+
+WAVEFORM_LENGTH = 8192
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AsynDriver(cas.Driver):
+    """
+    Completes the writes of asyn channels when told to, rather than at once
+    """
+
+    def __init__(self, server):
+        self.cas = server
+        super(AsynDriver, self).__init__()
+
+
+@pytest.fixture
+def server_env(monkeypatch):
+    monkeypatch.setenv("EPICS_CAS_INTF_ADDR_LIST", "127.0.0.1")
+    monkeypatch.setenv("EPICS_CAS_SERVER_PORT", str(free_port()))
+    monkeypatch.setenv("EPICS_CAS_BEACON_PORT", str(free_port()))
+    monkeypatch.setenv("EPICS_CAS_BEACON_ADDR_LIST", "127.0.0.1")
+    monkeypatch.setenv("EPICS_CAS_AUTO_BEACON_ADDR_LIST", "NO")
+
+
+@pytest.fixture
+def server(server_env):
+    server = cas.SimpleServer()
+    server.createPV(
+        "X1:TEST-",
+        {
+            "A": {"type": "float", "value": 1.5, "prec": 3},
+            "ASYN": {"type": "float", "asyn": True},
+            "STR": {"type": "string", "value": "hello"},
+            "WF": {"type": "float", "count": WAVEFORM_LENGTH},
+        },
+    )
+    server.test_driver = AsynDriver(server)
+    thread = cas.ServerThread(server)
+    thread.start()
+    yield server
+    thread.stop()
+    thread.join(5)
+
+
+@pytest.fixture
+def inbox_driver(server_env):
+    """
+    The CAS driver with its writes queued to a SimulatedReactor, which only applies
+    them once flushed
+    """
+    reactor = simulated_reactor.SimulatedReactor()
+    db = {
+        "X1:TEST-INBOX": dict(
+            rv=relay_values.RelayValueFloat(0),
+            type="float",
+            interaction="setting",
+            remote=False,
+            deferred=False,
+        ),
+    }
+    driver = ca_server_backend.CADriverServer(
+        db,
+        reactor,
+        deferred_write_period=None,
+        write_inbox=16,
+    )
+    driver.start()
+    yield driver, reactor
+    driver.stop()
+
+
+def name_payload(name):
+    return name.encode("utf-8") + b"\0"
+
+
+class Client(object):
+    """
+    A CA client circuit, with only the protocol needed by the tests
+    """
+
+    def __init__(self, port, rcvbuf=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if rcvbuf is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.settimeout(5)
+        self.sock.connect(("127.0.0.1", port))
+        self._buf = b""
+        self._cid = 0
+        self.send(
+            cas.message(cas.CA_PROTO_VERSION, data_count=cas.CA_MINOR_VERSION)
+            + cas.message(cas.CA_PROTO_HOST_NAME, name_payload("testhost"))
+            + cas.message(cas.CA_PROTO_CLIENT_NAME, name_payload("tester"))
+        )
+        command, data_type, count, p1, p2, payload = self.recv()
+        assert command == cas.CA_PROTO_VERSION
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def _read(self, N):
+        while len(self._buf) < N:
+            data = self.sock.recv(1 << 16)
+            if not data:
+                raise EOFError()
+            self._buf += data
+        data, self._buf = self._buf[:N], self._buf[N:]
+        return data
+
+    def recv(self):
+        command, size, data_type, count, p1, p2 = cas._header.unpack(self._read(16))
+        if size == 0xFFFF and count == 0:
+            size, count = struct.unpack(">II", self._read(8))
+        return command, data_type, count, p1, p2, self._read(size)
+
+    def create(self, name):
+        self._cid += 1
+        cid = self._cid
+        self.send(
+            cas.message(
+                cas.CA_PROTO_CREATE_CHAN,
+                name_payload(name),
+                p1=cid,
+                p2=cas.CA_MINOR_VERSION,
+            )
+        )
+        command, data_type, count, p1, p2, payload = self.recv()
+        assert (command, p1, p2) == (cas.CA_PROTO_ACCESS_RIGHTS, cid, 3)
+        command, data_type, count, p1, p2, payload = self.recv()
+        assert (command, p1) == (cas.CA_PROTO_CREATE_CHAN, cid)
+        return p2, data_type, count
+
+    def get(self, sid, dbr_type=cas.DBR_DOUBLE, count=1, ioid=7):
+        self.send(
+            cas.message(cas.CA_PROTO_READ_NOTIFY, b"", dbr_type, count, sid, ioid)
+        )
+        command, data_type, count, p1, p2, payload = self.recv()
+        assert (command, data_type, p1, p2) == (
+            cas.CA_PROTO_READ_NOTIFY,
+            dbr_type,
+            cas.ECA_NORMAL,
+            ioid,
+        )
+        return payload
+
+    def put(self, sid, value, notify_ioid=None):
+        payload = np.asarray(value, dtype=">f8").tobytes()
+        count = np.size(value)
+        if notify_ioid is None:
+            command = cas.CA_PROTO_WRITE
+            ioid = 0
+        else:
+            command = cas.CA_PROTO_WRITE_NOTIFY
+            ioid = notify_ioid
+        self.send(cas.message(command, payload, cas.DBR_DOUBLE, count, sid, ioid))
+
+    def subscribe(self, sid, subid, count=1, mask=cas.DBE_VALUE | cas.DBE_ALARM):
+        payload = struct.pack(">fffHH", 0, 0, 0, mask, 0)
+        self.send(
+            cas.message(
+                cas.CA_PROTO_EVENT_ADD, payload, cas.DBR_DOUBLE, count, sid, subid
+            )
+        )
+
+    def close(self):
+        self.sock.close()
+
+
+def test_search(server):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(5)
+    try:
+        request = cas.message(
+            cas.CA_PROTO_VERSION, data_count=cas.CA_MINOR_VERSION
+        ) + cas.message(
+            cas.CA_PROTO_SEARCH,
+            name_payload("X1:TEST-A"),
+            data_type=10,
+            data_count=cas.CA_MINOR_VERSION,
+            p1=42,
+            p2=42,
+        ) + cas.message(
+            cas.CA_PROTO_SEARCH,
+            name_payload("X1:TEST-MISSING"),
+            data_type=5,
+            data_count=cas.CA_MINOR_VERSION,
+            p1=43,
+            p2=43,
+        )
+        sock.sendto(request, ("127.0.0.1", server.port))
+        data, addr = sock.recvfrom(1 << 16)
+    finally:
+        sock.close()
+    replies = []
+    idx = 0
+    while idx < len(data):
+        command, size, data_type, count, p1, p2 = cas._header.unpack_from(data, idx)
+        replies.append((command, data_type, p2))
+        idx += 16 + size
+    # only the hosted channel is answered
+    assert replies == [
+        (cas.CA_PROTO_VERSION, 0, 0),
+        (cas.CA_PROTO_SEARCH, server.port, 42),
+    ]
+
+
+def test_create_get(server):
+    client = Client(server.port)
+    try:
+        sid, data_type, count = client.create("X1:TEST-A")
+        assert (data_type, count) == (cas.DBR_DOUBLE, 1)
+        assert struct.unpack_from(">d", client.get(sid))[0] == 1.5
+        payload = client.get(sid, dbr_type=cas.DBR_STRING, ioid=8)
+        assert payload[: payload.index(b"\0")] == b"1.500"
+        sid_str, data_type, count = client.create("X1:TEST-STR")
+        assert data_type == cas.DBR_STRING
+        payload = client.get(sid_str, dbr_type=cas.DBR_STRING)
+        assert payload[: payload.index(b"\0")] == b"hello"
+        # unknown channels fail to be created
+        client.send(
+            cas.message(cas.CA_PROTO_CREATE_CHAN, name_payload("X1:TEST-NOPE"), p1=99)
+        )
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p1) == (cas.CA_PROTO_CREATE_CH_FAIL, 99)
+    finally:
+        client.close()
+
+
+def test_put(server):
+    client = Client(server.port)
+    try:
+        sid, data_type, count = client.create("X1:TEST-A")
+        client.put(sid, 2.25)
+        assert struct.unpack_from(">d", client.get(sid))[0] == 2.25
+        assert server.test_driver.getParam("A") == 2.25
+    finally:
+        client.close()
+
+
+def test_put_callback(server):
+    client = Client(server.port)
+    driver = server.test_driver
+    try:
+        sid, data_type, count = client.create("X1:TEST-A")
+        client.put(sid, 3.5, notify_ioid=11)
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p1, p2) == (cas.CA_PROTO_WRITE_NOTIFY, cas.ECA_NORMAL, 11)
+        assert driver.getParam("A") == 3.5
+
+        # asyn channels complete once the driver calls back
+        sid_asyn, data_type, count = client.create("X1:TEST-ASYN")
+        client.put(sid_asyn, 1.0, notify_ioid=12)
+        client.put(sid_asyn, 2.0, notify_ioid=13)
+        time.sleep(0.2)
+        client.sock.settimeout(0.2)
+        with pytest.raises(socket.timeout):
+            client.recv()
+        client.sock.settimeout(5)
+        driver.callbackPV("ASYN")
+        driver.callbackPV("ASYN", success=False)
+        results = [client.recv() for idx in range(2)]
+        assert [(r[0], r[3], r[4]) for r in results] == [
+            (cas.CA_PROTO_WRITE_NOTIFY, cas.ECA_NORMAL, 12),
+            (cas.CA_PROTO_WRITE_NOTIFY, cas.ECA_PUTFAIL, 13),
+        ]
+    finally:
+        client.close()
+
+
+def test_monitor(server):
+    client = Client(server.port)
+    driver = server.test_driver
+    try:
+        sid, data_type, count = client.create("X1:TEST-A")
+        client.subscribe(sid, subid=5)
+        # the current value at once
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p1, p2) == (cas.CA_PROTO_EVENT_ADD, cas.ECA_NORMAL, 5)
+        assert struct.unpack_from(">d", payload)[0] == 1.5
+        driver.setParam("A", 4.0)
+        driver.updatePV("A")
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p2) == (cas.CA_PROTO_EVENT_ADD, 5)
+        assert struct.unpack_from(">d", payload)[0] == 4.0
+        # and from puts of the client
+        client.put(sid, 5.0, notify_ioid=20)
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p2) == (cas.CA_PROTO_EVENT_ADD, 5)
+        assert struct.unpack_from(">d", payload)[0] == 5.0
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p2) == (cas.CA_PROTO_WRITE_NOTIFY, 20)
+        # cancelled subscriptions are confirmed and then quiet
+        client.send(
+            cas.message(cas.CA_PROTO_EVENT_CANCEL, b"", cas.DBR_DOUBLE, 1, sid, 5)
+        )
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p2) == (cas.CA_PROTO_EVENT_ADD, 5)
+        driver.setParam("A", 6.0)
+        driver.updatePV("A")
+        assert struct.unpack_from(">d", client.get(sid))[0] == 6.0
+    finally:
+        client.close()
+
+
+def test_clear_channel_events(server):
+    """
+    Clearing a channel drops the events of its subscriptions not yet sent
+    """
+    client = Client(server.port)
+    try:
+        sid, data_type, count = client.create("X1:TEST-A")
+        client.send(cas.message(cas.CA_PROTO_EVENTS_OFF))
+        # the current value is held back with the events off
+        client.subscribe(sid, subid=5)
+        client.send(
+            cas.message(cas.CA_PROTO_CLEAR_CHANNEL, p1=sid, p2=1)
+            + cas.message(cas.CA_PROTO_EVENTS_ON)
+            + cas.message(cas.CA_PROTO_ECHO)
+        )
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p1) == (cas.CA_PROTO_CLEAR_CHANNEL, sid)
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert command == cas.CA_PROTO_ECHO
+    finally:
+        client.close()
+
+
+def test_payload_limit(server):
+    """
+    A message larger than any channel can take closes the circuit
+    """
+    client = Client(server.port)
+    try:
+        header = struct.pack(
+            ">HHHHIIII",
+            cas.CA_PROTO_WRITE,
+            0xFFFF,
+            cas.DBR_DOUBLE,
+            0,
+            1,
+            0,
+            1 << 30,
+            1 << 27,
+        )
+        client.send(header + bytes(1 << 16))
+        with pytest.raises((EOFError, ConnectionResetError)):
+            client.recv()
+    finally:
+        client.close()
+    # while the other clients are served
+    client = Client(server.port)
+    try:
+        sid, data_type, count = client.create("X1:TEST-WF")
+        client.put(sid, np.arange(WAVEFORM_LENGTH, dtype=float))
+        payload = client.get(sid, count=WAVEFORM_LENGTH)
+        val = np.frombuffer(payload, dtype=">f8", count=WAVEFORM_LENGTH)
+        np.testing.assert_array_equal(val, np.arange(WAVEFORM_LENGTH))
+    finally:
+        client.close()
+
+
+def test_monitor_slow_client(server):
+    """
+    Events for a client that doesn't read are coalesced rather than buffered, and
+    the latest is sent once it reads again
+    """
+    client = Client(server.port, rcvbuf=1 << 12)
+    driver = server.test_driver
+    N_posts = 200
+    try:
+        sid, data_type, count = client.create("X1:TEST-WF")
+        client.subscribe(sid, subid=9, count=WAVEFORM_LENGTH)
+        for idx in range(N_posts):
+            driver.setParam("WF", np.full(WAVEFORM_LENGTH, float(idx)))
+            driver.updatePV("WF")
+            time.sleep(0.001)
+        # let the server write what it can
+        time.sleep(0.5)
+        events = []
+        client.sock.settimeout(1)
+        while True:
+            try:
+                command, data_type, count, p1, p2, payload = client.recv()
+            except socket.timeout:
+                break
+            assert (command, p2) == (cas.CA_PROTO_EVENT_ADD, 9)
+            events.append(np.frombuffer(payload, dtype=">f8", count=count))
+        assert len(events) < N_posts // 2
+        # the latest value is always delivered, and each event is a whole update
+        assert events[-1][0] == N_posts - 1
+        for val in events:
+            assert (val == val[0]).all()
+        client_server = list(server._clients)[0]
+        assert not client_server._paused
+    finally:
+        client.close()
+
+
+def inbox_wait(driver, N):
+    mtime_end = time.monotonic() + 5
+    while len(driver._inbox) < N:
+        assert time.monotonic() < mtime_end
+        time.sleep(0.01)
+
+
+def test_inbox_put_callback_mixed(inbox_driver):
+    """
+    Queued plain puts and put-callbacks on a channel each complete only their own
+    put-callback, with the status of their own write
+    """
+    driver, reactor = inbox_driver
+    rv = driver.db["X1:TEST-INBOX"]["rv"]
+    client = Client(driver.cas.port)
+    try:
+        sid, data_type, count = client.create("X1:TEST-INBOX")
+        # the plain put is rejected, but the put-callback after it is applied
+        client.put(sid, float("nan"))
+        client.put(sid, 2.0, notify_ioid=30)
+        inbox_wait(driver, 2)
+        reactor.flush()
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p1, p2) == (cas.CA_PROTO_WRITE_NOTIFY, cas.ECA_NORMAL, 30)
+        assert rv.value == 2.0
+
+        # and the rejected put-callback before a plain put fails
+        client.put(sid, float("nan"), notify_ioid=31)
+        client.put(sid, 3.0)
+        inbox_wait(driver, 2)
+        reactor.flush()
+        command, data_type, count, p1, p2, payload = client.recv()
+        assert (command, p1, p2) == (cas.CA_PROTO_WRITE_NOTIFY, cas.ECA_PUTFAIL, 31)
+        assert struct.unpack_from(">d", client.get(sid))[0] == 3.0
+        assert rv.value == 3.0
+    finally:
+        client.close()
@@ -0,0 +1,125 @@
+"""
+Unit tests of the ConfigTreeRoot path index and node types, and of ConfigTree lookups
+"""
+import pytest
+
+from wavestate.epics.autocas.cascore import ctree
+
+
+@pytest.fixture
+def root():
+    root = ctree.ConfigTreeRoot()
+    root.config_load_recursive(
+        {
+            "rate_s": 2,
+            "burt": {"save_folder": "/tmp/burt", "save_rate_s": 60},
+            "deep": {"a": {"b": {"c": "value"}}},
+        }
+    )
+    return root
+
+
+def check_index(root):
+    """
+    Every indexed node is the node found by walking the nested dictionaries
+    """
+    for path, node in root._nodes.items():
+        walked = root._dict
+        for k in path:
+            walked = walked[k]
+        assert walked is node
+
+
+def test_configured(root):
+    ct = root.ctree
+    assert ct.get_configured("rate_s", default=1) == 2
+    assert ct["burt"].get_configured("save_rate_s", default=600) == 60
+    assert ct["deep"]["a"]["b"].get_configured("c", default=None) == "value"
+    # not configured, so the default
+    assert ct["burt"].get_configured("load_folder", default="/tmp") == "/tmp"
+    assert ct["new"]["sub"].get_configured("x", default=5) == 5
+    check_index(root)
+
+
+def test_value_assigned_once(root):
+    ct = root.ctree
+    assert ct.get_configured("other", default=1) == 1
+    assert ct.get_configured("other", default=1) == 1
+    # loading configuration later doesn't change values already in use
+    root.config_load_recursive({"other": 3, "rate_s": 10})
+    assert ct.get_configured("other", default=1) == 1
+    assert root.config_retrieve_recursive()["rate_s"] == 2
+
+
+def test_validator(root):
+    ct = root.ctree
+    assert ct["burt"].get_configured("save_rate_s", default=600, validator=str) == "60"
+    assert ct.get_configured("flag", default=0, validator=bool) is False
+
+
+def test_views_lazy(root):
+    ct = root.ctree
+    nodes = dict(root._nodes)
+    view = ct["unused"]["deeper"]["still"]
+    assert view._check_type() == "empty"
+    assert "unused" not in ct
+    assert root._nodes == nodes
+    assert view._dict == {}
+    view.get_configured("x", default=1)
+    assert "unused" in ct
+    assert ct["unused"]._check_type() == "tree"
+    check_index(root)
+
+
+def test_types(root):
+    ct = root.ctree
+    assert ct._check_type("burt") == "tree"
+    assert ct["burt"]._check_type("save_rate_s") == "value"
+    assert ct["burt"]._check_type("missing") == "empty"
+    assert ct["deep"]["a"]._check_type() == "tree"
+    # a subtree requested below a value makes its node bad
+    ct["rate_s"]["sub"].get_configured("x", default=1)
+    assert ct._check_type("rate_s") == "bad"
+    with pytest.raises(RuntimeError):
+        root.value_retrieve_recursive()
+
+
+def test_retrieve(root):
+    ct = root.ctree
+    ct["burt"].get_configured(
+        "save_rate_s", default=600, about="save period", classification="burt"
+    )
+    ct.get_configured("rate_s", default=1, about="loop period")
+    values = root.value_retrieve_recursive()
+    assert values["burt"]["save_rate_s"] == 60
+    assert values["rate_s"] == 2
+    # configured but never requested
+    assert "save_folder" not in values["burt"]
+    config = root.config_retrieve_recursive()
+    assert config["deep"]["a"]["b"]["c"] == "value"
+    about = root.about_retrieve_recursive()
+    assert about["burt"]["save_rate_s"] == "save period"
+    assert about["rate_s"] == "loop period"
+    assert root.classification_retrieve_recursive()["burt"]["save_rate_s"] == {"burt"}
+    assert root.classification_prime_retrieve_recursive()["burt"]["save_rate_s"] == (
+        "burt"
+    )
+
+
+def test_extra_annotations(root):
+    ct = root.ctree
+    ct.get_configured("rate_s", default=1, units="s")
+    assert root.extra_retrieve_recursive("units")["rate_s"] == "s"
+
+
+def test_bare():
+    root = ctree.ConfigTreeRoot(annotations=False)
+    root.config_load_recursive({"a": {"b": 1}})
+    ct = root.ctree
+    assert isinstance(ct, ctree.ConfigTreeBare)
+    assert ct["a"].get_configured("b", default=0, about="not stored") == 1
+    assert ct["a"].get_configured("c", default=2) == 2
+    node = root._nodes[("a", "c")]
+    assert ctree.ConfigTree.DEFAULT_KEY not in node
+    assert ctree.ConfigTree.ABOUT_KEY not in root._nodes[("a", "b")]
+    check_index(root)
@@ -0,0 +1,129 @@
+"""
+Tests of the key and contents of the PV db layout cache
+"""
+import sys
+
+import pytest
+
+from wavestate.epics.autocas import RelayValueFloat, RelayValueInt
+from wavestate.epics.autocas.cascore import ca_server_backend
+from wavestate.epics.autocas.cascore import db_cache
+from wavestate.epics.autocas.cascore import simulated_reactor
+
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+    """
+    A package of which only the top module is imported, as for programs with lazily
+    loaded modules
+    """
+    pkg = tmp_path / "lazy_pkg"
+    (pkg / "sub").mkdir(parents=True)
+    (pkg / "__pycache__").mkdir()
+    (pkg / "__init__.py").write_text("")
+    (pkg / "lazy.py").write_text("X = 1\n")
+    (pkg / "sub" / "__init__.py").write_text("")
+    (pkg / "sub" / "deeper.py").write_text("Y = 1\n")
+    (pkg / "__pycache__" / "stale.py").write_text("")
+    (pkg / "notes.txt").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    __import__("lazy_pkg")
+    yield pkg
+    for name in list(sys.modules):
+        if name == "lazy_pkg" or name.startswith("lazy_pkg."):
+            del sys.modules[name]
+
+
+def test_package_source_files(package):
+    fpaths = db_cache.package_source_files(["lazy_pkg", "not_a_module_at_all"])
+    assert fpaths == sorted(
+        str(package / rel)
+        for rel in ["__init__.py", "lazy.py", "sub/__init__.py", "sub/deeper.py"]
+    )
+    assert "lazy_pkg.lazy" not in sys.modules
+
+
+def test_key_unloaded_module_edit(package):
+    def key():
+        return db_cache.cache_key(
+            source_files=db_cache.package_source_files(["lazy_pkg"]),
+            extra=["x1test"],
+        )
+
+    key_before = key()
+    assert key() == key_before
+    (package / "sub" / "deeper.py").write_text("Y = 2\n")
+    assert key() != key_before
+
+
+def test_cache_round_trip(tmp_path):
+    db = {
+        "X1:TEST-A": {"rv": RelayValueFloat(1.5), "type": "float", "prec": 3},
+    }
+    folder = str(tmp_path / "cache")
+    cache = db_cache.PVDBCache(folder=folder, name="x1test", key="k1")
+    assert cache.load() is None
+    cache.save(db)
+    loaded = cache.load()
+    assert loaded["channels"] == {"X1:TEST-A": {"type": "float", "prec": 3}}
+    # a new key invalidates the cache
+    assert db_cache.PVDBCache(folder=folder, name="x1test", key="k2").load() is None
+
+
+def driver_db():
+    return {
+        "X1:TEST-A": dict(
+            rv=RelayValueFloat(1.5),
+            type="float",
+            prec=RelayValueInt(3),
+            unit="V",
+            interaction="setting",
+            remote=False,
+            deferred=False,
+        ),
+        "X1:TEST-E": dict(
+            rv=RelayValueInt(1),
+            type="enum",
+            enums=("OFF", "ON"),
+            interaction="setting",
+            remote=False,
+            deferred=False,
+        ),
+    }
+
+
+def test_cas_static_reuse(tmp_path, monkeypatch):
+    """
+    A driver started from the cached createPV settings serves the same channels as
+    one compiling them
+    """
+    reactor = simulated_reactor.SimulatedReactor()
+    driver = ca_server_backend.CADriverServer(
+        driver_db(), reactor, deferred_write_period=None
+    )
+    assert driver.db_cas_static["X1:TEST-A"] == (
+        {"type": "float", "unit": "V"},
+        ["prec"],
+    )
+    cache = db_cache.PVDBCache(folder=str(tmp_path), name="x1test", key="k1")
+    cache.save(driver.db, driver.db_cas_static)
+    db_cas_static = cache.load()["cas_raw"]
+
+    def compile_fail(self, db_entry):
+        raise AssertionError("compiled again")
+
+    monkeypatch.setattr(
+        ca_server_backend.CADriverServer, "_cas_static_compile", compile_fail
+    )
+    db = driver_db()
+    db["X1:TEST-A"]["prec"].value = 4
+    reused = ca_server_backend.CADriverServer(
+        db, reactor, deferred_write_period=None, db_cas_static=db_cas_static
+    )
+    assert reused.db_cas_raw == {
+        "X1:TEST-A": {"type": "float", "unit": "V", "prec": 4, "value": 1.5},
+        "X1:TEST-E": {"type": "enum", "enums": ["OFF", "ON"], "value": 1},
+    }
+    # the settings given by RelayValues still follow them
+    db["X1:TEST-A"]["prec"].value = 2
+    assert reused.db_cas_raw["X1:TEST-A"]["prec"] == 2
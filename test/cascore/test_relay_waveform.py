@@ -0,0 +1,95 @@
+"""
+Unit tests of the validation of RelayValueWaveform puts, and of their snapshot loads
+"""
+import io
+
+import numpy as np
+import pytest
+
+from wavestate.epics.autocas.cascore import ca_server_backend
+from wavestate.epics.autocas.cascore import simulated_reactor
+from wavestate.epics.autocas.cascore.relay_values import (
+    RelayValueWaveform,
+    RelayValueCoerced,
+    RelayValueRejected,
+)
+from wavestate.epics.autocas.subservices import autosave_base
+
+
+def test_float_put():
+    rv = RelayValueWaveform(np.zeros(3), max_length=4)
+    rv.put([1.5, 2.5])
+    assert rv.value.tolist() == [1.5, 2.5]
+    # float buffers accept integer input as is
+    rv.put(np.arange(4))
+    assert rv.value.tolist() == [0, 1, 2, 3]
+
+
+def test_truncation_coerced():
+    rv = RelayValueWaveform(np.zeros(3), max_length=4)
+    with pytest.raises(RelayValueCoerced):
+        rv.put(np.arange(6.0))
+    assert rv.put_coerce(np.arange(6.0)) is False
+    assert rv.value.tolist() == [0, 1, 2, 3]
+
+
+def test_int_buffer_lossy_coerced():
+    rv = RelayValueWaveform(np.zeros(3), max_length=4, dtype=int)
+    # exact float values are not a coercion
+    rv.put(np.array([1.0, 2.0]))
+    assert rv.value.tolist() == [1, 2]
+    with pytest.raises(RelayValueCoerced) as E:
+        rv.put([1.5, 2.0])
+    assert E.value.preferred.tolist() == [1, 2]
+    # the value is left alone unless the coercion is accepted
+    assert rv.value.tolist() == [1, 2]
+    assert rv.put_coerce([3.25, 4.0]) is False
+    assert rv.value.tolist() == [3, 4]
+    assert rv.value.dtype == np.dtype(int)
+
+
+def test_int_buffer_rejected():
+    rv = RelayValueWaveform(np.zeros(3), max_length=4, dtype=np.int16)
+    with pytest.raises(RelayValueRejected):
+        rv.put([1, 1 << 20])
+    with pytest.raises(RelayValueRejected):
+        rv.put([1.0, np.nan])
+    with pytest.raises(RelayValueCoerced):
+        rv.put(np.array([1, 2], dtype=np.int64) + 0.5)
+    # in-range integers of a wider dtype are exact
+    rv.put(np.array([-5, 7], dtype=np.int64))
+    assert rv.value.tolist() == [-5, 7]
+
+
+@pytest.mark.parametrize(
+    "max_length, dtype", [(4, float), (4, int), (1, float)], ids=str
+)
+def test_snapshot_length_one(max_length, dtype):
+    """
+    Waveforms holding a single element are written to snapshots as scalars, and
+    must load back as waveforms
+    """
+    rv = RelayValueWaveform(
+        np.array([3], dtype=dtype), max_length=max_length, dtype=dtype
+    )
+    db = {
+        "X1:TEST-WF": dict(
+            rv=rv,
+            type="float" if dtype is float else "int",
+            count=max_length,
+            interaction="setting",
+            remote=False,
+            deferred=False,
+        ),
+    }
+    driver = ca_server_backend.CADriverServer(
+        db, simulated_reactor.SimulatedReactor(), deferred_write_period=None
+    )
+    F = io.StringIO()
+    autosave_base.snap_write(F, {"X1:TEST-WF": rv.value})
+    rv.put(np.zeros(0, dtype=dtype))
+    F.seek(0)
+    PV_vals, ROPV_vals = autosave_base.snap_parse(F)
+    assert driver.write_sync_typecast_bulk(PV_vals) == []
+    assert rv.value.tolist() == [3]
+    assert rv.value.dtype == np.dtype(dtype)
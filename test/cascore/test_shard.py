@@ -0,0 +1,110 @@
+"""
+Unit tests of the shard configuration parsing and of the ShardPlan deciding which
+objects each process constructs and hosts
+"""
+import pytest
+
+from wavestate.epics.autocas.cascore import shard
+
+
+def test_parse():
+    nodes = shard.shards_parse(
+        ["pumps", "lasers.seed, lasers.amp", ["vac.a", "vac.b"]]
+    )
+    assert list(nodes.items()) == [
+        ("pumps", [("task", "pumps")]),
+        ("seed_amp", [("task", "lasers", "seed"), ("task", "lasers", "amp")]),
+        ("a_b", [("task", "vac", "a"), ("task", "vac", "b")]),
+    ]
+    nodes = shard.shards_parse(["pumps"], task_path=("prog", "task"))
+    assert nodes["pumps"] == [("prog", "task", "pumps")]
+
+
+def test_parse_reject():
+    # the names of the shards are from the last element of their paths
+    with pytest.raises(RuntimeError, match="unique"):
+        shard.shards_parse(["a.pumps", "b.pumps"])
+    with pytest.raises(RuntimeError, match="nested"):
+        shard.shards_parse(["lasers", "lasers.seed"])
+    with pytest.raises(RuntimeError, match="nested"):
+        shard.shards_parse(["pumps,lasers.seed", "lasers"])
+    with pytest.raises(RuntimeError, match="Empty"):
+        shard.shards_parse([[]])
+
+
+@pytest.fixture
+def nodes():
+    return shard.shards_parse(["pumps", "lasers.seed,lasers.amp"])
+
+
+def test_plan_supervisor(nodes):
+    plan = shard.ShardPlan(nodes)
+    # the shard nodes are stubs, everything else is constructed
+    stub = plan.stub(None, "pumps", ("task", "pumps"))
+    assert isinstance(stub, shard.ShardStub)
+    assert stub._shard == "pumps"
+    assert plan.stub(None, "amp", ("task", "lasers", "amp"))._shard == "seed_amp"
+    assert plan.stub(None, "lasers", ("task", "lasers")) is None
+    assert plan.stub(None, "other", ("task", "lasers", "other")) is None
+    assert plan.stub(None, "status", ("status",)) is None
+    assert plan.hosts(("task", "lasers"))
+    assert plan.hosts(("status",))
+
+
+def test_plan_worker(nodes):
+    plan = shard.ShardPlan(nodes, shard="seed_amp")
+    assert plan.nodes_own == [("task", "lasers", "seed"), ("task", "lasers", "amp")]
+    # its nodes, the chain above them and the root services are constructed
+    assert plan.stub(None, "task", ("task",)) is None
+    assert plan.stub(None, "lasers", ("task", "lasers")) is None
+    assert plan.stub(None, "seed", ("task", "lasers", "seed")) is None
+    assert plan.stub(None, "x", ("task", "lasers", "seed", "x")) is None
+    assert plan.stub(None, "status", ("status",)) is None
+    # the nodes of other shards and other objects of the task are not
+    stub = plan.stub(None, "pumps", ("task", "pumps"))
+    assert stub._shard == "pumps"
+    stub = plan.stub(None, "other", ("task", "lasers", "other"))
+    assert stub._shard is None
+    # only its nodes and the root services are hosted
+    assert plan.hosts(("task", "lasers", "seed"))
+    assert plan.hosts(("task", "lasers", "amp", "x"))
+    assert plan.hosts(("status",))
+    assert not plan.hosts(("task", "lasers"))
+    assert not plan.hosts(("task",))
+
+
+def test_plan_unknown(nodes):
+    with pytest.raises(RuntimeError, match="Unknown shard"):
+        shard.ShardPlan(nodes, shard="nope")
+
+
+def test_stub():
+    stub = shard.ShardStub(None, "pumps", ("task", "pumps"), "pumps")
+    match = "'task.pumps' is hosted by the shard 'pumps'"
+    with pytest.raises(AttributeError, match=match):
+        stub.rv_pressure
+    stub = shard.ShardStub(None, "other", ("task", "other"), None)
+    with pytest.raises(AttributeError, match="the shard supervisor"):
+        stub.rv_pressure
+
+
+def test_worker_argv(nodes):
+    plan = shard.ShardPlan(
+        nodes,
+        module_name="x1test",
+        argv=["python", "-m", "prog", "--config", "c.yaml"],
+        argv_command=["run"],
+    )
+    assert plan.worker_argv("pumps", 5) == [
+        "python",
+        "-m",
+        "prog",
+        "--config",
+        "c.yaml",
+        "--shard",
+        "pumps",
+        "--shard-fd",
+        "5",
+        "run",
+    ]
+    assert plan.module_name_shard("pumps") == "x1test_pumps"
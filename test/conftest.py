@@ -0,0 +1,5 @@
+"""
+Fixtures of wavestate.pytest shared by the tests, such as closefigs of the
+pytest.ini usefixtures and tpath_join for the benchmark reports
+"""
+from wavestate.pytest.fixtures import *  # noqa: F401,F403
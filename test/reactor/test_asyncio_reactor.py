@@ -0,0 +1,115 @@
+"""
+Tests of the AsyncioReactor which run it on the real clock:
+
+    pytest test/reactor -s
+"""
+import time
+import asyncio
+import threading
+
+from wavestate.epics import autocas
+from wavestate.epics.autocas.cascore import asyncio_reactor
+from wavestate.epics.autocas.cascore import ctree
+from wavestate.epics.autocas.serial import serial_base
+
+
+def test_task_lock_contended():
+    """
+    Another thread taking the task_lock is not starved by a reactor that always has
+    ready tasks
+    """
+    r = asyncio_reactor.AsyncioReactor()
+    runs = [0]
+
+    def busy():
+        runs[0] += 1
+        r.send_task(busy)
+
+    r.send_task(busy)
+
+    waits = []
+    done = threading.Event()
+
+    def contender():
+        while not done.is_set():
+            time_start = time.perf_counter()
+            with r.task_lock:
+                waits.append(time.perf_counter() - time_start)
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=contender, daemon=True)
+    thread.start()
+    time_start = time.perf_counter()
+    r.flush(for_s=1)
+    duration_s = time.perf_counter() - time_start
+    done.set()
+    thread.join(5)
+    assert duration_s < 1.5
+    assert runs[0] > 0
+    assert len(waits) > 100
+    assert max(waits) < 0.25
+
+
+def test_coroutine_tasks():
+    """
+    Coroutines returned by sent, enqueued and looping tasks all run to completion
+    """
+    r = asyncio_reactor.AsyncioReactor()
+    done = []
+
+    async def sent():
+        await asyncio.sleep(0.01)
+        done.append("sent")
+
+    async def enqueued():
+        await asyncio.sleep(0.01)
+        done.append("enqueued")
+
+    async def looping():
+        await asyncio.sleep(0.01)
+        done.append("looping")
+
+    r.send_task(sent)
+    r.enqueue(enqueued, future_s=0.05)
+    r.enqueue_looping(looping, period_s=0.1)
+    r.flush(for_s=0.55)
+    r.enqueue_looping(looping, period_s=None)
+    r.flush(for_s=0.1)
+    assert done.count("sent") == 1
+    assert done.count("enqueued") == 1
+    # requeued on every iteration
+    assert 4 <= done.count("looping") <= 6
+
+
+def test_serial_async_blocks():
+    """
+    Serial block functions may be async def, awaiting their remainder
+    """
+    ctree_root = ctree.ConfigTreeRoot()
+    ctree_root.config_load_recursive(
+        dict(reactor_type="asyncio", settings={"time_convention": "UNIX"})
+    )
+    root = autocas.InstaCAS(
+        prefix_base="X1",
+        prefix_subsystem="TEST",
+        module_name="x1test",
+        ctree_root=ctree_root,
+    )
+    conn = serial_base.SerialConnection(parent=root, name="serial")
+    calls = []
+
+    async def outer(cmd):
+        calls.append("outer")
+        await asyncio.sleep(0.01)
+        await cmd.block_remainder()
+        calls.append("outer done")
+
+    def inner(cmd):
+        calls.append("inner")
+
+    block_outer = conn.block_add(outer)
+    block_inner = conn.block_add(inner, parent=block_outer)
+    block_inner()
+    root.reactor.flush(for_s=1)
+    assert calls == ["outer", "inner", "outer done"]
+    assert not conn.rb_running.value
@@ -0,0 +1,239 @@
+"""
+Scheduling regression tests of the Reactor, run on the virtual clock of the
+SimulatedReactor so that days of looping tasks, rate limits and wall-clock steps
+are checked in well under a second each:
+
+    pytest test/reactor -s
+"""
+import time
+
+import pytest
+
+from wavestate.epics.autocas.cascore import simulated_reactor
+from wavestate.epics.autocas.cascore import relay_throttle
+
+# a wall-clock start which is not on any period boundary
+MTIME_START = 1700000000.25
+
+
+@pytest.fixture
+def sim():
+    return simulated_reactor.SimulatedReactor(mtime_start=MTIME_START)
+
+
+def looping_times(sim, period_s, **kwargs):
+    times = []
+
+    def loop():
+        times.append(sim.time())
+
+    sim.enqueue_looping(loop, period_s=period_s, **kwargs)
+    return loop, times
+
+
+def test_looping_day(sim):
+    skips = []
+    loop, times = looping_times(sim, 10, skip_cb=lambda: skips.append(sim.time()))
+    sim.flush(for_s=24 * 3600)
+    assert len(times) == 24 * 360
+    # aligned to the wall-clock period boundaries
+    assert times[0] == pytest.approx(1700000010)
+    for t in times:
+        assert t % 10 == pytest.approx(0, abs=1e-5)
+    for t1, t2 in zip(times[:-1], times[1:]):
+        assert t2 - t1 == pytest.approx(10)
+    assert not skips
+    assert sim.loop_jitters()[loop].max == 0
+
+
+def test_looping_stop(sim):
+    loop, times = looping_times(sim, 1)
+    sim.flush(for_s=10)
+    assert len(times) == 10
+    sim.enqueue_looping(loop, period_s=None)
+    sim.flush(for_s=10)
+    assert len(times) == 10
+    assert loop not in sim.loop_jitters()
+
+
+def test_looping_skip(sim):
+    skips = []
+    times = []
+
+    def loop():
+        times.append(sim.time())
+        if len(times) == 5:
+            sim.sleep(2.5)
+
+    sim.enqueue_looping(loop, period_s=1, skip_cb=lambda: skips.append(sim.time()))
+    sim.flush(for_s=10)
+    # the run queued before the slow one runs late, then the missed periods are
+    # skipped once rather than run in a burst
+    assert len(skips) == 1
+    intervals = [t2 - t1 for t1, t2 in zip(times[:-1], times[1:])]
+    assert intervals[4] == pytest.approx(2.5)
+    assert intervals[5] == pytest.approx(0.5)
+    assert all(dt == pytest.approx(1) for dt in intervals[6:])
+    assert sim.loop_jitters()[loop].max == pytest.approx(1.5)
+
+
+def test_looping_jitter(sim):
+    loop, times = looping_times(sim, 1)
+    # a task holding the reactor across the deadline of a run delays it
+    sim.enqueue(lambda: sim.sleep(0.3), mtime_at=1700000004.9)
+    sim.flush(for_s=10)
+    jitter = sim.loop_jitters()[loop]
+    assert jitter.count == len(times)
+    assert jitter.max == pytest.approx(0.2)
+
+
+@pytest.mark.parametrize("step_s", [3600.3, -3600.3, 0.7, -0.7])
+def test_looping_wall_step(sim, step_s):
+    skips = []
+    loop, times = looping_times(sim, 1, skip_cb=lambda: skips.append(sim.time()))
+    sim.flush(for_s=10.5)
+    N_before = len(times)
+    sim.step_time(step_s)
+    sim.flush(for_s=10)
+    # neither a burst of runs nor a stall
+    assert len(times) - N_before in (9, 10, 11)
+    # the run queued before the step keeps its deadline, then the loop is phase
+    # locked again to the stepped wall clock
+    times_after = times[N_before + 1 :]
+    intervals = [t2 - t1 for t1, t2 in zip(times_after[:-1], times_after[1:])]
+    assert all(dt == pytest.approx(1) for dt in intervals)
+    for t in times_after:
+        assert (t + 0.5) % 1 - 0.5 == pytest.approx(0, abs=1e-5)
+    assert len(skips) <= 1
+
+
+def test_enqueue_timing(sim):
+    runs = []
+    sim.enqueue(lambda: runs.append(("future", sim.time())), key="f", future_s=2)
+    sim.enqueue(
+        lambda: runs.append(("at", sim.time())), key="a", mtime_at=MTIME_START + 1
+    )
+    sim.enqueue(lambda: runs.append(("modulo", sim.time())), key="m", modulo_s=60)
+    sim.flush(for_s=100)
+    assert [name for name, t in runs] == ["at", "future", "modulo"]
+    assert runs[0][1] == pytest.approx(MTIME_START + 1)
+    assert runs[1][1] == pytest.approx(MTIME_START + 2)
+    assert runs[2][1] == pytest.approx(1700000040)
+
+
+def test_enqueue_earlier(sim):
+    runs = []
+
+    def task():
+        runs.append(sim.time())
+
+    sim.enqueue(task, future_s=10)
+    # only moves the queued task earlier
+    sim.enqueue(task, future_s=5)
+    sim.enqueue(task, future_s=7)
+    sim.flush(for_s=20)
+    assert runs == [pytest.approx(MTIME_START + 5)]
+
+
+def test_enqueue_limit(sim):
+    runs = []
+
+    def limited():
+        runs.append(sim.time())
+
+    def requester():
+        sim.enqueue(limited, future_s=0, limit_s=5)
+
+    sim.enqueue_looping(requester, period_s=1)
+    sim.flush(for_s=60)
+    assert len(runs) >= 11
+    for t1, t2 in zip(runs[:-1], runs[1:]):
+        assert t2 - t1 == pytest.approx(5)
+
+
+def test_flush(sim):
+    sim.flush(for_s=12.5)
+    assert sim.time() == pytest.approx(MTIME_START + 12.5)
+    sim.flush(modulo_s=3600)
+    assert sim.time() % 3600 == pytest.approx(0, abs=1e-5)
+    mtime_to = sim.time() + 100
+    sim.flush(mtime_to=mtime_to)
+    assert sim.time() == pytest.approx(mtime_to)
+    # without a time, only flushes what is ready and leaves the clock
+    sim.enqueue(lambda: None, future_s=50)
+    sim.flush()
+    assert sim.time() == pytest.approx(mtime_to)
+
+
+def test_send_task_run_at(sim):
+    runs = []
+    sim.send_task(lambda: runs.append(sim.time()), run_at=MTIME_START + 30)
+    sim.send_task(lambda: runs.append(sim.time()))
+    sim.flush(for_s=60)
+    assert runs == [pytest.approx(MTIME_START), pytest.approx(MTIME_START + 30)]
+
+
+def test_throttle(sim):
+    delivered = []
+    throttle = relay_throttle.RelayThrottle(
+        sim, lambda v: delivered.append((sim.time(), v)), max_rate_hz=2
+    )
+    values = iter(range(1000))
+
+    def update():
+        throttle(next(values))
+
+    sim.enqueue_looping(update, period_s=0.05)
+    sim.flush(for_s=10)
+    sim.enqueue_looping(update, period_s=None)
+    sim.flush(for_s=10)
+    # limited to the rate, but the last update is always delivered
+    assert 19 <= len(delivered) <= 22
+    for (t1, v1), (t2, v2) in zip(delivered[:-1], delivered[1:]):
+        assert t2 - t1 >= 0.5 - 1e-6
+    assert delivered[-1][1] == 199
+
+
+@pytest.mark.parametrize("step_s", [-3600, 3600])
+def test_throttle_wall_step(sim, step_s):
+    delivered = []
+    throttle = relay_throttle.RelayThrottle(
+        sim, lambda v: delivered.append((sim.clock(), v)), max_rate_hz=1, deadband=1
+    )
+    throttle(0)
+    sim.flush(for_s=0.5)
+    sim.step_time(step_s)
+    # held by the rate
+    throttle(5)
+    sim.flush(for_s=1)
+    assert delivered[-1][1] == 5
+    assert delivered[-1][0] - delivered[0][0] == pytest.approx(1)
+    # held by the deadband until settled
+    throttle(5.5)
+    sim.step_time(step_s)
+    sim.flush(for_s=2)
+    assert delivered[-1][1] == 5.5
+    assert delivered[-1][0] - delivered[1][0] == pytest.approx(1.5)
+
+
+def test_overhead(sim):
+    """
+    Reactor overhead of looping tasks, which does not wait on the virtual clock
+    """
+    N_loops = 10
+    runs = [0]
+
+    def loop():
+        runs[0] += 1
+
+    for idx in range(N_loops):
+        sim.enqueue_looping(loop, key=idx, period_s=1)
+    time_start = time.perf_counter()
+    sim.flush(for_s=3600)
+    duration_s = time.perf_counter() - time_start
+    assert runs[0] == N_loops * 3600
+    print(
+        "\n{0} runs of {1} looping tasks in {2:.2f} s: {3:.1f} us per run".format(
+            runs[0], N_loops, duration_s, 1e6 * duration_s / runs[0]
+        )
+    )
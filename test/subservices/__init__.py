@@ -0,0 +1,3 @@
+"""
+Tests of the subservices, a package so that they may import simulated_program
+"""
@@ -0,0 +1,22 @@
+"""
+Programs for the subservice tests, which run on the SimulatedReactor and are not
+started, so that the subservices may be tested without the CA libraries.
+"""
+from wavestate.epics import autocas
+from wavestate.epics.autocas.cascore import ctree
+
+
+def insta_simulated(shard_plan=None, **config):
+    """
+    An InstaCAS on the SimulatedReactor, configured by the ctree entries config
+    """
+    config.setdefault("settings", {"time_convention": "UNIX"})
+    ctree_root = ctree.ConfigTreeRoot()
+    ctree_root.config_load_recursive(dict(reactor_type="simulated", **config))
+    return autocas.InstaCAS(
+        prefix_base="X1",
+        prefix_subsystem="TEST",
+        module_name="x1test",
+        ctree_root=ctree_root,
+        shard_plan=shard_plan,
+    )
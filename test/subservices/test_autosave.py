@@ -0,0 +1,140 @@
+"""
+Tests of the AutoSave snapshots, given a db of its own rather than a started CAS
+"""
+import os
+import time
+
+import pytest
+
+from wavestate.epics import autocas
+from wavestate.epics.autocas.cascore import ca_server_backend
+from wavestate.epics.autocas.subservices import autosave
+
+from .simulated_program import insta_simulated
+
+
+@pytest.fixture(params=[False, True], ids=["foreground", "background"])
+def saver(request, tmp_path):
+    root = insta_simulated(
+        burt=dict(
+            save_folder=str(tmp_path),
+            load_folder=str(tmp_path),
+            save_background=request.param,
+        )
+    )
+    sv = root.autosave
+    sv.rvs = {
+        "X1:TEST-A": autocas.RelayValueFloat(1.0),
+        "X1:TEST-B": autocas.RelayValueFloat(2.0),
+    }
+    db = {
+        pv: {"burt": True, "burtRO": False, "rv": rv, "remote": False}
+        for pv, rv in sv.rvs.items()
+    }
+    sv.set_db_driver(db, None)
+    return sv
+
+
+def save_wait(sv):
+    """
+    Save, waiting for the writer thread and the tasks it sends to the reactor.
+    Returns False if the save failed.
+    """
+    try:
+        sv.save_snap_rolling()
+    except OSError:
+        return False
+    if not sv.save_background:
+        return True
+    time_end = time.time() + 10
+    while sv._save_job is not None or not os.path.exists(sv.load_fpath):
+        assert time.time() < time_end
+        time.sleep(0.01)
+    time.sleep(0.05)
+    sv.reactor.flush()
+    return sv._last_savepath is not None
+
+
+def load_values(sv):
+    with open(sv.load_fpath) as F:
+        PV_vals, ROPV_vals = autocas.subservices.autosave_base.snap_parse(F)
+    return PV_vals
+
+
+def test_save(saver):
+    assert save_wait(saver)
+    assert load_values(saver) == {"X1:TEST-A": "1.0", "X1:TEST-B": "2.0"}
+    saver.rvs["X1:TEST-B"].value = 3.0
+    assert save_wait(saver)
+    assert load_values(saver)["X1:TEST-B"] == "3.0"
+
+
+def test_save_failed(saver):
+    assert save_wait(saver)
+    saver.rvs["X1:TEST-A"].value = 5.0
+    # a directory in the way of the temporary file fails the next write
+    fbase, fext = os.path.splitext(saver._last_savepath)
+    fpath_temp = fbase + "_temp" + fext
+    os.mkdir(fpath_temp)
+    assert not save_wait(saver)
+    assert saver.snap_changed()
+    os.rmdir(fpath_temp)
+    assert save_wait(saver)
+    assert load_values(saver)["X1:TEST-A"] == "5.0"
+
+
+@pytest.mark.parametrize("program", ["gzip", "bzip2", "xz"])
+def test_rollover_compressed(tmp_path, program):
+    """
+    Rolled over snapshots are compressed in-process, and load back through snap_open
+    """
+    root = insta_simulated(
+        burt=dict(
+            save_folder=str(tmp_path),
+            load_folder=str(tmp_path),
+            save_background=False,
+            zip_rollover_program=program,
+        )
+    )
+    sv = root.autosave
+    rvs = {
+        "X1:TEST-A": autocas.RelayValueFloat(1.0),
+        "X1:TEST-S": autocas.RelayValueString("with spaces"),
+    }
+    db = {
+        pv: dict(
+            rv=rv,
+            type="string" if isinstance(rv, autocas.RelayValueString) else "float",
+            interaction="setting",
+            burt=True,
+            burtRO=False,
+            remote=False,
+            deferred=False,
+        )
+        for pv, rv in rvs.items()
+    }
+    driver = ca_server_backend.CADriverServer(
+        db, root.reactor, deferred_write_period=None
+    )
+    sv.set_db_driver(db, driver)
+
+    assert save_wait(sv)
+    fpath_first = sv._last_savepath
+    rvs["X1:TEST-A"].value = 2.0
+    root.reactor.sleep(sv.rollover_rate_s)
+    assert save_wait(sv)
+    assert sv._last_savepath != fpath_first
+
+    fpath_zip = fpath_first + autosave.zip_suffixes[program]
+    time_end = time.time() + 10
+    while os.path.exists(fpath_first) or not os.path.exists(fpath_zip):
+        assert time.time() < time_end
+        time.sleep(0.01)
+    with autosave.snap_open(fpath_zip) as F:
+        PV_vals, ROPV_vals = autosave.autosave_base.snap_parse(F)
+    assert PV_vals == {"X1:TEST-A": "1.0", "X1:TEST-S": "with spaces"}
+
+    rvs["X1:TEST-S"].value = "changed"
+    sv.load_snap_file(fpath_zip)
+    assert rvs["X1:TEST-A"].value == 1.0
+    assert rvs["X1:TEST-S"].value == "with spaces"
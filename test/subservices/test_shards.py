@@ -0,0 +1,145 @@
+"""
+Tests of the ShardSupervisor on the SimulatedReactor, with stand-in worker processes
+which only send a report, and of the snapshot merge of the shards
+"""
+import os
+import sys
+import time
+from os import path
+
+import pytest
+
+from wavestate.epics.autocas.cascore import shard
+from wavestate.epics.autocas.subservices import autosave
+from wavestate.epics.autocas.subservices import autosave_base
+
+from .simulated_program import insta_simulated
+
+# reports as a worker would, then waits to be terminated by the supervisor
+WORKER_SCRIPT = """
+import os, sys, json, time
+shard = sys.argv[sys.argv.index("--shard") + 1]
+fd = int(sys.argv[sys.argv.index("--shard-fd") + 1])
+report = dict(
+    shard=shard,
+    reactor_latency_ms=50.0,
+    reactor_fill=3,
+    PVs_hosted=7,
+    burt_fpath=None,
+)
+os.write(fd, (json.dumps(report) + "\\n").encode("utf-8"))
+time.sleep(60)
+"""
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    plan = shard.ShardPlan(
+        shard.shards_parse(["pumps", "lasers"]),
+        module_name="x1test",
+        argv=[sys.executable, "-c", WORKER_SCRIPT],
+        argv_command=[],
+    )
+    root = insta_simulated(
+        shard_plan=plan,
+        burt=dict(save_folder=str(tmp_path), load_folder=str(tmp_path)),
+    )
+    sup = root.shard_service
+    yield sup
+    sup.workers_stop()
+
+
+def test_workers_report(supervisor):
+    sup = supervisor
+    reactor = sup.reactor
+    # the workers are started by the reactor
+    reactor.flush()
+    mtime_end = time.monotonic() + 20
+    while any(w.report is None for w in sup.workers.values()):
+        assert time.monotonic() < mtime_end
+        time.sleep(0.05)
+        reactor.flush()
+    sup._workers_check()
+    assert sup.rv_shards_up.value == 2
+    assert sup.rv_shards_down.value == ""
+    assert sup.rv_reactor_latency_ms.value == 50.0
+    assert sup.rv_reactor_fill.value >= 3
+    assert sup.rv_PVs_hosted.value == len(sup.root.rv_db) + 14
+
+    # exited workers are down, and restarted after restart_delay_s
+    proc = sup.workers["pumps"].proc
+    proc.terminate()
+    proc.wait(5)
+    sup._workers_check()
+    assert sup.rv_shards_up.value == 1
+    assert sup.rv_shards_down.value == "pumps"
+    assert sup.workers["pumps"].proc is None
+    sup.workers["pumps"].mtime_exit -= sup.restart_delay_s
+    sup._workers_check()
+    assert sup.workers["pumps"].proc is not None
+    assert sup.rv_restarts.value == 1
+
+
+def snap_save(fpath, PV_vals):
+    with open(fpath, "w") as F:
+        autosave_base.snap_write(F, PV_vals)
+
+
+def test_merge(supervisor, tmp_path):
+    sup = supervisor
+    saver = sup.root.autosave
+    snap_save(saver.load_fpath, {"X1:TEST-A": 1.0, "X1:TEST-B": 2.0})
+    snap_save(
+        path.join(str(tmp_path), saver.load_fname.format(modname="x1test_pumps")),
+        {"X1:TEST-PUMPS_P": 3.0},
+    )
+    # the snapshot of the lasers shard does not exist yet
+    fpath_merge = path.join(str(tmp_path), "x1test_shards.snap")
+
+    def merge():
+        sup.burt_merge()
+        sup._merge_thread.join(10)
+        # the merge time is updated by the reactor
+        sup.reactor.flush()
+
+    merge()
+    with autosave.snap_open(fpath_merge) as F:
+        PV_vals, ROPV_vals = autosave_base.snap_parse(F)
+    assert {k: float(v) for k, v in PV_vals.items()} == {
+        "X1:TEST-A": 1.0,
+        "X1:TEST-B": 2.0,
+        "X1:TEST-PUMPS_P": 3.0,
+    }
+
+    # only rewritten once a snapshot changes
+    mtime_merge = os.stat(fpath_merge).st_mtime_ns
+    merge()
+    assert os.stat(fpath_merge).st_mtime_ns == mtime_merge
+    snap_save(
+        path.join(str(tmp_path), saver.load_fname.format(modname="x1test_lasers")),
+        {"X1:TEST-LASERS_P": 4.0, "X1:TEST-A": 5.0},
+    )
+    merge()
+    with autosave.snap_open(fpath_merge) as F:
+        PV_vals, ROPV_vals = autosave_base.snap_parse(F)
+    assert float(PV_vals["X1:TEST-LASERS_P"]) == 4.0
+    # the shards are merged after the supervisor
+    assert float(PV_vals["X1:TEST-A"]) == 5.0
+
+
+def test_worker_fallback(tmp_path):
+    plan = shard.ShardPlan(
+        shard.shards_parse(["pumps", "lasers"]),
+        shard="pumps",
+        module_name="x1test",
+    )
+    root = insta_simulated(
+        shard_plan=plan,
+        burt=dict(save_folder=str(tmp_path), load_folder=str(tmp_path)),
+    )
+    assert root.module_name == "x1test_pumps"
+    saver = root.autosave
+    assert saver.load_fallback_fpaths == [
+        path.join(str(tmp_path), "x1test_shards.snap"),
+        path.join(str(tmp_path), saver.load_fname.format(modname="x1test")),
+    ]
@@ -0,0 +1,81 @@
+"""
+Tests of the comparison of snapshot and live channel values
+"""
+import numpy as np
+import pytest
+
+from wavestate.epics.autocas.subservices.snap_diff import (
+    snap_values_equal,
+    snap_diff,
+    snap_diff_lines,
+    value_typecast_like,
+)
+
+inf = float("inf")
+nan = float("nan")
+
+
+@pytest.mark.parametrize("rtol", [0, 1e-6])
+@pytest.mark.parametrize("atol", [0, 1e-3])
+def test_special_scalars(atol, rtol):
+    def equal(a, b):
+        return snap_values_equal(a, b, atol=atol, rtol=rtol)
+
+    assert equal(inf, inf)
+    assert equal(-inf, -inf)
+    assert equal("inf", inf)
+    assert equal("-inf", "-inf")
+    assert not equal(inf, -inf)
+    assert not equal(inf, 1e308)
+    assert not equal(1e308, inf)
+    assert equal(nan, nan)
+    assert equal("nan", nan)
+    assert not equal(nan, 1.0)
+    assert not equal(inf, nan)
+
+
+def test_special_arrays():
+    assert snap_values_equal([inf, nan, 1], np.array([inf, nan, 1]))
+    assert snap_values_equal(["inf", "nan"], ["inf", "nan"])
+    assert snap_values_equal(["-inf", "1"], np.array([-inf, 1]), rtol=1e-6)
+    assert not snap_values_equal(["inf", "1"], np.array([-inf, 1]), rtol=1e-6)
+    assert not snap_values_equal([nan, 1], [0, 1])
+
+
+def test_tolerances():
+    assert snap_values_equal("1.0", 1)
+    assert not snap_values_equal(1.0, 1.001)
+    assert snap_values_equal(1.0, 1.001, atol=1e-2)
+    assert snap_values_equal(1000.0, 1001.0, rtol=1e-2)
+    assert snap_values_equal(["1", "2"], np.array([1.0, 2.0005]), atol=1e-3)
+    assert not snap_values_equal(["1", "2"], np.array([1.0, 2.0, 3.0]))
+
+
+def test_strings():
+    assert snap_values_equal("ON", "ON")
+    assert not snap_values_equal("ON", "OFF")
+    assert not snap_values_equal("ON", 1)
+    assert not snap_values_equal(["a", "b"], [1, 2])
+
+
+def test_snap_diff():
+    diff = snap_diff(
+        {"X1:TEST-A": "1.0", "X1:TEST-B": "inf", "X1:TEST-C": "x"},
+        {"X1:TEST-A": 2.0, "X1:TEST-B": inf, "X1:TEST-D": "y"},
+    )
+    assert diff.added == {"X1:TEST-D": "y"}
+    assert diff.removed == {"X1:TEST-C": "x"}
+    assert diff.changed == {"X1:TEST-A": ("1.0", 2.0)}
+    assert snap_diff_lines(diff) == [
+        "~ X1:TEST-A 1.0 -> 2.0",
+        "- X1:TEST-C x",
+        "+ X1:TEST-D y",
+    ]
+
+
+def test_value_typecast_like():
+    assert value_typecast_like("3.0", 1) == 3
+    assert value_typecast_like("inf", 1.0) == inf
+    assert value_typecast_like(["a", "b"], "") == "a b"
+    cast = value_typecast_like(["1", "2"], np.zeros(2))
+    assert cast.dtype == float and cast.tolist() == [1.0, 2.0]
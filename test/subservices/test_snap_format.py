@@ -0,0 +1,94 @@
+"""
+Round trips of values through the BURT snapshot format of snap_write and snap_parse
+"""
+import io
+
+import numpy as np
+import pytest
+
+from wavestate.epics.autocas.subservices.autosave_base import (
+    snap_parse,
+    snap_value_format,
+    snap_write,
+)
+
+
+def round_trip(PV_vals, ROPV_vals=None):
+    F = io.StringIO()
+    snap_write(F, PV_vals, ROPV_vals, username="test", comments="round trip")
+    F.seek(0)
+    return snap_parse(F)
+
+
+@pytest.mark.parametrize(
+    "val",
+    [
+        "plain",
+        "",
+        "with spaces",
+        "  leading and trailing  ",
+        'a "quoted" word',
+        "back\\slash",
+        "\\0",
+        "\\",
+        'ends with a backslash \\',
+        "tab\tseparated",
+        "µ unicode",
+    ],
+)
+def test_string_round_trip(val):
+    PV_vals, ROPV_vals = round_trip({"X1:TEST-S": val})
+    assert PV_vals == {"X1:TEST-S": val}
+    assert ROPV_vals == {}
+
+
+@pytest.mark.parametrize("val", [0, -3, 1 << 40, 1.5, -2.25e-300, 1e300, 0.1])
+def test_number_round_trip(val):
+    PV_vals, ROPV_vals = round_trip({"X1:TEST-N": val})
+    assert type(val)(PV_vals["X1:TEST-N"]) == val
+
+
+def test_bool():
+    assert snap_value_format(True) == (1, 1)
+    assert snap_value_format(np.bool_(False)) == (1, 0)
+    PV_vals, ROPV_vals = round_trip({"X1:TEST-B": True})
+    assert PV_vals["X1:TEST-B"] == "1"
+
+
+def test_array_round_trip():
+    vals = {
+        "X1:TEST-F": np.array([1.5, -2.0, 0.1]),
+        "X1:TEST-I": [1, 2, 3, 4],
+        "X1:TEST-B": np.array([True, False]),
+    }
+    PV_vals, ROPV_vals = round_trip(vals)
+    assert [float(v) for v in PV_vals["X1:TEST-F"]] == [1.5, -2.0, 0.1]
+    assert PV_vals["X1:TEST-I"] == ["1", "2", "3", "4"]
+    assert PV_vals["X1:TEST-B"] == ["1", "0"]
+
+
+def test_RO_round_trip():
+    PV_vals, ROPV_vals = round_trip(
+        {"X1:TEST-A": "set"},
+        {"X1:TEST-R": "read only", "X1:TEST-C": 2.5},
+    )
+    assert PV_vals == {"X1:TEST-A": "set"}
+    assert ROPV_vals == {"X1:TEST-R": "read only", "X1:TEST-C": "2.5"}
+
+
+def test_parse_legacy():
+    """
+    Older snapshots wrote strings with spaces unquoted, and a bare count for empty
+    strings
+    """
+    F = io.StringIO(
+        "--- Start BURT header\n"
+        "Time:     Thu Jan  1 00:00:00 2026\n"
+        "--- End BURT header\n"
+        "X1:TEST-A 1 two words\n"
+        "X1:TEST-B 1\n"
+        "RO X1:TEST-C 1 \\0\n"
+    )
+    PV_vals, ROPV_vals = snap_parse(F)
+    assert PV_vals == {"X1:TEST-A": "two words", "X1:TEST-B": ""}
+    assert ROPV_vals == {"X1:TEST-C": ""}
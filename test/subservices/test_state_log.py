@@ -0,0 +1,154 @@
+"""
+Tests of the state log records, files and reader
+"""
+import os
+
+import numpy as np
+import pytest
+from wavestate.bunch import Bunch
+
+from wavestate.epics.autocas.subservices import state_log
+
+from .simulated_program import insta_simulated
+
+CHANNELS = ["X1:TEST-A", "X1:TEST-B", "X1:TEST-C"]
+
+
+@pytest.mark.parametrize(
+    "val",
+    [
+        1.5,
+        -7,
+        True,
+        np.float32(0.25),
+        np.int16(3),
+        "",
+        "setting µ",
+        np.array([1.5, -2.0]),
+        np.array([1, 2, 3], dtype=np.int32),
+        np.array([], dtype=float),
+    ],
+)
+def test_record_round_trip(val):
+    payload = state_log.encode_record(1700000000.5, 7, val)
+    ((ptime, cid, val_out),) = state_log.decode_records(payload)
+    assert ptime == 1700000000.5
+    assert cid == 7
+    if isinstance(val, np.ndarray):
+        np.testing.assert_array_equal(val_out, val)
+    else:
+        assert val_out == val
+        # bools are logged as ints
+        assert isinstance(val_out, (int, float, str))
+
+
+def test_records_concatenated():
+    records = [(1.0, 0, 2.5), (2.0, 1, "on"), (3.0, 2, np.arange(3.0)), (4.0, 0, 3)]
+    payload = b"".join(state_log.encode_record(*record) for record in records)
+    decoded = state_log.decode_records(payload)
+    assert [(t, cid) for t, cid, val in decoded] == [(t, cid) for t, cid, v in records]
+    assert decoded[1][2] == "on"
+    np.testing.assert_array_equal(decoded[2][2], np.arange(3.0))
+
+
+@pytest.mark.parametrize(
+    "val",
+    [
+        ["a", "b"],
+        np.array(["1", "2"]),
+        np.zeros((2, 2)),
+        None,
+    ],
+)
+def test_record_reject(val):
+    with pytest.raises(TypeError):
+        state_log.encode_record(1.0, 0, val)
+
+
+def statelog_new(tmp_path):
+    root = insta_simulated(
+        burt=dict(save_folder=str(tmp_path)),
+        statelog=dict(log_enable=True, log_folder=str(tmp_path)),
+    )
+    sl = root.statelog
+    sl._channels = CHANNELS
+    return sl
+
+
+def log_write(sl, fpath, ptime, values):
+    """
+    Write a new log as the writer thread would, starting with a keyframe of values
+    at ptime and then a change of the first channel a second later.
+    """
+    keyframe = [(ptime, cid, val) for cid, val in enumerate(values)]
+    sl._log_write(Bunch(records=[], keyframe=keyframe, fpath=fpath, ptime_start=ptime))
+    sl._log_write(
+        Bunch(records=[(ptime + 1, 0, values[0] + 1)], keyframe=None, fpath=None)
+    )
+    sl._log_file.close()
+    sl._log_index.close()
+    sl._log_file = None
+    sl._log_index = None
+
+
+def test_log_read(tmp_path):
+    fpath = str(tmp_path / "x1test_state.statelog")
+    log_write(statelog_new(tmp_path), fpath, 100, [1.0, 2, "a"])
+    reader = state_log.StateLogReader(str(tmp_path))
+    assert len(reader.files) == 1
+    assert reader.snapshot_at(100.5) == {
+        CHANNELS[0]: 1.0,
+        CHANNELS[1]: 2,
+        CHANNELS[2]: "a",
+    }
+    assert reader.value_at(CHANNELS[0], 101) == 2.0
+    assert reader.changes(0, 1000) == [(101, CHANNELS[0], 2.0)]
+
+
+def test_log_reopen(tmp_path):
+    """
+    A restarted program logging to the same file name starts a new log
+    """
+    fpath = str(tmp_path / "x1test_state.statelog")
+    log_write(statelog_new(tmp_path), fpath, 100, [1.0, 2, "a"])
+    log_write(statelog_new(tmp_path), fpath, 200, [5.0, 6, "b"])
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "x1test_state.statelog",
+        "x1test_state.statelog.idx",
+        "x1test_state_1.statelog",
+        "x1test_state_1.statelog.idx",
+    ]
+    reader = state_log.StateLogReader(str(tmp_path))
+    assert [f.ptime_start for f in reader.files] == [100, 200]
+    assert reader.snapshot_at(150)[CHANNELS[0]] == 2.0
+    assert reader.snapshot_at(250) == {
+        CHANNELS[0]: 6.0,
+        CHANNELS[1]: 6,
+        CHANNELS[2]: "b",
+    }
+    assert reader.value_at(CHANNELS[2], 150) == "a"
+    assert reader.changes(0, 1000) == [
+        (101, CHANNELS[0], 2.0),
+        (201, CHANNELS[0], 6.0),
+    ]
+
+
+def test_log_bad_value(tmp_path):
+    """
+    A value which can't be logged only drops its own record, not the chunk
+    """
+    fpath = str(tmp_path / "x1test_state.statelog")
+    sl = statelog_new(tmp_path)
+    keyframe = [(100, 0, 1.0), (100, 1, ["x", "y"]), (100, 2, "a")]
+    sl._log_write(Bunch(records=[], keyframe=keyframe, fpath=fpath, ptime_start=100))
+    records = [(101, 1, ["z"]), (101, 0, 2.0), (102, 2, "b")]
+    sl._log_write(Bunch(records=records, keyframe=None, fpath=None))
+    sl._log_file.close()
+    sl._log_index.close()
+    reader = state_log.StateLogReader(str(tmp_path))
+    assert reader.snapshot_at(100.5) == {CHANNELS[0]: 1.0, CHANNELS[2]: "a"}
+    assert reader.changes(0, 1000) == [
+        (101, CHANNELS[0], 2.0),
+        (102, CHANNELS[2], "b"),
+    ]
+    assert [c["chn"] for c in reader.files[0].chunks] == [{0, 2}, {0, 2}]
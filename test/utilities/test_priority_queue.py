@@ -0,0 +1,126 @@
+"""
+Unit tests of the IndexedPriorityQueue behind the Reactor's timed tasks
+"""
+import queue
+import random
+
+import pytest
+
+from wavestate.epics.autocas.utilities.priority_queue import IndexedPriorityQueue
+
+
+def drain(pq):
+    out = []
+    while pq:
+        out.append(pq.pop())
+    return out
+
+
+def test_push_pop_ordering():
+    pq = IndexedPriorityQueue()
+    rng = random.Random(1)
+    priorities = [rng.random() for _ in range(200)]
+    for idx, priority in enumerate(priorities):
+        pq.push(idx, priority, "item{0}".format(idx))
+    assert len(pq) == 200
+    popped = drain(pq)
+    assert [p for p, item in popped] == sorted(priorities)
+    assert pq.is_empty()
+    assert len(pq.index) == 0
+
+
+def test_initial_iterable_and_peek():
+    pq = IndexedPriorityQueue([("a", 3, "A"), ("b", 1, "B"), ("c", 2, "C")])
+    assert pq.peek() == (1, "B")
+    assert pq.peek_key() == "b"
+    # peek does not discard
+    assert len(pq) == 3
+    assert "a" in pq
+    assert pq.get("c") == (2, "C")
+    assert pq.get("z", "default") == "default"
+
+
+def test_empty():
+    pq = IndexedPriorityQueue()
+    assert not pq
+    with pytest.raises(queue.Empty):
+        pq.peek()
+    with pytest.raises(queue.Empty):
+        pq.peek_key()
+    with pytest.raises(queue.Empty):
+        pq.pop()
+
+
+def test_ties_pop_in_insertion_order():
+    pq = IndexedPriorityQueue()
+    # items which cannot be compared, to check the keys and items never are
+    items = [object() for _ in range(10)]
+    for idx, item in enumerate(items):
+        pq.push(("key", idx), 5, item)
+    assert [item for p, item in drain(pq)] == items
+
+
+def test_update_priority():
+    pq = IndexedPriorityQueue()
+    for idx in range(10):
+        pq.push(idx, idx, idx)
+    # decrease-key
+    pq.push(7, -1, "seven")
+    assert pq.peek() == (-1, "seven")
+    # increase-key
+    pq.push(7, 100, "seven later")
+    pq.push(0, 50, "zero later")
+    assert len(pq) == 10
+    assert [item for p, item in drain(pq)] == [
+        1, 2, 3, 4, 5, 6, 8, 9, "zero later", "seven later"
+    ]
+
+
+def test_update_same_priority_replaces_item():
+    pq = IndexedPriorityQueue()
+    pq.push("a", 1, "old")
+    pq.push("a", 1, "new")
+    assert len(pq) == 1
+    assert pq.pop() == (1, "new")
+
+
+def test_remove_and_discard():
+    pq = IndexedPriorityQueue()
+    for idx in range(20):
+        pq.push(idx, (idx * 7) % 20, idx)
+    assert pq.remove(3) == (1, 3)
+    assert pq.discard(4)
+    assert not pq.discard(4)
+    with pytest.raises(KeyError):
+        pq.remove(4)
+    assert 3 not in pq
+    remaining = drain(pq)
+    assert len(remaining) == 18
+    assert [p for p, item in remaining] == sorted(p for p, item in remaining)
+
+
+def test_random_operations_match_reference():
+    """
+    Random pushes, updates, removals and pops against a dictionary reference
+    """
+    rng = random.Random(2)
+    pq = IndexedPriorityQueue()
+    ref = dict()
+    for step in range(5000):
+        op = rng.random()
+        key = rng.randrange(50)
+        if op < 0.5:
+            priority = rng.randrange(100)
+            pq.push(key, priority, (key, priority))
+            ref[key] = priority
+        elif op < 0.7:
+            assert pq.discard(key) == (key in ref)
+            ref.pop(key, None)
+        elif ref:
+            priority, (pkey, ppriority) = pq.pop()
+            assert priority == ppriority == min(ref.values())
+            assert ref.pop(pkey) == priority
+        assert len(pq) == len(ref)
+        # the index always points at the entries of their keys
+        for idx, entry in enumerate(pq.heap):
+            assert pq.index[entry[2]] == idx